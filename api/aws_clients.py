@@ -0,0 +1,76 @@
+"""
+Shared boto3 client registry.
+
+boto3.client() re-reads the service model, resolves credentials and builds a
+fresh connection pool on every call, which costs tens of milliseconds per
+client. Handlers that presign a URL per material or invoke embed_query per
+message paid that cost on every call. Clients here are built once per
+(service, region, credentials) and reused across requests in a warm
+instance. boto3 clients are thread-safe, so the concurrent PageIndex tool
+workers and the chat embedding pool can share them.
+
+Optional environment variables:
+    AWS_MAX_POOL_CONNECTIONS   connections kept per client (default 16)
+"""
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+_DEFAULT_REGION = 'us-east-1'
+_ENV_REGION = object()
+
+
+def _max_pool_connections() -> int:
+    try:
+        value = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '16'))
+    except ValueError:
+        return 16
+    return max(1, min(value, 64))
+
+
+def _client_config() -> Config:
+    return Config(
+        max_pool_connections=_max_pool_connections(),
+        tcp_keepalive=True,
+        retries={'max_attempts': 3, 'mode': 'standard'},
+    )
+
+
+def get_client(service: str, region_name=_ENV_REGION):
+    """Return a cached boto3 client for service.
+
+    Credentials come from AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY. They are
+    part of the cache key, so rotated keys get a new client rather than a stale
+    one. Pass region_name explicitly (including None) to override the default
+    of AWS_REGION, then us-east-1.
+    """
+    if region_name is _ENV_REGION:
+        region_name = os.environ.get('AWS_REGION', _DEFAULT_REGION)
+    access_key = os.environ.get('AWS_ACCESS_KEY_ID')
+    secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
+    key = (service, region_name, access_key, secret_key)
+    client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            client = boto3.client(
+                service,
+                region_name=region_name,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                config=_client_config(),
+            )
+            _CLIENTS[key] = client
+        return client
+
+
+def reset_clients() -> None:
+    """Drop every cached client (tests, credential rotation)."""
+    with _CLIENTS_LOCK:
+        _CLIENTS.clear()
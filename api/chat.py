@@ -17,23 +17,23 @@ import json
 import logging
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 from uuid import uuid4
 
 try:
-    from .middleware import send_json, send_sse_headers, send_sse_event, handle_options, authenticate_request, sanitize_string, check_rate_limit
-    from .models import User
+    from .middleware import send_json, send_sse_headers, send_sse_event, handle_options, load_request_context, sanitize_string, check_rate_limit
     from .courses import Course
     from .db import get_db
-    from .llm import synthesize
+    from .llm import synthesize, collect_chat_memory_fold, summarize_chat_memory, store_chat_memory
 except ImportError:
-    from middleware import send_json, send_sse_headers, send_sse_event, handle_options, authenticate_request, sanitize_string, check_rate_limit
-    from models import User
+    from middleware import send_json, send_sse_headers, send_sse_event, handle_options, load_request_context, sanitize_string, check_rate_limit
     from courses import Course
     from db import get_db
-    from llm import synthesize
+    from llm import synthesize, collect_chat_memory_fold, summarize_chat_memory, store_chat_memory
 
 try:
     from services.query.persistence import embed_text_via_lambda, write_chat_message_embedding, embed_image_via_lambda
@@ -232,14 +232,11 @@ def _is_agentic_request(ai_provider: str, ai_model: str) -> bool:
 
 
 def _fetch_s3_bytes(s3_key: str) -> bytes:
-    import boto3
-    region = os.environ.get('AWS_REGION', 'us-east-1')
-    client = boto3.client(
-        's3',
-        region_name=region,
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-    )
+    try:
+        from .aws_clients import get_client
+    except ImportError:
+        from aws_clients import get_client
+    client = get_client('s3')
     bucket = os.environ.get('AWS_S3_BUCKET_NAME')
     obj = client.get_object(Bucket=bucket, Key=s3_key)
     return obj['Body'].read()
@@ -298,24 +295,150 @@ def embed_and_store_chat_images(conn, chat_id: int, message_id: int, image_s3_ke
     cursor.close()
 
 
+_EMBED_EXECUTOR = None
+_EMBED_EXECUTOR_LOCK = threading.Lock()
+
+
+def _embed_executor() -> ThreadPoolExecutor:
+    global _EMBED_EXECUTOR
+    with _EMBED_EXECUTOR_LOCK:
+        if _EMBED_EXECUTOR is None:
+            _EMBED_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chat-embed")
+        return _EMBED_EXECUTOR
+
+
+class _PendingMessageEmbeddings:
+    """Chat message embeddings computed off the SSE critical path.
+
+    submit() starts the embed_query Lambda call on a worker thread. Enter the
+    object ahead of get_db() (`with embeddings, get_db() as conn:`) so its exit
+    runs once the request transaction has committed: each embedding is then
+    written by a worker on its own pooled connection as soon as it arrives, and
+    the request never waits for it. Nothing is written after a rollback.
+    """
+
+    def __init__(self, action: str):
+        self.action = action
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pending, self._pending = self._pending, []
+        for message_id, future in pending:
+            if exc_type is not None:
+                future.cancel()
+                continue
+
+            def _schedule(done, message_id=message_id):
+                _embed_executor().submit(self._write, message_id, done)
+
+            future.add_done_callback(_schedule)
+        return False
+
+    def submit(self, message_id: int, text: str) -> None:
+        if not (embed_text_via_lambda and write_chat_message_embedding and text):
+            return
+        self._pending.append((message_id, _embed_executor().submit(embed_text_via_lambda, text)))
+
+    def _write(self, message_id: int, future) -> None:
+        try:
+            embedding = future.result()
+            if embedding:
+                with get_db() as conn:
+                    write_chat_message_embedding(conn, message_id, embedding)
+        except Exception:
+            logger.exception(
+                "Failed to persist message embedding (%s)", self.action,
+                extra={"message_id": message_id},
+            )
+
+
+class _PendingChatMemory:
+    """Rolling chat memory update run off the response path.
+
+    Enter the object ahead of get_db() (`with memory, get_db() as conn:`) and
+    call schedule() once the reply is inserted. After the request transaction
+    commits, a worker collects the turns that aged out of the raw history
+    window, summarizes them and stores the merged memory, each database step on
+    its own pooled connection. Nothing runs after a rollback.
+    """
+
+    def __init__(self, chat_id: int, user_id: int):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self._due = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        due, self._due = self._due, False
+        if due and exc_type is None:
+            _embed_executor().submit(self._run)
+        return False
+
+    def schedule(self) -> None:
+        self._due = True
+
+    def _run(self) -> None:
+        try:
+            with get_db() as conn:
+                fold = collect_chat_memory_fold(conn, self.user_id, self.chat_id)
+            if not fold:
+                return
+            memory = summarize_chat_memory(fold)
+            if memory:
+                with get_db() as conn:
+                    store_chat_memory(conn, fold, memory)
+        except Exception:
+            logger.exception("chat_memory_update_failed", extra={"chat_id": self.chat_id})
+
+
+def _forget_chat_memory(conn, chat_id, from_index: int) -> None:
+    """Drop the rolling memory when it covers a message that was just edited,
+    replaced or deleted; the next reply rebuilds it from the active branch."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        UPDATE chats
+        SET memory_summary = NULL,
+            memory_through_index = NULL
+        WHERE id = %s
+          AND memory_through_index >= %s
+        """,
+        (chat_id, from_index),
+    )
+    cursor.close()
+
+
 class handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
         handle_options(self)
 
     # ------------------------------------------------------------------ GET --
     def do_GET(self):
-        google_id, _ = authenticate_request(self)
-        if not google_id:
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+
+        # Most GETs are scoped to a course: check access in the auth query itself.
+        course_id_raw = params.get('course_id', [None])[0]
+        course_id = int(course_id_raw) if course_id_raw and course_id_raw.isdigit() else None
+        context = load_request_context(self, course_id=course_id)
+        if not context:
             send_json(self, 401, {"error": "Unauthorized"})
             return
 
-        user = User.get_by_google_id(google_id)
+        user = context['user']
         if not user:
             send_json(self, 404, {"error": "User not found"})
             return
-
-        parsed = urlparse(self.path)
-        params = parse_qs(parsed.query)
+        if not check_rate_limit(self, bucket='read', user_id=user['id']):
+            send_json(self, 429, {"error": "Rate limit exceeded"})
+            return
+        if course_id is not None:
+            self._checked_course_access = (course_id, context['course_access'])
 
         resource = params.get('resource', ['chat'])[0]
         q = params.get('q', [None])[0]
@@ -335,12 +458,12 @@ class handler(BaseHTTPRequestHandler):
 
     # ----------------------------------------------------------------- POST --
     def do_POST(self):
-        google_id, _ = authenticate_request(self)
-        if not google_id:
+        context = load_request_context(self)
+        if not context:
             send_json(self, 401, {"error": "Unauthorized"})
             return
 
-        user = User.get_by_google_id(google_id)
+        user = context['user']
         if not user:
             send_json(self, 404, {"error": "User not found"})
             return
@@ -373,22 +496,22 @@ class handler(BaseHTTPRequestHandler):
                 send_json(self, 400, {"error": f"Unknown action '{action}' for resource 'pin'"})
         elif resource == 'message':
             if action == 'send':
-                if not check_rate_limit(self, max_rpm=10):
+                if not check_rate_limit(self, bucket='expensive', user_id=user['id']):
                     send_json(self, 429, {"error": "Rate limit exceeded"})
                     return
                 self._send_message(user, data)
             elif action == 'stream_send':
-                if not check_rate_limit(self, max_rpm=10):
+                if not check_rate_limit(self, bucket='expensive', user_id=user['id']):
                     send_json(self, 429, {"error": "Rate limit exceeded"})
                     return
                 self._stream_send_message(user, data)
             elif action == 'edit':
-                if not check_rate_limit(self, max_rpm=10):
+                if not check_rate_limit(self, bucket='expensive', user_id=user['id']):
                     send_json(self, 429, {"error": "Rate limit exceeded"})
                     return
                 self._edit_message(user, data)
             elif action == 'stream_edit':
-                if not check_rate_limit(self, max_rpm=10):
+                if not check_rate_limit(self, bucket='expensive', user_id=user['id']):
                     send_json(self, 429, {"error": "Rate limit exceeded"})
                     return
                 self._stream_edit_message(user, data)
@@ -397,12 +520,12 @@ class handler(BaseHTTPRequestHandler):
             elif action == 'restore':
                 self._restore_message(user, data)
             elif action == 'regenerate':
-                if not check_rate_limit(self, max_rpm=10):
+                if not check_rate_limit(self, bucket='expensive', user_id=user['id']):
                     send_json(self, 429, {"error": "Rate limit exceeded"})
                     return
                 self._regenerate_message(user, data)
             elif action == 'stream_regenerate':
-                if not check_rate_limit(self, max_rpm=10):
+                if not check_rate_limit(self, bucket='expensive', user_id=user['id']):
                     send_json(self, 429, {"error": "Rate limit exceeded"})
                     return
                 self._stream_regenerate_message(user, data)
@@ -419,12 +542,12 @@ class handler(BaseHTTPRequestHandler):
 
     # --------------------------------------------------------------- DELETE --
     def do_DELETE(self):
-        google_id, _ = authenticate_request(self)
-        if not google_id:
+        context = load_request_context(self)
+        if not context:
             send_json(self, 401, {"error": "Unauthorized"})
             return
 
-        user = User.get_by_google_id(google_id)
+        user = context['user']
         if not user:
             send_json(self, 404, {"error": "User not found"})
             return
@@ -442,6 +565,13 @@ class handler(BaseHTTPRequestHandler):
         else:
             send_json(self, 400, {"error": f"Unknown resource '{resource}'"})
 
+    def _verify_course_access(self, course_id, user):
+        """Course access, reusing the check fused into the auth query when it covered course_id."""
+        checked = getattr(self, '_checked_course_access', None)
+        if checked and checked[0] == course_id:
+            return checked[1]
+        return Course.verify_access(course_id, user['id'])
+
     # ----------------------------------------------------------- GET helpers --
 
     def _list_or_search_chats(self, user, params, q):
@@ -451,7 +581,7 @@ class handler(BaseHTTPRequestHandler):
             return
         course_id = int(course_id_raw)
 
-        if not Course.verify_access(course_id, user['id']):
+        if not self._verify_course_access(course_id, user):
             send_json(self, 403, {"error": "Access denied to this course"})
             return
 
@@ -491,7 +621,7 @@ class handler(BaseHTTPRequestHandler):
             return
         course_id = int(course_id_raw)
 
-        if not Course.verify_access(course_id, user['id']):
+        if not self._verify_course_access(course_id, user):
             send_json(self, 403, {"error": "Access denied to this course"})
             return
 
@@ -590,7 +720,7 @@ class handler(BaseHTTPRequestHandler):
                 send_json(self, 400, {"error": "course_id must be an integer"})
                 return
             course_id = int(course_id_raw)
-            if not Course.verify_access(course_id, user['id']):
+            if not self._verify_course_access(course_id, user):
                 send_json(self, 403, {"error": "Access denied to this course"})
                 return
 
@@ -783,7 +913,7 @@ class handler(BaseHTTPRequestHandler):
             send_json(self, 400, {"error": "title is required"})
             return
 
-        if not Course.verify_access(course_id, user['id']):
+        if not self._verify_course_access(course_id, user):
             send_json(self, 403, {"error": "Access denied to this course"})
             return
 
@@ -870,7 +1000,7 @@ class handler(BaseHTTPRequestHandler):
             send_json(self, 400, {"error": "course_id is required"})
             return
 
-        if not Course.verify_access(course_id, user['id']):
+        if not self._verify_course_access(course_id, user):
             send_json(self, 403, {"error": "Access denied to this course"})
             return
 
@@ -918,7 +1048,9 @@ class handler(BaseHTTPRequestHandler):
             "embedding_errors": 0,
         }
 
-        with get_db() as conn:
+        # The memory fold runs after the commit and never delays the response.
+        memory = _PendingChatMemory(chat_id, user['id'])
+        with memory, get_db() as conn:
             chat = _get_chat(conn, chat_id)
             if not chat:
                 send_json(self, 404, {"error": "Chat not found"})
@@ -1095,6 +1227,7 @@ class handler(BaseHTTPRequestHandler):
             cursor.close()
             logger.info("chat_message_embedding_metrics", extra=metrics)
 
+            memory.schedule()
             suggested_title = _maybe_suggest_title(conn, chat, user['id'], next_idx)
 
         serialized_chunks = [
@@ -1146,7 +1279,11 @@ class handler(BaseHTTPRequestHandler):
             send_json(self, 400, {"error": "context_material_ids must be a list"})
             return
 
-        with get_db() as conn:
+        # Embeddings run alongside synthesis; they and the memory fold are
+        # written after the commit.
+        embeddings = _PendingMessageEmbeddings("stream_send")
+        memory = _PendingChatMemory(chat_id, user['id'])
+        with embeddings, memory, get_db() as conn:
             chat = _get_chat(conn, chat_id)
             if not chat:
                 send_json(self, 404, {"error": "Chat not found"})
@@ -1187,13 +1324,11 @@ class handler(BaseHTTPRequestHandler):
                 image_s3_keys or [],
             ))
             user_message = cursor.fetchone()
-            if embed_text_via_lambda and write_chat_message_embedding and content:
-                try:
-                    user_embedding = embed_text_via_lambda(content)
-                    if user_embedding:
-                        write_chat_message_embedding(conn, user_message['id'], user_embedding)
-                except Exception:
-                    logger.exception("Failed to persist user message embedding (stream_send)")
+            embeddings.submit(user_message['id'], content)
+
+            # All validation passed — now commit to SSE headers
+            send_sse_headers(self)
+            send_sse_event(self, {"type": "user_message", "message": dict(user_message)})
 
             if image_s3_keys_with_filenames:
                 try:
@@ -1201,10 +1336,6 @@ class handler(BaseHTTPRequestHandler):
                 except Exception:
                     logger.exception("Failed to embed chat images (stream_send)")
 
-            # All validation passed — now commit to SSE headers
-            send_sse_headers(self)
-            send_sse_event(self, {"type": "user_message", "message": dict(user_message)})
-
             chunks = []
 
             # Check if the prior assistant message has a pending clarification.
@@ -1285,15 +1416,10 @@ class handler(BaseHTTPRequestHandler):
                 context_token_count, response_token_count,
             ))
             assistant_message = cursor.fetchone()
-            if embed_text_via_lambda and write_chat_message_embedding:
-                try:
-                    assistant_embedding = embed_text_via_lambda(assistant_content)
-                    if assistant_embedding:
-                        write_chat_message_embedding(conn, assistant_message['id'], assistant_embedding)
-                except Exception:
-                    logger.exception("Failed to persist assistant message embedding (stream_send)")
+            embeddings.submit(assistant_message['id'], assistant_content)
             cursor.close()
 
+            memory.schedule()
             suggested_title = _maybe_suggest_title(conn, chat, user['id'], next_idx)
 
             send_sse_event(self, {
@@ -1551,6 +1677,7 @@ class handler(BaseHTTPRequestHandler):
                       AND message_index >= %s
                       AND is_deleted = FALSE
                 """, (msg['chat_id'], msg['message_index'] + 1))
+                _forget_chat_memory(conn, msg['chat_id'], msg['message_index'])
 
                 next_idx = _next_message_index(conn, msg['chat_id'])
 
@@ -1757,6 +1884,7 @@ class handler(BaseHTTPRequestHandler):
                 """,
                 (msg['chat_id'], msg['message_index'])
             )
+            _forget_chat_memory(conn, msg['chat_id'], user_msg['message_index'])
 
             next_idx = _next_message_index(conn, msg['chat_id'])
 
@@ -1947,6 +2075,7 @@ class handler(BaseHTTPRequestHandler):
                 """,
                 (msg['chat_id'], msg['message_index'])
             )
+            _forget_chat_memory(conn, msg['chat_id'], user_msg['message_index'])
 
             next_idx = _next_message_index(conn, msg['chat_id'])
 
@@ -2223,6 +2352,7 @@ class handler(BaseHTTPRequestHandler):
                     """,
                     (msg['chat_id'], msg['message_index'])
                 )
+                _forget_chat_memory(conn, msg['chat_id'], msg['message_index'])
 
                 next_idx = _next_message_index(conn, msg['chat_id'])
 
@@ -2385,6 +2515,7 @@ class handler(BaseHTTPRequestHandler):
                   AND message_index IN (%s, %s)
                   AND is_deleted = FALSE
             """, (msg['chat_id'], msg['message_index'], msg['message_index'] + 1))
+            _forget_chat_memory(conn, msg['chat_id'], msg['message_index'])
             cursor.close()
 
         send_json(self, 200, {"success": True})
@@ -2398,7 +2529,7 @@ class handler(BaseHTTPRequestHandler):
             return
         course_id = int(course_id_raw)
 
-        if not Course.verify_access(course_id, user['id']):
+        if not self._verify_course_access(course_id, user):
             send_json(self, 403, {"error": "Access denied to this course"})
             return
 
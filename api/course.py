@@ -71,8 +71,7 @@ class handler(BaseHTTPRequestHandler):
                 send_json(self, 404, {"error": "Course not found"})
                 return
 
-            co_creators = course.get('co_creator_ids') or []
-            if course['primary_creator'] != user['id'] and user['id'] not in co_creators:
+            if course['primary_creator'] != user['id'] and not Course.verify_access(course_id, user['id']):
                 send_json(self, 403, {"error": "Access denied"})
                 return
 
@@ -88,16 +88,19 @@ class Course:
             cursor = conn.cursor()
             
             if include_co_created:
-                # Use JSONB containment operator to check co_creator_ids
+                # Owned courses plus memberships; each side is one index scan
                 query = """
                     SELECT c.*, uco.opened_at AS user_last_opened_at
                     FROM courses c
                     LEFT JOIN user_course_opens uco
                       ON uco.course_id = c.id AND uco.user_id = %s
-                    WHERE c.primary_creator = %s
-                       OR c.co_creator_ids @> %s::jsonb
+                    WHERE c.id IN (
+                        SELECT id FROM courses WHERE primary_creator = %s
+                        UNION
+                        SELECT course_id FROM course_members WHERE user_id = %s
+                    )
                 """
-                params = [creator_id, creator_id, json.dumps([creator_id])]
+                params = [creator_id, creator_id, creator_id]
             else:
                 query = """
                     SELECT c.*, uco.opened_at AS user_last_opened_at
@@ -351,12 +354,18 @@ class Course:
         """
         with get_db() as conn:
             cursor = conn.cursor()
+            # `jsonb - text` only removes string elements; ids are stored as numbers.
             cursor.execute("""
                 UPDATE courses
-                SET co_creator_ids = co_creator_ids - %s::text
+                SET co_creator_ids = COALESCE((
+                        SELECT jsonb_agg(e.value)
+                        FROM jsonb_array_elements(co_creator_ids) AS e(value)
+                        WHERE e.value <> to_jsonb(%s::int)
+                          AND e.value <> to_jsonb(%s::text)
+                    ), '[]'::jsonb)
                 WHERE id = %s
                 RETURNING *
-            """, (str(user_id), course_id))
+            """, (user_id, str(user_id), course_id))
             
             course = cursor.fetchone()
             cursor.close()
@@ -454,7 +463,7 @@ class Course:
     @staticmethod
     def verify_access(course_id: int, user_id: int) -> bool:
         """
-        Check if a user has access to a course (is creator or co-creator).
+        Check if a user has access to a course (is creator or a course member).
         
         Args:
             course_id: ID of the course
@@ -466,10 +475,14 @@ class Course:
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT id FROM courses
-                WHERE id = %s
-                  AND (primary_creator = %s OR co_creator_ids @> %s::jsonb)
-            """, (course_id, user_id, json.dumps([user_id])))
+                SELECT c.id FROM courses c
+                WHERE c.id = %s
+                  AND (c.primary_creator = %s
+                       OR EXISTS (
+                           SELECT 1 FROM course_members cm
+                           WHERE cm.course_id = c.id AND cm.user_id = %s
+                       ))
+            """, (course_id, user_id, user_id))
             
             result = cursor.fetchone()
             cursor.close()
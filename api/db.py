@@ -26,10 +26,14 @@ def _get_pool():
 
 
 @contextmanager
-def get_db():
-    """Context manager for database connections from the pool."""
+def get_db(timeout=None):
+    """Context manager for database connections from the pool.
+
+    timeout caps the wait for a free connection (seconds); None keeps the
+    pool's default.
+    """
     pool = _get_pool()
-    with pool.connection() as conn:
+    with pool.connection(timeout=timeout) as conn:
         try:
             yield conn
             conn.commit()
@@ -134,6 +138,7 @@ def init_db():
             CREATE INDEX IF NOT EXISTS idx_course_members_course_id ON course_members(course_id);
             CREATE INDEX IF NOT EXISTS idx_course_members_user_id ON course_members(user_id);
             CREATE INDEX IF NOT EXISTS idx_course_members_course_role ON course_members(course_id, role);
+            CREATE INDEX IF NOT EXISTS idx_courses_primary_creator ON courses(primary_creator);
 
             CREATE TABLE IF NOT EXISTS chats (
                 id SERIAL PRIMARY KEY,
@@ -333,7 +338,27 @@ def init_db():
         # Add new columns to existing tables (idempotent)
         cursor.execute("ALTER TABLE materials ADD COLUMN IF NOT EXISTS doc_type TEXT NOT NULL DEFAULT 'general';")
         cursor.execute("ALTER TABLE materials ADD COLUMN IF NOT EXISTS outsourced_url TEXT;")
+        cursor.execute("ALTER TABLE materials ADD COLUMN IF NOT EXISTS s3_key TEXT;")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_materials_s3_key
+                ON materials (s3_key)
+                WHERE s3_key IS NOT NULL;
+        """)
         cursor.execute("ALTER TABLE chats ADD COLUMN IF NOT EXISTS session_uuid UUID NOT NULL DEFAULT gen_random_uuid();")
+        cursor.execute("ALTER TABLE chats ADD COLUMN IF NOT EXISTS memory_summary TEXT;")
+        cursor.execute("ALTER TABLE chats ADD COLUMN IF NOT EXISTS memory_through_index INTEGER;")
+
+        # Shared token buckets for check_rate_limit; disposable, so UNLOGGED.
+        cursor.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+                bucket_key TEXT PRIMARY KEY,
+                tokens DOUBLE PRECISION NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_updated
+                ON rate_limit_buckets(updated_at);
+        """)
 
         # Phase 1 migration: message embeddings for conversation grounding (Phase 2)
         cursor.execute("""
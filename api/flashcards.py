@@ -13,14 +13,14 @@ from http.server import BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlparse
 
 try:
-    from .middleware import send_json, handle_options, authenticate_request, get_cors_headers
+    from .middleware import send_json, handle_options, authenticate_request, get_cors_headers, check_rate_limit
     from .models import User
     from .courses import Course
     from .db import get_db
     from .services.flashcards_token_estimator import estimate_flashcards_token_ranges
     from .services.flashcards_pdf_builder import build_flashcards_pdf_bytes
 except ImportError:
-    from middleware import send_json, handle_options, authenticate_request, get_cors_headers
+    from middleware import send_json, handle_options, authenticate_request, get_cors_headers, check_rate_limit
     from models import User
     from courses import Course
     from db import get_db
@@ -353,6 +353,9 @@ class handler(BaseHTTPRequestHandler):
         if action == 'estimate':
             self._estimate(body, user)
         elif action == 'generate':
+            if not check_rate_limit(self, bucket='expensive', user_id=user['id']):
+                send_json(self, 429, {'error': 'Rate limit exceeded'})
+                return
             self._generate(body, user)
         elif action == 'save_artifact':
             self._save_artifact(body, user)
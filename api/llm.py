@@ -12,12 +12,17 @@ Phase 2 (agentic loop): Each provider's tool-calling format will extend this mod
   - Gemini:  tools with function_declarations + FunctionCall/FunctionResponse
 """
 
+import hashlib
 import json
 import logging
 import mimetypes
 import os
 import re
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from uuid import UUID
 
 import requests
@@ -48,23 +53,22 @@ def _raise_for_status_verbose(response) -> None:
 
 try:
     from .crypto_utils import decrypt_api_key
+    from . import provider_http
 except ImportError:
     from crypto_utils import decrypt_api_key
+    import provider_http
 
 
 def _fetch_images_as_base64(s3_keys: list) -> list:
     """Fetch S3 images and return list of (mime_type, base64_data) tuples."""
     import base64
 
-    import boto3
+    try:
+        from .aws_clients import get_client
+    except ImportError:
+        from aws_clients import get_client
 
-    region = os.environ.get("AWS_REGION", "us-east-1")
-    client = boto3.client(
-        "s3",
-        region_name=region,
-        aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
-        aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
-    )
+    client = get_client("s3")
     bucket = os.environ.get("AWS_S3_BUCKET_NAME")
     result = []
     for key in s3_keys or []:
@@ -266,6 +270,12 @@ _CONVERSATION_HISTORY_NOTICE = (
     "pronouns. Respond only to the most recent user message."
 )
 
+_CONVERSATION_MEMORY_NOTICE = (
+    "**Conversation memory**: Earlier turns of this chat, condensed. The messages that "
+    "follow continue from where it ends. Treat it as what was already discussed, not as "
+    "course evidence or a question to answer.\n\n"
+)
+
 
 _SUMMARY_MAX_LEN = 200
 
@@ -600,6 +610,18 @@ def _estimate_tokens(text: str) -> int:
 RESPONSE_RESERVE_TOKENS = 4096
 SAFETY_MARGIN_RATIO = 0.15
 HISTORY_CONTEXT_RATIO = 0.35
+# Keyset page size for history loads, and the share of the history budget
+# replayed verbatim before older assistant replies collapse to their summary.
+HISTORY_PAGE_SIZE = 40
+HISTORY_VERBATIM_RATIO = 0.75
+_HISTORY_SUMMARY_PREFIX = "[Earlier reply, summarized] "
+# Rolling chat memory (chats.memory_summary): after each reply, turns older
+# than the newest CHAT_MEMORY_RECENT_TURNS are folded into a compact summary,
+# at most CHAT_MEMORY_FOLD_MAX_TURNS per update so old chats catch up gradually.
+CHAT_MEMORY_RECENT_TURNS = 6
+CHAT_MEMORY_FOLD_MAX_TURNS = 20
+CHAT_MEMORY_MAX_CHARS = 3000
+_CHAT_MEMORY_TURN_CHARS = 1500
 OUTPUT_CONTEXT_RATIO = 0.05
 MIN_OUTPUT_TOKENS = 2048
 MAX_OUTPUT_TOKENS = 8192
@@ -711,20 +733,20 @@ def _normalize_page_candidates(candidates: list) -> tuple[list[dict], int]:
     return normalized, dropped
 
 
-def _get_page_content_for_materialization(
-    conn, material_id: int, pages: str
-) -> list[dict]:
-    from pageindex_retrieval import get_page_content
+def _get_page_contents_for_materialization(
+    conn, locations: list[tuple[int, int]]
+) -> dict:
+    from pageindex_retrieval import get_page_contents
 
-    return get_page_content(conn, material_id, pages)
+    return get_page_contents(conn, locations)
 
 
 def _get_page_section_summaries_for_materialization(
-    conn, material_ids: list[int]
+    conn, locations: list[tuple[int, int]]
 ) -> dict:
     from pageindex_retrieval import get_page_section_summaries
 
-    return get_page_section_summaries(conn, material_ids)
+    return get_page_section_summaries(conn, locations)
 
 
 def _format_raw_page_result(material_id: int, rows: list[dict]) -> str:
@@ -743,7 +765,7 @@ def _candidate_priority_key(candidate: dict) -> tuple[int, int]:
 
 
 def _materialize_page_candidates(
-    conn, candidates: list[dict], budget: dict
+    conn, candidates: list[dict], budget: dict, page_cache=None
 ) -> tuple[list[str], list[str], dict]:
     raw_evidence: list[str] = []
     summary_evidence: list[str] = []
@@ -763,10 +785,18 @@ def _materialize_page_candidates(
     summary_candidates: list[dict] = []
     first = True
 
-    for candidate in sorted(candidates_with_order, key=_candidate_priority_key):
-        rows = _get_page_content_for_materialization(
-            conn, candidate["material_id"], str(candidate["page"])
+    # One round trip for the whole frontier; the raw budget is applied in memory.
+    locations = [(c["material_id"], c["page"]) for c in candidates_with_order]
+    if page_cache is not None:
+        pages_by_location = page_cache.fetch(
+            locations, lambda missing: _get_page_contents_for_materialization(conn, missing)
         )
+    else:
+        pages_by_location = _get_page_contents_for_materialization(conn, locations)
+
+    for candidate in sorted(candidates_with_order, key=_candidate_priority_key):
+        row = pages_by_location.get((candidate["material_id"], candidate["page"]))
+        rows = [row] if row else []
         row_tokens = sum(
             int(
                 row.get("token_count")
@@ -786,11 +816,8 @@ def _materialize_page_candidates(
             summary_candidates.append(candidate)
         first = False
 
-    material_ids = _dedupe_preserve_order(
-        [c["material_id"] for c in summary_candidates]
-    )
     summaries_by_page = _get_page_section_summaries_for_materialization(
-        conn, material_ids
+        conn, [(c["material_id"], c["page"]) for c in summary_candidates]
     )
     summary_budget = max(0, int(budget.get("summary_tokens") or 0))
     running_tokens = 0
@@ -850,42 +877,88 @@ def _output_token_cap(model: str) -> int:
     )
 
 
-def _compose_history(prior_turns: list, budget_tokens: int) -> list:
-    """Return the newest prior turns that fit within budget_tokens, in
-    chronological (oldest->newest) order. Drops oldest turns first."""
-    kept_reversed = []
-    running = 0
-    for turn in reversed(prior_turns):  # newest first
-        cost = _estimate_tokens(turn.get("content", ""))
-        if running + cost > budget_tokens:
-            break
-        kept_reversed.append(turn)
-        running += cost
-    return list(reversed(kept_reversed))
+_HISTORY_PAGE_SQL = """
+    SELECT message_index, role, summary,
+           CASE WHEN %s AND role = 'assistant' AND COALESCE(summary, '') <> ''
+                THEN NULL ELSE content END AS content,
+           COALESCE(response_token_count, GREATEST(1, char_length(content) / 4)) AS token_count
+    FROM chat_messages
+    WHERE chat_id = %s
+      AND is_deleted = FALSE
+      AND role IN ('user', 'assistant')
+      AND message_index > %s
+      AND message_index < %s
+    ORDER BY message_index DESC
+    LIMIT %s
+"""
 
 
-def _load_chat_history(conn, chat_id, before_index) -> list:
+def _history_turn(row, compact: bool) -> tuple:
+    """Map one chat_messages row to ({"role", "content"}, token cost). Compact
+    assistant turns replay the stored summary instead of the full reply."""
+    summary = (row.get("summary") or "").strip()
+    if compact and row["role"] == "assistant" and summary:
+        text = _HISTORY_SUMMARY_PREFIX + summary
+        return {"role": "assistant", "content": text}, _estimate_tokens(text)
+    content = row.get("content") or ""
+    cost = row.get("token_count") or _estimate_tokens(content)
+    return {"role": row["role"], "content": content}, cost
+
+
+def _load_chat_history(
+    conn, chat_id, before_index, budget_tokens=None, after_index=None
+) -> list:
     """Active-branch prior turns (user + assistant), oldest->newest, excluding
     soft-deleted rows and anything at/after before_index. Returns
-    [{"role", "content"}]. reply_history undo blobs are intentionally ignored."""
+    [{"role", "content"}]. reply_history undo blobs are intentionally ignored.
+
+    Rows are read newest-first in keyset pages of HISTORY_PAGE_SIZE and costed
+    from the stored response_token_count (user rows by length in SQL), so
+    loading stops as soon as budget_tokens is spent. Once verbatim turns use
+    HISTORY_VERBATIM_RATIO of the budget, older assistant replies fall back to
+    their stored summary and later pages no longer fetch their content.
+    budget_tokens=None loads the whole branch verbatim. after_index skips
+    turns already folded into the rolling chat memory."""
     if chat_id is None or before_index is None:
         return []
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT role, content
-        FROM chat_messages
-        WHERE chat_id = %s
-          AND is_deleted = FALSE
-          AND role IN ('user', 'assistant')
-          AND message_index < %s
-        ORDER BY message_index ASC
-        """,
-        (chat_id, before_index),
+    if budget_tokens is not None and budget_tokens <= 0:
+        return []
+    verbatim_cap = (
+        None if budget_tokens is None else int(budget_tokens * HISTORY_VERBATIM_RATIO)
     )
-    rows = cursor.fetchall()
-    cursor.close()
-    return [{"role": r["role"], "content": r["content"]} for r in rows]
+    kept_reversed = []
+    running = 0
+    compact = False
+    page_before = before_index
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute(
+                _HISTORY_PAGE_SQL,
+                (
+                    compact,
+                    chat_id,
+                    -1 if after_index is None else after_index,
+                    page_before,
+                    HISTORY_PAGE_SIZE,
+                ),
+            )
+            rows = cursor.fetchall()
+            for row in rows:  # newest first
+                turn, cost = _history_turn(row, compact)
+                if not compact and verbatim_cap is not None and running + cost > verbatim_cap:
+                    compact = True
+                    turn, cost = _history_turn(row, compact)
+                if budget_tokens is not None and running + cost > budget_tokens:
+                    return list(reversed(kept_reversed))
+                kept_reversed.append(turn)
+                running += cost
+            if len(rows) < HISTORY_PAGE_SIZE:
+                break
+            page_before = rows[-1]["message_index"]
+    finally:
+        cursor.close()
+    return list(reversed(kept_reversed))
 
 
 def _build_history_turns(
@@ -896,12 +969,10 @@ def _build_history_turns(
     system_text,
     current_user_text,
     reserved_retrieval_tokens: int = 0,
+    after_index=None,
 ) -> list:
-    """Load active-branch history and trim it to the model's budget.
+    """Load active-branch history within the model's budget.
     Returns kept turns as [{"role", "content"}] in chronological order."""
-    prior = _load_chat_history(conn, chat_id, before_index)
-    if not prior:
-        return []
     window = _context_window_for(model)
     budget = _history_budget(
         window,
@@ -909,7 +980,44 @@ def _build_history_turns(
         current_user_text,
         reserved_retrieval_tokens=reserved_retrieval_tokens,
     )
-    return _compose_history(prior, budget)
+    return _load_chat_history(
+        conn, chat_id, before_index, budget_tokens=budget, after_index=after_index
+    )
+
+
+def _load_chat_memory(conn, chat_id, before_index) -> dict | None:
+    """Rolling memory for the chat as {"summary", "through_index"}, or None when
+    there is none or it already covers turns at/after before_index (an edit or
+    regenerate further back in the chat)."""
+    if chat_id is None or before_index is None:
+        return None
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT memory_summary, memory_through_index FROM chats WHERE id = %s",
+        (chat_id,),
+    )
+    row = cursor.fetchone() or {}
+    cursor.close()
+    summary = row.get("memory_summary")
+    through_index = row.get("memory_through_index")
+    if not isinstance(summary, str) or not summary.strip():
+        return None
+    if not isinstance(through_index, int) or through_index >= before_index:
+        return None
+    return {"summary": summary.strip(), "through_index": through_index}
+
+
+def _with_chat_memory(turns: list, chat_memory: dict | None) -> list:
+    """Lead the history with the rolling memory as a user turn, keeping it out
+    of the system prompt so the cached system prefix stays byte-stable. Merged
+    into the first turn when that is a user turn too, so roles still alternate."""
+    if not chat_memory:
+        return turns
+    text = _CONVERSATION_MEMORY_NOTICE + chat_memory["summary"]
+    if turns and turns[0]["role"] == "user":
+        first = {"role": "user", "content": text + "\n\n" + turns[0]["content"]}
+        return [first] + turns[1:]
+    return [{"role": "user", "content": text}] + turns
 
 
 def _shape_history_openai(turns: list) -> list:
@@ -1143,7 +1251,7 @@ def _repair_response_openai(
             "Do not provide generic course-wide summaries."
         )
     repair_messages = list(messages) + [{"role": "user", "content": prompt}]
-    response = requests.post(
+    response = provider_http.post(
         "https://api.openai.com/v1/chat/completions",
         headers={
             "Authorization": f"Bearer {api_key}",
@@ -1310,7 +1418,7 @@ def _synthesize_claude(
         ] + [{"type": "text", "text": user_message}]
     else:
         content = user_message
-    response = requests.post(
+    response = provider_http.post(
         "https://api.anthropic.com/v1/messages",
         headers={
             "x-api-key": api_key,
@@ -1371,7 +1479,7 @@ def _synthesize_openai(
             ] + [{"type": "input_text", "text": user_message}]
         else:
             user_content = user_message
-        response = requests.post(
+        response = provider_http.post(
             "https://api.openai.com/v1/responses",
             headers={
                 "Authorization": f"Bearer {api_key}",
@@ -1405,7 +1513,7 @@ def _synthesize_openai(
     }
     if _openai_chat_supports_temperature(model):
         req_body["temperature"] = 0.2
-    response = requests.post(
+    response = provider_http.post(
         "https://api.openai.com/v1/chat/completions",
         headers={
             "Authorization": f"Bearer {api_key}",
@@ -1432,7 +1540,7 @@ def _synthesize_gemini(
         ] + [{"text": user_message}]
     else:
         parts = [{"text": user_message}]
-    response = requests.post(
+    response = provider_http.post(
         f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent",
         headers={
             "x-goog-api-key": api_key,
@@ -1470,10 +1578,18 @@ def _emit_web_results(on_event, text: str, max_results: int = 3):
         emitted += 1
 
 
-def _format_routing_index_block(materials: list[dict]) -> str:
+def _format_routing_index_block(
+    materials: list[dict], detailed_material_ids: set | None = None
+) -> str:
+    """Render the planner's routing block.
+
+    With detailed_material_ids, only those materials get a summary and section
+    snippets; the rest are one-line stubs the planner expands on demand.
+    """
     if not materials:
         return "<course_materials>\n(no materials available)\n</course_materials>"
     lines = ["<course_materials>"]
+    stub_count = 0
     for m in materials:
         mid = m.get("material_id", "??")
         title = m.get("title") or ""
@@ -1481,6 +1597,10 @@ def _format_routing_index_block(materials: list[dict]) -> str:
         page_count = m.get("page_count")
         pages_str = f"{page_count}p" if page_count is not None else "?p"
         tags = ", ".join(m.get("tags") or []) or "none"
+        if detailed_material_ids is not None and mid not in detailed_material_ids:
+            lines.append(f"[{mid}] {title} | {doc_type} | {pages_str} | tags: {tags}")
+            stub_count += 1
+            continue
         summary = (m.get("summary") or "").strip().replace("\n", " ")
         if len(summary) > 240:
             summary = summary[:237] + "..."
@@ -1498,10 +1618,170 @@ def _format_routing_index_block(materials: list[dict]) -> str:
                 snippets.append(f"{page_ref}:{snip}")
             if snippets:
                 lines.append(f"  pages: {' · '.join(snippets)}")
+    if stub_count:
+        lines.append(
+            f"({stub_count} materials above are listed without summaries or page outlines; "
+            "call get_material_structure on any that look relevant to see their sections.)"
+        )
     lines.append("</course_materials>")
     return "\n".join(lines)
 
 
+# In-process tier of the routing-block cache. Keys are (course_id, scope_key,
+# version), so a version bump from the indexer simply misses and the stale entry
+# ages out of the LRU. The shared tier lives in the routing_index_cache table.
+_ROUTING_BLOCK_CACHE: "OrderedDict[tuple, str]" = OrderedDict()
+_ROUTING_BLOCK_CACHE_LOCK = threading.Lock()
+
+
+def _routing_block_cache_get(key: tuple) -> str | None:
+    with _ROUTING_BLOCK_CACHE_LOCK:
+        block = _ROUTING_BLOCK_CACHE.get(key)
+        if block is not None:
+            _ROUTING_BLOCK_CACHE.move_to_end(key)
+        return block
+
+
+def _routing_block_cache_put(key: tuple, block: str) -> None:
+    max_entries = _safe_int_env("ROUTING_INDEX_CACHE_SIZE", 64, 0, 4096)
+    with _ROUTING_BLOCK_CACHE_LOCK:
+        _ROUTING_BLOCK_CACHE[key] = block
+        _ROUTING_BLOCK_CACHE.move_to_end(key)
+        while len(_ROUTING_BLOCK_CACHE) > max_entries:
+            _ROUTING_BLOCK_CACHE.popitem(last=False)
+
+
+# Lexical pre-router state per (course_id, scope_key, version): the routing
+# materials plus their inverted index. Few large courses cross the threshold,
+# so this tier stays small.
+_ROUTING_LEXICAL_CACHE: "OrderedDict[tuple, tuple[list, dict]]" = OrderedDict()
+_ROUTING_LEXICAL_CACHE_MAX_ENTRIES = 8
+
+
+def _routing_lexical_cache_get(key: tuple) -> tuple[list, dict] | None:
+    with _ROUTING_BLOCK_CACHE_LOCK:
+        entry = _ROUTING_LEXICAL_CACHE.get(key)
+        if entry is not None:
+            _ROUTING_LEXICAL_CACHE.move_to_end(key)
+        return entry
+
+
+def _routing_lexical_cache_put(key: tuple, entry: tuple[list, dict]) -> None:
+    with _ROUTING_BLOCK_CACHE_LOCK:
+        _ROUTING_LEXICAL_CACHE[key] = entry
+        _ROUTING_LEXICAL_CACHE.move_to_end(key)
+        while len(_ROUTING_LEXICAL_CACHE) > _ROUTING_LEXICAL_CACHE_MAX_ENTRIES:
+            _ROUTING_LEXICAL_CACHE.popitem(last=False)
+
+
+def _preroute_threshold(query: str) -> int:
+    """Material count above which the routing block is narrowed per query (0 = off)."""
+    if not (query or "").strip():
+        return 0
+    return _safe_int_env("PAGEINDEX_PREROUTE_THRESHOLD", 100, 0, 100000)
+
+
+def _prerouted_routing_block(
+    materials: list[dict], lexical_index: dict, query: str, trace: dict | None
+) -> str:
+    """Routing block with the top PAGEINDEX_PREROUTE_TOP_K materials in full and
+    the rest as stubs."""
+    from pageindex_retrieval import rank_routing_materials
+
+    top_k = _safe_int_env("PAGEINDEX_PREROUTE_TOP_K", 20, 1, 1000)
+    ranked = rank_routing_materials(lexical_index, len(materials), query)
+    detailed_positions = ranked[:top_k]
+    detailed_ids = [materials[p]["material_id"] for p in detailed_positions]
+    stub_positions = sorted(ranked[top_k:])
+    ordered = [materials[p] for p in detailed_positions + stub_positions]
+    if trace is not None:
+        trace["preroute"] = {
+            "materials": len(materials),
+            "detailed": len(detailed_ids),
+            "detailed_material_ids": detailed_ids,
+        }
+    return _format_routing_index_block(ordered, set(detailed_ids))
+
+
+def _load_routing_block(
+    conn,
+    course_id,
+    material_ids: list | None,
+    query: str = "",
+    trace: dict | None = None,
+    loaded: list | None = None,
+) -> tuple[str, str]:
+    """Return (routing_block, cache_tier) where cache_tier is "memory", "shared",
+    "miss" or "preroute".
+
+    The version check and the shared-tier lookup share one query; only a miss
+    pays for loading and flattening every material's index tree. Scopes with more
+    than PAGEINDEX_PREROUTE_THRESHOLD materials get a per-query block instead
+    (see _prerouted_routing_block), built from a cached inverted index. When
+    the routing materials are in hand (a miss or a pre-routed scope) they are
+    appended to loaded, so the page prefetch can score them without a reload.
+    """
+    from pageindex_retrieval import (
+        build_routing_lexical_index,
+        get_course_routing_index,
+        get_routing_index_cache_entry,
+        routing_index_scope_key,
+        store_routing_index_cache_entry,
+    )
+
+    threshold = _preroute_threshold(query)
+    version = None
+    if course_id is not None:
+        try:
+            with conn.transaction():
+                entry = get_routing_index_cache_entry(conn, course_id, material_ids)
+            version = entry.get("version")
+        except Exception:
+            logger.warning("routing_index_cache_read_failed", exc_info=True)
+            entry = {}
+        if isinstance(version, str):
+            key = (course_id, routing_index_scope_key(material_ids), version)
+            material_count = entry.get("material_count")
+            if threshold and isinstance(material_count, int) and material_count > threshold:
+                lexical = _routing_lexical_cache_get(key)
+                if lexical is not None:
+                    materials, lexical_index = lexical
+                    if loaded is not None:
+                        loaded.extend(materials)
+                    return _prerouted_routing_block(materials, lexical_index, query, trace), "preroute"
+            else:
+                cached = _routing_block_cache_get(key)
+                if cached is not None:
+                    return cached, "memory"
+                shared = entry.get("routing_block")
+                if isinstance(shared, str):
+                    _routing_block_cache_put(key, shared)
+                    return shared, "shared"
+        else:
+            version = None
+
+    materials = get_course_routing_index(conn, course_id, material_ids)
+    if loaded is not None:
+        loaded.extend(materials)
+    if threshold and len(materials) > threshold:
+        lexical_index = build_routing_lexical_index(materials)
+        if version is not None:
+            _routing_lexical_cache_put(key, (materials, lexical_index))
+        return _prerouted_routing_block(materials, lexical_index, query, trace), "preroute"
+
+    routing_block = _format_routing_index_block(materials)
+    if version is not None:
+        _routing_block_cache_put(key, routing_block)
+        try:
+            with conn.transaction():
+                store_routing_index_cache_entry(
+                    conn, course_id, material_ids, version, routing_block
+                )
+        except Exception:
+            logger.warning("routing_index_cache_write_failed", exc_info=True)
+    return routing_block, "miss"
+
+
 def _build_pageindex_retrieval_system_context(
     routing_block: str,
     *,
@@ -1789,12 +2069,20 @@ def _parse_responses_api_output(payload: dict) -> tuple[str, list]:
     return "".join(text_parts), tool_calls
 
 
+def _prompt_cache_key(system_text: str) -> str:
+    """OpenAI prompt_cache_key for a planner prefix: requests sharing it are
+    routed to the same cache, across iterations and turns of a chat."""
+    return "pageindex-" + hashlib.sha256(system_text.encode("utf-8")).hexdigest()[:32]
+
+
 def _pageindex_call_responses(
     api_key: str,
     model: str,
     messages: list,
     tools: list | None,
     on_event,
+    prompt_cache_key: str | None = None,
+    usage: dict | None = None,
 ) -> tuple[dict, str | None]:
     """Responses API call for gpt-5+ models in the agentic loop.
     Returns the same (message_dict, finish_reason) shape as _pageindex_stream_call."""
@@ -1803,6 +2091,8 @@ def _pageindex_call_responses(
         "input": _messages_to_responses_input(messages),
         "max_output_tokens": _output_token_cap(model),
     }
+    if prompt_cache_key:
+        req_body["prompt_cache_key"] = prompt_cache_key
     if tools:
         req_body["tools"] = _tools_to_responses_format(tools)
         req_body["tool_choice"] = "auto"
@@ -1810,7 +2100,7 @@ def _pageindex_call_responses(
         # cap reasoning effort so each iteration stays fast. Synthesis (no
         # tools) keeps the model's default effort.
         req_body["reasoning"] = {"effort": "low"}
-    response = requests.post(
+    response = provider_http.post(
         "https://api.openai.com/v1/responses",
         headers={
             "Authorization": f"Bearer {api_key}",
@@ -1821,6 +2111,10 @@ def _pageindex_call_responses(
     )
     _raise_for_status_verbose(response)
     payload = response.json()
+    if usage is not None:
+        reported = payload.get("usage") or {}
+        usage["input_tokens"] = reported.get("input_tokens") or 0
+        usage["cached_tokens"] = (reported.get("input_tokens_details") or {}).get("cached_tokens") or 0
     text, tool_calls_list = _parse_responses_api_output(payload)
     if text and on_event:
         on_event({"type": "text", "chunk": text})
@@ -1837,15 +2131,26 @@ def _pageindex_stream_call(
     messages: list,
     tools: list | None,
     on_event,
+    prompt_cache_key: str | None = None,
+    usage: dict | None = None,
 ) -> tuple[dict, str | None]:
     """Stream one OpenAI call for the pageindex loop.
 
     Emits {"type": "text", "chunk": str} via on_event when the model generates
     text content (the final answer). Returns (message_dict, finish_reason)
-    with the same shape as a non-streaming choices[0]["message"].
+    with the same shape as a non-streaming choices[0]["message"]. When `usage`
+    is given it is filled with input and cached prompt token counts.
     """
     if _openai_should_use_responses_api(model):
-        return _pageindex_call_responses(api_key, model, messages, tools, on_event)
+        return _pageindex_call_responses(
+            api_key,
+            model,
+            messages,
+            tools,
+            on_event,
+            prompt_cache_key=prompt_cache_key,
+            usage=usage,
+        )
 
     req_body: dict = {
         "model": model,
@@ -1853,11 +2158,15 @@ def _pageindex_stream_call(
         "temperature": 0.2,
         "stream": True,
     }
+    if prompt_cache_key:
+        req_body["prompt_cache_key"] = prompt_cache_key
+    if usage is not None:
+        req_body["stream_options"] = {"include_usage": True}
     if tools:
         req_body["tools"] = tools
         req_body["tool_choice"] = "auto"
 
-    response = requests.post(
+    response = provider_http.post(
         "https://api.openai.com/v1/chat/completions",
         headers={
             "Authorization": f"Bearer {api_key}",
@@ -1888,6 +2197,11 @@ def _pageindex_stream_call(
             continue
         if chunk.get("error"):
             raise RuntimeError(f"OpenAI stream error: {chunk['error']}")
+        if usage is not None and chunk.get("usage"):
+            usage["input_tokens"] = chunk["usage"].get("prompt_tokens") or 0
+            usage["cached_tokens"] = (
+                chunk["usage"].get("prompt_tokens_details") or {}
+            ).get("cached_tokens") or 0
         choices = chunk.get("choices") or []
         if not choices:
             continue
@@ -2136,13 +2450,13 @@ def _format_frontier_locations(locations: list) -> str:
 
 
 def _dispatch_candidate_frontier(
-    conn, args: dict, budget: dict, grounding_refs: list
+    conn, args: dict, budget: dict, grounding_refs: list, page_cache=None
 ) -> tuple[str, dict]:
     candidates, dropped = _normalize_page_candidates(args.get("candidates") or [])
     if len(candidates) > _FRONTIER_EXPAND_CANDIDATE_THRESHOLD:
         budget = _expand_retrieval_budget(budget)
     raw_evidence, summary_evidence, materialization_meta = _materialize_page_candidates(
-        conn, candidates, budget
+        conn, candidates, budget, page_cache=page_cache
     )
     for material_id in _dedupe_preserve_order(
         materialization_meta.get("raw_material_ids") or []
@@ -2187,11 +2501,16 @@ def _dispatch_candidate_frontier(
 
 
 def _dispatch_pageindex_tool(
-    conn, name, args, course_id, grounding_refs, on_event
+    conn, name, args, course_id, grounding_refs, on_event, page_cache=None
 ) -> tuple[str, dict]:
     """Dispatch a single PageIndex tool call. Returns (tool-result text, extra trace metadata).
     Appends to grounding_refs and emits events as a side effect."""
-    from pageindex_retrieval import get_material_structure, get_page_content
+    from pageindex_retrieval import (
+        _parse_pages,
+        get_material_structure,
+        get_page_content,
+        get_page_contents,
+    )
 
     if name == "get_material_structure":
         material_id = args.get("material_id")
@@ -2199,7 +2518,14 @@ def _dispatch_pageindex_tool(
     elif name == "get_page_content":
         material_id = args.get("material_id")
         pages_spec = args.get("pages", "")
-        rows = get_page_content(conn, material_id, pages_spec)
+        if page_cache is not None and isinstance(material_id, int):
+            locations = [(material_id, page) for page in sorted(set(_parse_pages(pages_spec)))]
+            by_location = page_cache.fetch(
+                locations, lambda missing: get_page_contents(conn, missing)
+            )
+            rows = [by_location[loc] for loc in locations if loc in by_location]
+        else:
+            rows = get_page_content(conn, material_id, pages_spec)
         if rows:
             parts = [
                 f"--- Page {row['page_number']} ---\n"
@@ -2269,6 +2595,181 @@ def _dispatch_pageindex_tool(
     return str(tool_result), {}
 
 
+# Read-only tools that may run side by side within one planner turn. The
+# candidate frontier and generation proposals stay on the request thread: the
+# frontier can expand the shared retrieval budget and proposals end the loop.
+_PAGEINDEX_CONCURRENT_TOOLS = frozenset(
+    {"get_material_structure", "get_page_content", "get_related_materials", "web_search"}
+)
+
+
+def _checkout_tool_conn():
+    """Borrow a pooled connection (api/db.py) for one concurrent tool call."""
+    try:
+        from .db import get_db
+    except ImportError:
+        from db import get_db
+
+    return get_db()
+
+
+def _dispatch_pageindex_tools_concurrently(
+    conn, calls: list[tuple[str, dict]], course_id, on_event, page_cache=None
+) -> list[tuple[str, dict, list]]:
+    """Run independent PageIndex tool calls of one planner turn concurrently.
+
+    Each call gets its own pooled connection and grounding-ref list. Returns one
+    (tool-result text, trace metadata, grounding_refs) per call, in call order,
+    so the caller can reply to tool_call ids exactly as a sequential run would.
+    """
+    max_workers = min(len(calls), _safe_int_env("PAGEINDEX_TOOL_CONCURRENCY", 4, 1, 16))
+    if max_workers <= 1:
+        results = []
+        for name, args in calls:
+            refs: list = []
+            text, meta = _dispatch_pageindex_tool(
+                conn=conn,
+                name=name,
+                args=args,
+                course_id=course_id,
+                grounding_refs=refs,
+                on_event=on_event,
+                page_cache=page_cache,
+            )
+            results.append((text, meta, refs))
+        return results
+
+    event_lock = threading.Lock()
+
+    def _emit(evt):
+        with event_lock:
+            on_event(evt)
+
+    def _run(name, args):
+        refs: list = []
+        with ExitStack() as stack:
+            try:
+                worker_conn = stack.enter_context(_checkout_tool_conn())
+            except Exception as exc:
+                # psycopg serializes concurrent use of one connection, so the
+                # request connection is a safe (if slower) fallback.
+                logger.warning("pageindex_tool_conn_checkout_failed", extra={"error": str(exc)})
+                worker_conn = conn
+            text, meta = _dispatch_pageindex_tool(
+                conn=worker_conn,
+                name=name,
+                args=args,
+                course_id=course_id,
+                grounding_refs=refs,
+                on_event=_emit if on_event else None,
+                page_cache=page_cache,
+            )
+        return text, meta, refs
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pageindex-tool") as pool:
+        futures = [pool.submit(_run, name, args) for name, args in calls]
+        return [future.result() for future in futures]
+
+
+# How long a planner page fetch waits for an in-flight prefetch before going
+# to the database itself.
+_PREFETCH_WAIT_SECONDS = 1.0
+
+
+def _page_row_bytes(row: dict) -> int:
+    return len((row.get("text_content") or "").encode("utf-8"))
+
+
+class _PageCache:
+    """Per-request cache of material_page_text rows warmed by the speculative prefetch.
+
+    Hit/miss counts and wasted bytes (prefetched but never served) are kept on
+    `trace`, the prefetch entry in tool_trace, so they are reported whichever
+    provider branch returns.
+    """
+
+    def __init__(self):
+        self._rows: dict = {}
+        self._served: set = set()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.trace = {
+            "phase": "prefetch",
+            "pages": 0,
+            "hits": 0,
+            "misses": 0,
+            "hit_rate": None,
+            "wasted_bytes": 0,
+        }
+
+    def _update_trace(self) -> None:
+        looked_up = self.trace["hits"] + self.trace["misses"]
+        self.trace["hit_rate"] = round(self.trace["hits"] / looked_up, 3) if looked_up else None
+        self.trace["wasted_bytes"] = sum(
+            _page_row_bytes(row) for loc, row in self._rows.items() if loc not in self._served
+        )
+
+    def fill(self, rows: dict) -> None:
+        with self._lock:
+            self._rows.update(rows)
+            self.trace["pages"] = len(self._rows)
+            self._update_trace()
+        self._ready.set()
+
+    def fetch(self, locations: list[tuple[int, int]], load) -> dict:
+        """Return rows for `locations`, loading cache misses with load(missing)."""
+        self._ready.wait(_PREFETCH_WAIT_SECONDS)
+        with self._lock:
+            hits = {loc: self._rows[loc] for loc in locations if loc in self._rows}
+        missing = [loc for loc in locations if loc not in hits]
+        loaded = load(missing) if missing else {}
+        with self._lock:
+            self._served.update(hits)
+            self.trace["hits"] += len(hits)
+            self.trace["misses"] += len(missing)
+            self._update_trace()
+        return {**loaded, **hits}
+
+
+def _start_page_prefetch(
+    course_id, material_ids: list | None, query: str, materials: list | None = None
+) -> "_PageCache | None":
+    """Warm a per-request page cache in the background while the planner runs.
+
+    Scores routing sections against the query lexically and loads the top
+    PAGEINDEX_PREFETCH_PAGES pages on a pooled connection. Sections come from
+    the routing materials the request already loaded, else from a narrow
+    keyword query on material_sections. Disabled when unset.
+    """
+    limit = _safe_int_env("PAGEINDEX_PREFETCH_PAGES", 0, 0, 50)
+    if not limit or course_id is None or not (query or "").strip():
+        return None
+    page_cache = _PageCache()
+
+    def _warm():
+        from pageindex_retrieval import (
+            get_page_contents,
+            get_prefetch_sections,
+            rank_prefetch_pages,
+        )
+
+        rows = {}
+        try:
+            with _checkout_tool_conn() as prefetch_conn:
+                candidates = materials or get_prefetch_sections(
+                    prefetch_conn, course_id, material_ids, query
+                )
+                locations = rank_prefetch_pages(candidates, query, limit)
+                if locations:
+                    rows = get_page_contents(prefetch_conn, locations)
+        except Exception:
+            logger.warning("pageindex_prefetch_failed", exc_info=True)
+        page_cache.fill(rows)
+
+    threading.Thread(target=_warm, name="pageindex-prefetch", daemon=True).start()
+    return page_cache
+
+
 def _pageindex_tools_anthropic(tools: list) -> list:
     """Convert OpenAI-format tool dicts to Anthropic format."""
     result = []
@@ -2286,19 +2787,29 @@ def _pageindex_tools_anthropic(tools: list) -> list:
     return result
 
 
-def _pageindex_stream_call_claude(api_key, model, system, messages, tools, on_event):
+def _pageindex_stream_call_claude(
+    api_key, model, system, messages, tools, on_event, cache_prefix=False, usage=None
+):
     """One streaming Anthropic messages call. Returns (content_blocks, stop_reason).
-    Emits {"type":"text","chunk":...} for text delta events."""
+    Emits {"type":"text","chunk":...} for text delta events.
+
+    cache_prefix puts a cache_control breakpoint on the system prompt, caching
+    tools + system across planner iterations; usage (if given) is filled with
+    input and cache-read token counts."""
     body = {
         "model": model,
         "max_tokens": _output_token_cap(model),
-        "system": system,
+        "system": (
+            [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+            if cache_prefix
+            else system
+        ),
         "messages": messages,
         "stream": True,
     }
     if tools:
         body["tools"] = _pageindex_tools_anthropic(tools)
-    resp = requests.post(
+    resp = provider_http.post(
         "https://api.anthropic.com/v1/messages",
         headers={
             "x-api-key": api_key,
@@ -2339,11 +2850,21 @@ def _pageindex_stream_call_claude(api_key, model, system, messages, tools, on_ev
                 blocks[idx]["text"] += d["text"]
                 if on_event:
                     on_event({"type": "text", "chunk": d["text"]})
+        elif t == "message_start":
+            if usage is not None:
+                reported = (evt.get("message") or {}).get("usage") or {}
+                cache_read = reported.get("cache_read_input_tokens") or 0
+                usage["cached_tokens"] = cache_read
+                usage["input_tokens"] = (
+                    (reported.get("input_tokens") or 0)
+                    + cache_read
+                    + (reported.get("cache_creation_input_tokens") or 0)
+                )
         elif t == "message_delta":
             stop_reason = evt.get("delta", {}).get("stop_reason", stop_reason)
         elif t == "error":
             raise RuntimeError(f"Anthropic stream error: {evt}")
-        # ping, message_start, content_block_stop, message_stop → no-op
+        # ping, content_block_stop, message_stop → no-op
     ordered = [blocks[i] for i in sorted(blocks)]
     return ordered, stop_reason
 
@@ -2365,21 +2886,89 @@ def _pageindex_tools_gemini(tools: list) -> list:
     return [{"functionDeclarations": declarations}]
 
 
-def _pageindex_stream_call_gemini(api_key, model, system, contents, tools, on_event):
+# Explicit Gemini context caches for the planner prefix (system + tools), keyed
+# by (api key hash, model, prefix hash) -> (cachedContents name or None, expiry).
+# A failed create is remembered too, so an unsupported model is not retried on
+# every planner iteration.
+_GEMINI_CONTEXT_CACHE: "OrderedDict[tuple, tuple[str | None, float]]" = OrderedDict()
+_GEMINI_CONTEXT_CACHE_LOCK = threading.Lock()
+_GEMINI_CONTEXT_CACHE_TTL_SECONDS = 900
+_GEMINI_CONTEXT_CACHE_MAX_ENTRIES = 64
+# Below this the API rejects explicit caches; implicit caching still applies.
+_GEMINI_CONTEXT_CACHE_MIN_TOKENS = 4096
+
+
+def _gemini_cached_content(api_key: str, model: str, system: str, tools: list) -> str | None:
+    """Return a cachedContents name holding system + tools, creating it if needed."""
+    if _estimate_tokens(system) < _GEMINI_CONTEXT_CACHE_MIN_TOKENS:
+        return None
+    prefix_hash = hashlib.sha256(
+        (system + json.dumps(tools or [], sort_keys=True)).encode("utf-8")
+    ).hexdigest()
+    key = (hashlib.sha256(api_key.encode("utf-8")).hexdigest(), model, prefix_hash)
+    now = time.time()
+    with _GEMINI_CONTEXT_CACHE_LOCK:
+        entry = _GEMINI_CONTEXT_CACHE.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+    body: dict = {
+        "model": f"models/{model}",
+        "systemInstruction": {"parts": [{"text": system}]},
+        "ttl": f"{_GEMINI_CONTEXT_CACHE_TTL_SECONDS}s",
+    }
+    if tools:
+        body["tools"] = _pageindex_tools_gemini(tools)
+    name = None
+    try:
+        resp = provider_http.post(
+            f"https://generativelanguage.googleapis.com/v1beta/cachedContents?key={api_key}",
+            json=body,
+            timeout=_TIMEOUT,
+        )
+        _raise_for_status_verbose(resp)
+        name = resp.json().get("name")
+    except Exception:
+        logger.warning("gemini_context_cache_create_failed", exc_info=True)
+
+    # Expire our handle a minute early so we never send a cache the API dropped.
+    expires = now + _GEMINI_CONTEXT_CACHE_TTL_SECONDS - (60 if name else 0)
+    with _GEMINI_CONTEXT_CACHE_LOCK:
+        _GEMINI_CONTEXT_CACHE[key] = (name, expires)
+        _GEMINI_CONTEXT_CACHE.move_to_end(key)
+        while len(_GEMINI_CONTEXT_CACHE) > _GEMINI_CONTEXT_CACHE_MAX_ENTRIES:
+            _GEMINI_CONTEXT_CACHE.popitem(last=False)
+    return name
+
+
+def _pageindex_stream_call_gemini(
+    api_key, model, system, contents, tools, on_event, cache_prefix=False, usage=None
+):
     """One streaming Gemini generateContent call. Returns (parts, has_function_call).
-    Emits {"type":"text","chunk":...} for text parts."""
+    Emits {"type":"text","chunk":...} for text parts.
+
+    cache_prefix serves system + tools from an explicit cachedContents entry when
+    the prefix is large enough; usage (if given) is filled with prompt and
+    cached token counts."""
     url = (
         f"https://generativelanguage.googleapis.com/v1beta/models/"
         f"{model}:streamGenerateContent?alt=sse&key={api_key}"
     )
+    cached_content = (
+        _gemini_cached_content(api_key, model, system, tools) if cache_prefix else None
+    )
     body = {
-        "system_instruction": {"parts": [{"text": system}]},
         "contents": contents,
         "generationConfig": {"maxOutputTokens": _output_token_cap(model)},
     }
-    if tools:
-        body["tools"] = _pageindex_tools_gemini(tools)
-    resp = requests.post(url, json=body, stream=True, timeout=_TIMEOUT)
+    if cached_content:
+        # System instruction and tools live in the cache and must not be resent.
+        body["cachedContent"] = cached_content
+    else:
+        body["system_instruction"] = {"parts": [{"text": system}]}
+        if tools:
+            body["tools"] = _pageindex_tools_gemini(tools)
+    resp = provider_http.post(url, json=body, stream=True, timeout=_TIMEOUT)
     _raise_for_status_verbose(resp)
     all_parts = []
     has_function_call = False
@@ -2395,6 +2984,9 @@ def _pageindex_stream_call_gemini(api_key, model, system, contents, tools, on_ev
             continue
         if evt.get("error"):
             raise RuntimeError(f"Gemini stream error: {evt['error']}")
+        if usage is not None and evt.get("usageMetadata"):
+            usage["input_tokens"] = evt["usageMetadata"].get("promptTokenCount") or 0
+            usage["cached_tokens"] = evt["usageMetadata"].get("cachedContentTokenCount") or 0
         for candidate in evt.get("candidates", []):
             for part in candidate.get("content", {}).get("parts", []):
                 all_parts.append(part)
@@ -2421,8 +3013,6 @@ def run_agent_pageindex(
     history_before_index: int | None = None,
     clarification_depth: int = 0,
 ) -> tuple:
-    from pageindex_retrieval import get_course_routing_index
-
     _validate_model_supports_images(model, image_s3_keys)
 
     # Image-only messages have no text query; give the retrieval model something to work with.
@@ -2431,17 +3021,28 @@ def run_agent_pageindex(
 
     tools = _pageindex_tool_list(web_search_enabled=web_search_enabled)
 
-    routing_materials = get_course_routing_index(
-        conn, course_id, context_material_ids or None
+    routing_trace: dict = {"phase": "routing_index"}
+    routing_materials: list = []
+    routing_block, routing_cache_tier = _load_routing_block(
+        conn, course_id, context_material_ids or None, user_message, routing_trace,
+        routing_materials,
+    )
+    routing_trace["cache"] = routing_cache_tier
+    page_cache = _start_page_prefetch(
+        course_id, context_material_ids or None, user_message, routing_materials
     )
-    routing_block = _format_routing_index_block(routing_materials)
     system_content = _build_pageindex_retrieval_system_context(
         routing_block,
         web_search_enabled=web_search_enabled,
         clarification_depth=clarification_depth,
     )
 
-    history_system_content = system_content + _CONVERSATION_HISTORY_NOTICE
+    system_content += _CONVERSATION_HISTORY_NOTICE
+    # Older turns travel as the rolling memory turn; only unfolded turns are
+    # replayed verbatim. The memory stays out of system_content so the cached
+    # prefix and its prompt_cache_key do not change as the memory grows.
+    chat_memory = _load_chat_memory(conn, chat_id, history_before_index)
+    memory_text = (_CONVERSATION_MEMORY_NOTICE + chat_memory["summary"]) if chat_memory else ""
 
     # Budget starts at the base slice; the candidate frontier auto-expands it
     # when the planner submits a broad frontier. History reserves the max slice
@@ -2453,12 +3054,12 @@ def run_agent_pageindex(
         chat_id=chat_id,
         before_index=history_before_index,
         model=model,
-        system_text=history_system_content,
+        system_text=system_content + memory_text,
         current_user_text=user_message,
         reserved_retrieval_tokens=retrieval_budget["max_tokens"],
+        after_index=chat_memory["through_index"] if chat_memory else None,
     )
-
-    system_content = history_system_content
+    _history_turns = _with_chat_memory(_history_turns, chat_memory)
 
     # Attached images travel with the first user turn. Each provider has its own
     # multimodal content shape (mirrors _synthesize_claude/openai/gemini). Prior
@@ -2486,7 +3087,24 @@ def run_agent_pageindex(
         + [current_user_message]
     )
     grounding_refs: list = []
-    tool_trace: list = []
+    tool_trace: list = [routing_trace]
+    if page_cache is not None:
+        tool_trace.append(page_cache.trace)
+    # Planner calls share a byte-identical system prefix (prompt + routing
+    # block), so each provider is asked to cache it; token counts accumulate here.
+    prompt_cache_trace = {
+        "phase": "prompt_cache",
+        "provider": provider,
+        "calls": 0,
+        "input_tokens": 0,
+        "cached_tokens": 0,
+    }
+    tool_trace.append(prompt_cache_trace)
+
+    def _record_prompt_cache_usage(usage: dict) -> None:
+        prompt_cache_trace["calls"] += 1
+        prompt_cache_trace["input_tokens"] += int(usage.get("input_tokens") or 0)
+        prompt_cache_trace["cached_tokens"] += int(usage.get("cached_tokens") or 0)
     final_text = ""
     proposal_emitted = False
     assistant_follow_ups: list = []
@@ -2503,6 +3121,74 @@ def run_agent_pageindex(
         elif tool_name == "web_search":
             web_evidence.append(str(tool_result))
 
+    def _execute_tool_calls(iteration: int, calls: list[tuple[str, dict]]) -> list[str]:
+        """Run one planner turn's tool calls; returns result texts in call order.
+
+        Independent lookups run concurrently; evidence, grounding refs and trace
+        entries are still recorded in call order.
+        """
+        nonlocal proposal_emitted
+        concurrent_idx = [
+            i for i, (name, _args) in enumerate(calls) if name in _PAGEINDEX_CONCURRENT_TOOLS
+        ]
+        concurrent_results = {}
+        if concurrent_idx:
+            dispatched = _dispatch_pageindex_tools_concurrently(
+                conn, [calls[i] for i in concurrent_idx], course_id, on_event, page_cache
+            )
+            concurrent_results = dict(zip(concurrent_idx, dispatched))
+
+        results = []
+        for i, (name, args) in enumerate(calls):
+            _tmeta = {}
+            if name == "propose_generation":
+                proposal = {
+                    "type": "generation_proposal",
+                    "generation_type": args.get("generation_type") or "",
+                    "title": args.get("title") or "",
+                    "discussion_summary": args.get("discussion_summary") or "",
+                    "material_ids": args.get("material_ids")
+                    or list(context_material_ids or []),
+                    "params": args.get("params") or {},
+                }
+                if on_event:
+                    on_event(proposal)
+                proposal_emitted = True
+                result_text = ""
+            elif name == "select_page_candidates":
+                result_text, _tmeta = _dispatch_candidate_frontier(
+                    conn=conn,
+                    args=args,
+                    budget=retrieval_budget,
+                    grounding_refs=grounding_refs,
+                    page_cache=page_cache,
+                )
+                course_evidence.extend(_tmeta.get("raw_evidence") or [])
+                summary_evidence.extend(_tmeta.get("summary_evidence") or [])
+            elif i in concurrent_results:
+                result_text, _tmeta, call_refs = concurrent_results[i]
+                grounding_refs.extend(call_refs)
+                _record_evidence(name, result_text)
+            else:
+                result_text, _tmeta = _dispatch_pageindex_tool(
+                    conn=conn,
+                    name=name,
+                    args=args,
+                    course_id=course_id,
+                    grounding_refs=grounding_refs,
+                    on_event=on_event,
+                    page_cache=page_cache,
+                )
+            if name == "select_page_candidates":
+                _te = _candidate_frontier_trace(iteration, args, _tmeta, retrieval_budget)
+            else:
+                _te = {"tool": name, "args": args, "iteration": iteration}
+                if _tmeta.get("urls"):
+                    _te["urls"] = _tmeta["urls"]
+            tool_trace.append(_te)
+            results.append(result_text)
+        return results
+
     # Retrieval planning runs on the user-selected model — navigation quality is
     # the dominant retrieval failure mode, so it gets the same model as synthesis.
     retrieval_model = model
@@ -2514,9 +3200,18 @@ def run_agent_pageindex(
             if on_event and evt.get("type") != "text":
                 on_event(evt)
 
-        return _pageindex_stream_call(
-            api_key, retrieval_model, msgs, tls, _non_text_evt if on_event else None
+        usage: dict = {}
+        result = _pageindex_stream_call(
+            api_key,
+            retrieval_model,
+            msgs,
+            tls,
+            _non_text_evt if on_event else None,
+            prompt_cache_key=_prompt_cache_key(system_content),
+            usage=usage,
         )
+        _record_prompt_cache_usage(usage)
+        return result
 
     def _synthesis_call(msgs):
         """Final answer: user-selected model with full text streaming."""
@@ -2553,6 +3248,7 @@ def run_agent_pageindex(
             {"role": "user", "content": claude_user_content}
         ]
         for iteration in range(MAX_TOOL_ITERATIONS):
+            usage: dict = {}
             blocks, stop_reason = _pageindex_stream_call_claude(
                 api_key,
                 model,
@@ -2560,7 +3256,10 @@ def run_agent_pageindex(
                 claude_messages,
                 tools,
                 _non_text_event if on_event else None,
+                cache_prefix=True,
+                usage=usage,
             )
+            _record_prompt_cache_usage(usage)
             tool_use_blocks = [b for b in blocks if b["type"] == "tool_use"]
             if not tool_use_blocks or stop_reason != "tool_use":
                 break
@@ -2581,58 +3280,18 @@ def run_agent_pageindex(
                 elif b["type"] == "text" and b["text"]:
                     assistant_content.append({"type": "text", "text": b["text"]})
             claude_messages.append({"role": "assistant", "content": assistant_content})
-            # Dispatch each tool call and collect results
-            tool_results = []
-            for b in tool_use_blocks:
-                args = json.loads(b["input_json"]) if b["input_json"] else {}
-                _tmeta = {}
-                if b["name"] == "propose_generation":
-                    proposal = {
-                        "type": "generation_proposal",
-                        "generation_type": args.get("generation_type") or "",
-                        "title": args.get("title") or "",
-                        "discussion_summary": args.get("discussion_summary") or "",
-                        "material_ids": args.get("material_ids")
-                        or list(context_material_ids or []),
-                        "params": args.get("params") or {},
-                    }
-                    if on_event:
-                        on_event(proposal)
-                    proposal_emitted = True
-                    result_text = ""
-                elif b["name"] == "select_page_candidates":
-                    result_text, _tmeta = _dispatch_candidate_frontier(
-                        conn=conn,
-                        args=args,
-                        budget=retrieval_budget,
-                        grounding_refs=grounding_refs,
-                    )
-                    course_evidence.extend(_tmeta.get("raw_evidence") or [])
-                    summary_evidence.extend(_tmeta.get("summary_evidence") or [])
-                else:
-                    result_text, _tmeta = _dispatch_pageindex_tool(
-                        conn=conn,
-                        name=b["name"],
-                        args=args,
-                        course_id=course_id,
-                        grounding_refs=grounding_refs,
-                        on_event=on_event,
-                    )
-                    _record_evidence(b["name"], result_text)
-                if b["name"] == "select_page_candidates":
-                    _te = _candidate_frontier_trace(iteration, args, _tmeta, retrieval_budget)
-                else:
-                    _te = {"tool": b["name"], "args": args, "iteration": iteration}
-                    if _tmeta.get("urls"):
-                        _te["urls"] = _tmeta["urls"]
-                tool_trace.append(_te)
-                tool_results.append(
-                    {
-                        "type": "tool_result",
-                        "tool_use_id": b["id"],
-                        "content": result_text,
-                    }
-                )
+            # Dispatch the turn's tool calls and reply in tool_use order
+            results = _execute_tool_calls(
+                iteration,
+                [
+                    (b["name"], json.loads(b["input_json"]) if b["input_json"] else {})
+                    for b in tool_use_blocks
+                ],
+            )
+            tool_results = [
+                {"type": "tool_result", "tool_use_id": b["id"], "content": result_text}
+                for b, result_text in zip(tool_use_blocks, results)
+            ]
             if proposal_emitted:
                 final_text = GENERATION_PROPOSAL_READY_MESSAGE
                 break
@@ -2726,6 +3385,7 @@ def run_agent_pageindex(
             {"role": "user", "parts": gemini_user_parts}
         ]
         for iteration in range(MAX_TOOL_ITERATIONS):
+            usage: dict = {}
             parts, has_fc = _pageindex_stream_call_gemini(
                 api_key,
                 model,
@@ -2733,65 +3393,28 @@ def run_agent_pageindex(
                 contents,
                 tools,
                 _non_text_event if on_event else None,
+                cache_prefix=True,
+                usage=usage,
             )
+            _record_prompt_cache_usage(usage)
             if not has_fc:
                 break
             # Append model turn
             contents.append({"role": "model", "parts": parts})
-            # Dispatch function calls and collect responses
+            # Dispatch function calls and collect responses in call order
+            function_calls = [p["functionCall"] for p in parts if "functionCall" in p]
+            results = _execute_tool_calls(
+                iteration, [(fc["name"], fc.get("args", {})) for fc in function_calls]
+            )
             fn_responses = []
-            for p in parts:
-                if "functionCall" in p:
-                    fc = p["functionCall"]
-                    args = fc.get("args", {})
-                    _tmeta = {}
-                    if fc["name"] == "propose_generation":
-                        proposal = {
-                            "type": "generation_proposal",
-                            "generation_type": args.get("generation_type") or "",
-                            "title": args.get("title") or "",
-                            "discussion_summary": args.get("discussion_summary") or "",
-                            "material_ids": args.get("material_ids")
-                            or list(context_material_ids or []),
-                            "params": args.get("params") or {},
-                        }
-                        if on_event:
-                            on_event(proposal)
-                        proposal_emitted = True
-                        result_text = ""
-                    elif fc["name"] == "select_page_candidates":
-                        result_text, _tmeta = _dispatch_candidate_frontier(
-                            conn=conn,
-                            args=args,
-                            budget=retrieval_budget,
-                            grounding_refs=grounding_refs,
-                        )
-                        course_evidence.extend(_tmeta.get("raw_evidence") or [])
-                        summary_evidence.extend(_tmeta.get("summary_evidence") or [])
-                    else:
-                        result_text, _tmeta = _dispatch_pageindex_tool(
-                            conn=conn,
-                            name=fc["name"],
-                            args=args,
-                            course_id=course_id,
-                            grounding_refs=grounding_refs,
-                            on_event=on_event,
-                        )
-                        _record_evidence(fc["name"], result_text)
-                    if fc["name"] == "select_page_candidates":
-                        _te = _candidate_frontier_trace(iteration, args, _tmeta, retrieval_budget)
-                    else:
-                        _te = {"tool": fc["name"], "args": args, "iteration": iteration}
-                        if _tmeta.get("urls"):
-                            _te["urls"] = _tmeta["urls"]
-                    tool_trace.append(_te)
-                    function_response = {
-                        "name": fc["name"],
-                        "response": {"content": result_text},
-                    }
-                    if fc.get("id"):
-                        function_response["id"] = fc["id"]
-                    fn_responses.append({"functionResponse": function_response})
+            for fc, result_text in zip(function_calls, results):
+                function_response = {
+                    "name": fc["name"],
+                    "response": {"content": result_text},
+                }
+                if fc.get("id"):
+                    function_response["id"] = fc["id"]
+                fn_responses.append({"functionResponse": function_response})
             if proposal_emitted:
                 final_text = GENERATION_PROPOSAL_READY_MESSAGE
                 break
@@ -2913,6 +3536,7 @@ def run_agent_pageindex(
             }
         )
 
+        parsed_calls = []
         for call in tool_calls:
             name = call.get("function", {}).get("name")
             raw_args = call.get("function", {}).get("arguments") or "{}"
@@ -2920,49 +3544,10 @@ def run_agent_pageindex(
                 args = json.loads(raw_args)
             except json.JSONDecodeError:
                 args = {}
+            parsed_calls.append((name, args))
 
-            _tmeta = {}
-            if name == "propose_generation":
-                proposal = {
-                    "type": "generation_proposal",
-                    "generation_type": args.get("generation_type") or "",
-                    "title": args.get("title") or "",
-                    "discussion_summary": args.get("discussion_summary") or "",
-                    "material_ids": args.get("material_ids")
-                    or list(context_material_ids or []),
-                    "params": args.get("params") or {},
-                }
-                if on_event:
-                    on_event(proposal)
-                proposal_emitted = True
-                tool_result = ""
-            elif name == "select_page_candidates":
-                tool_result, _tmeta = _dispatch_candidate_frontier(
-                    conn=conn,
-                    args=args,
-                    budget=retrieval_budget,
-                    grounding_refs=grounding_refs,
-                )
-                course_evidence.extend(_tmeta.get("raw_evidence") or [])
-                summary_evidence.extend(_tmeta.get("summary_evidence") or [])
-            else:
-                tool_result, _tmeta = _dispatch_pageindex_tool(
-                    conn=conn,
-                    name=name,
-                    args=args,
-                    course_id=course_id,
-                    grounding_refs=grounding_refs,
-                    on_event=on_event,
-                )
-                _record_evidence(name, tool_result)
-
-            if name == "select_page_candidates":
-                _te = _candidate_frontier_trace(iteration, args, _tmeta, retrieval_budget)
-            else:
-                _te = {"tool": name, "args": args, "iteration": iteration}
-                if _tmeta.get("urls"):
-                    _te["urls"] = _tmeta["urls"]
-            tool_trace.append(_te)
+        results = _execute_tool_calls(iteration, parsed_calls)
+        for call, (name, _args), tool_result in zip(tool_calls, parsed_calls, results):
             messages.append(
                 {
                     "role": "tool",
@@ -3134,7 +3719,7 @@ def suggest_chat_title(
     }
 
     try:
-        resp = requests.post(
+        resp = provider_http.post(
             _TITLE_URL,
             headers={
                 "Authorization": f"Bearer {api_key}",
@@ -3162,6 +3747,131 @@ def suggest_chat_title(
     return None
 
 
+def collect_chat_memory_fold(conn, user_id: int, chat_id: int) -> dict | None:
+    """
+    Gather the turns that have aged out of the raw history window since the last
+    memory update. Returns a fold job for summarize_chat_memory/store_chat_memory,
+    or None when nothing is due or the user has no OpenAI key.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT memory_summary, memory_through_index FROM chats WHERE id = %s",
+        (chat_id,),
+    )
+    chat = cursor.fetchone() or {}
+    through_index = chat.get("memory_through_index")
+    cursor.execute(
+        """
+        SELECT message_index, role, content
+        FROM (
+            SELECT message_index, role, content
+            FROM chat_messages
+            WHERE chat_id = %s
+              AND is_deleted = FALSE
+              AND role IN ('user', 'assistant')
+              AND message_index > %s
+            ORDER BY message_index DESC
+            OFFSET %s
+        ) aged
+        ORDER BY message_index ASC
+        LIMIT %s
+        """,
+        (
+            chat_id,
+            -1 if through_index is None else through_index,
+            CHAT_MEMORY_RECENT_TURNS,
+            CHAT_MEMORY_FOLD_MAX_TURNS,
+        ),
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows:
+        return None
+
+    try:
+        api_key = _get_api_key(conn, user_id, "openai")
+    except Exception:
+        return None
+    if not api_key:
+        return None
+
+    return {
+        "chat_id": chat_id,
+        "api_key": api_key,
+        "memory": chat.get("memory_summary") or "",
+        "previous_through_index": through_index,
+        "through_index": rows[-1]["message_index"],
+        "turns": [
+            {"role": row["role"], "content": (row["content"] or "")[:_CHAT_MEMORY_TURN_CHARS]}
+            for row in rows
+        ],
+    }
+
+
+def summarize_chat_memory(fold: dict) -> str | None:
+    """
+    Merge the fold's aged-out turns into its running memory with GPT-4o-mini.
+    Makes no database calls, so it can run on a worker thread. Returns the new
+    memory text or None on any failure.
+    """
+    system_prompt = (
+        "You maintain the running memory of a study-assistant conversation. Merge the "
+        "new turns into the existing memory. Keep what later questions may depend on: "
+        "the student's goals and preferences, topics and materials discussed, definitions, "
+        "results and decisions reached, and open questions. Drop greetings and filler. "
+        f"Write compact bullet points, at most {CHAT_MEMORY_MAX_CHARS} characters, oldest "
+        'topics first. Return strict JSON: {"memory": "..."}.'
+    )
+    payload = {"memory": fold.get("memory") or "", "new_turns": fold.get("turns") or []}
+
+    try:
+        resp = provider_http.post(
+            _TITLE_URL,
+            headers={
+                "Authorization": f"Bearer {fold['api_key']}",
+                "Content-Type": "application/json",
+            },
+            json={
+                "model": _TITLE_MODEL,
+                "response_format": {"type": "json_object"},
+                "temperature": 0,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": json.dumps(payload)},
+                ],
+            },
+            timeout=10,
+        )
+        _raise_for_status_verbose(resp)
+        parsed = json.loads(resp.json()["choices"][0]["message"]["content"])
+        memory = str(parsed.get("memory", "")).strip()
+        if memory:
+            return memory[:CHAT_MEMORY_MAX_CHARS]
+    except Exception:
+        pass
+
+    return None
+
+
+def store_chat_memory(conn, fold: dict, memory: str) -> bool:
+    """Persist a folded memory unless another update or a reset moved the chat's
+    memory since the fold was collected. Returns True when the row changed."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        UPDATE chats
+        SET memory_summary = %s,
+            memory_through_index = %s
+        WHERE id = %s
+          AND memory_through_index IS NOT DISTINCT FROM %s
+        """,
+        (memory, fold["through_index"], fold["chat_id"], fold["previous_through_index"]),
+    )
+    updated = cursor.rowcount == 1
+    cursor.close()
+    return updated
+
+
 _PROVIDERS = {
     "claude": _synthesize_claude,
     "openai": _synthesize_openai,
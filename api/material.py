@@ -720,6 +720,7 @@ class handler(BaseHTTPRequestHandler):
             visibility=visibility,
             source_type='upload',
             doc_type=doc_type,
+            s3_key=s3_key,
         )
         Course.add_material(course_id, material['id'])
 
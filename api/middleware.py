@@ -6,7 +6,8 @@ import json
 import time
 import hmac
 import hashlib
-from collections import defaultdict
+import threading
+from collections import OrderedDict
 
 
 # --- CORS ---
@@ -64,27 +65,208 @@ def handle_options(handler):
 
 # --- Rate Limiting ---
 
-_rate_store = defaultdict(list)
+# Token buckets shared by every instance through the UNLOGGED
+# rate_limit_buckets table. Each bucket class refills at its requests-per-minute
+# rate up to a burst of one minute's worth, keyed per client IP and per user.
+# An instance keeps its own estimate of each key and writes to Postgres only
+# every RATE_LIMIT_SYNC_BATCH admissions (fewer for small buckets) or after
+# _RATE_LIMIT_SYNC_SECONDS. The shared balance can only be lower than the local
+# estimate, so a locally empty bucket is refused without a query; admissions
+# overshoot by at most one batch per instance. Local state is an LRU of
+# _RATE_LIMIT_MAX_KEYS keys (an evicted key's unsynced charges are dropped), and
+# when Postgres is unreachable the local estimate decides on its own.
+_RATE_LIMIT_CLASSES = {
+    'default': ('RATE_LIMIT_RPM', 30),
+    'expensive': ('RATE_LIMIT_EXPENSIVE_RPM', 10),
+    'read': ('RATE_LIMIT_READ_RPM', 120),
+}
+_RATE_LIMIT_MAX_KEYS = 4096
+_RATE_LIMIT_SYNC_SECONDS = 2.0
+# Syncs between deletes of idle (hence full) buckets from the shared table.
+_RATE_LIMIT_PRUNE_EVERY = 500
+# Pool checkout wait for a sync; past it the local estimate decides, so an
+# exhausted pool or a database outage never stalls admission.
+_RATE_LIMIT_DB_TIMEOUT_SECONDS = 0.5
+
+_rate_buckets = OrderedDict()
+_rate_buckets_lock = threading.Lock()
+_rate_sync_count = 0
+
+_RATE_BUCKET_SQL = """
+    INSERT INTO rate_limit_buckets AS b (bucket_key, tokens, updated_at)
+    VALUES (%s, %s::float8 - %s::float8, now())
+    ON CONFLICT (bucket_key) DO UPDATE
+    SET tokens = GREATEST(
+            -%s::float8,
+            LEAST(
+                %s::float8,
+                b.tokens + EXTRACT(EPOCH FROM now() - b.updated_at)::float8 * %s::float8
+            ) - %s::float8
+        ),
+        updated_at = now()
+    RETURNING tokens
+"""
 
+_RATE_REFUND_SQL = """
+    UPDATE rate_limit_buckets
+    SET tokens = LEAST(%s::float8, tokens + 1)
+    WHERE bucket_key = ANY(%s)
+"""
 
-def check_rate_limit(handler, max_rpm=None):
-    """
-    In-memory per-IP rate limiting.
-    Returns True if the request is within limits, False otherwise.
-    Resets on cold start (acceptable for serverless).
-    """
-    if max_rpm is None:
-        max_rpm = int(os.environ.get('RATE_LIMIT_RPM', '30'))
+
+def _rate_limit_rpm(bucket):
+    env_name, default = _RATE_LIMIT_CLASSES[bucket]
+    try:
+        return int(os.environ.get(env_name, str(default)))
+    except ValueError:
+        return default
+
+
+def _rate_sync_batch(capacity):
+    try:
+        configured = int(os.environ.get('RATE_LIMIT_SYNC_BATCH', '10'))
+    except ValueError:
+        configured = 10
+    return max(1, min(configured, capacity // 10))
+
+
+def _client_ip(handler):
     client_ip = handler.headers.get('X-Forwarded-For', '').split(',')[0].strip()
     if not client_ip:
         client_ip = handler.client_address[0] if handler.client_address else 'unknown'
-    now = time.time()
-    window = 60
-    _rate_store[client_ip] = [t for t in _rate_store[client_ip] if now - t < window]
-    if len(_rate_store[client_ip]) >= max_rpm:
+    return client_ip
+
+
+def _take_local(keys, capacity, rate, batch, now):
+    """
+    Charge one request against the local estimate of every key, or of none.
+    Returns False when some key is locally empty, otherwise {key: cost} for the
+    keys that must sync now (unsynced charges plus this request); keys left out
+    were charged locally.
+    """
+    with _rate_buckets_lock:
+        states = []
+        for key in keys:
+            state = _rate_buckets.get(key)
+            if state is not None:
+                _rate_buckets.move_to_end(key)
+                state['tokens'] = min(capacity, state['tokens'] + (now - state['at']) * rate)
+                state['at'] = now
+                if state['tokens'] < 1:
+                    return False
+            states.append((key, state))
+        charges = {}
+        for key, state in states:
+            if state is None:
+                charges[key] = 1
+            elif state['pending'] + 1 < batch and now - state['synced_at'] < _RATE_LIMIT_SYNC_SECONDS:
+                state['tokens'] -= 1
+                state['pending'] += 1
+            else:
+                charges[key], state['pending'] = state['pending'] + 1, 0
+        return charges
+
+
+def _refund_local(keys, capacity):
+    """Hand back the local charge of a request refused by another key."""
+    with _rate_buckets_lock:
+        for key in keys:
+            state = _rate_buckets.get(key)
+            if state is not None and state['pending'] > 0:
+                state['tokens'] = min(capacity, state['tokens'] + 1)
+                state['pending'] -= 1
+
+
+def _settle(charges, synced, capacity, now):
+    """Record a sync result (synced None if it failed); returns the decision."""
+    with _rate_buckets_lock:
+        states = {}
+        for key in charges:
+            state = _rate_buckets.get(key)
+            if state is None:
+                state = {'tokens': float(capacity), 'pending': 0, 'at': now, 'synced_at': now}
+                _rate_buckets[key] = state
+            states[key] = state
+        while len(_rate_buckets) > _RATE_LIMIT_MAX_KEYS:
+            _rate_buckets.popitem(last=False)
+        if synced is None:
+            # Keep the charges for the next sync and decide on the local estimate.
+            allowed = all(state['tokens'] >= 1 for state in states.values())
+            for key, state in states.items():
+                state['pending'] += charges[key] if allowed else charges[key] - 1
+                if allowed:
+                    state['tokens'] -= 1
+            return allowed
+        shared, allowed = synced
+        for key, state in states.items():
+            state['tokens'] = shared[key]
+            state['at'] = state['synced_at'] = now
+        return allowed
+
+
+def _sync_buckets(charges, capacity, rate):
+    """
+    Apply {key: cost} in one transaction; returns ({key: tokens left}, allowed)
+    or None. When any key is overdrawn the request is refused and its own charge
+    is handed back to every key, so one empty bucket does not drain the others.
+    """
+    global _rate_sync_count
+    try:
+        from .db import get_db
+        with get_db(timeout=_RATE_LIMIT_DB_TIMEOUT_SECONDS) as conn:
+            cursor = conn.cursor()
+            shared = {}
+            for key, cost in charges.items():
+                cursor.execute(
+                    _RATE_BUCKET_SQL,
+                    (key, capacity, cost, capacity, capacity, rate, cost),
+                )
+                shared[key] = float(cursor.fetchone()['tokens'])
+            allowed = min(shared.values()) >= 0
+            if not allowed:
+                cursor.execute(_RATE_REFUND_SQL, (capacity, list(shared)))
+                shared = {key: min(capacity, tokens + 1) for key, tokens in shared.items()}
+            _rate_sync_count += 1
+            if _rate_sync_count % _RATE_LIMIT_PRUNE_EVERY == 0:
+                cursor.execute(
+                    "DELETE FROM rate_limit_buckets WHERE updated_at < now() - interval '1 hour'"
+                )
+            cursor.close()
+        return shared, allowed
+    except Exception:
+        return None
+
+
+def check_rate_limit(handler, bucket='default', user_id=None):
+    """
+    Token-bucket rate limiting per client IP and, when user_id is given, per user.
+    bucket picks the limit: 'default' (RATE_LIMIT_RPM), 'expensive'
+    (RATE_LIMIT_EXPENSIVE_RPM) for LLM-backed actions, or 'read'
+    (RATE_LIMIT_READ_RPM) for cheap reads; a limit of 0 disables the class.
+    A request is charged to every key or, when any of them refuses, to none.
+    Returns True if the request is within limits, False otherwise.
+    """
+    capacity = _rate_limit_rpm(bucket)
+    if capacity <= 0:
+        return True
+    rate = capacity / 60.0
+    batch = _rate_sync_batch(capacity)
+    keys = [f"{bucket}:ip:{_client_ip(handler)}"]
+    if user_id is not None:
+        keys.append(f"{bucket}:user:{user_id}")
+
+    now = time.monotonic()
+    charges = _take_local(keys, capacity, rate, batch, now)
+    if charges is False:
         return False
-    _rate_store[client_ip].append(now)
-    return True
+    if not charges:
+        return True
+
+    synced = _sync_buckets(charges, capacity, rate)
+    allowed = _settle(charges, synced, capacity, now)
+    if not allowed:
+        _refund_local([key for key in keys if key not in charges], capacity)
+    return allowed
 
 
 # --- CSRF ---
@@ -131,34 +313,191 @@ def set_session_cookie(token, clear=False):
 
 # --- Session Authentication ---
 
-def authenticate_request(handler):
+# Validated sessions, keyed by sha256(cm_session), so a warm instance can skip
+# the sessions/users round trip on back-to-back requests. Entries live for
+# AUTH_SESSION_CACHE_SECONDS (default 30, 0 disables) and never past the
+# session's own expiry. Session.revoke / revoke_all evict them here; other warm
+# instances may honour a revocation up to one TTL late. The cached user row can
+# be equally stale, so handlers that need fresh OAuth tokens should still read
+# User.get_by_google_id.
+_session_cache = {}
+_session_cache_lock = threading.Lock()
+_SESSION_CACHE_MAX_ENTRIES = 1024
+
+_COURSE_ACCESS_SQL = """
+    EXISTS (
+        SELECT 1 FROM courses c
+        WHERE c.id = %s
+          AND (c.primary_creator = u.id
+               OR EXISTS (
+                   SELECT 1 FROM course_members cm
+                   WHERE cm.course_id = c.id AND cm.user_id = u.id
+               ))
+    )
+"""
+
+
+def _session_cache_ttl():
+    try:
+        return max(0, int(os.environ.get('AUTH_SESSION_CACHE_SECONDS', '30')))
+    except ValueError:
+        return 30
+
+
+def _session_cache_key(session_token):
+    return hashlib.sha256(session_token.encode()).hexdigest()
+
+
+def _get_cached_session(session_token):
+    key = _session_cache_key(session_token)
+    with _session_cache_lock:
+        entry = _session_cache.get(key)
+        if entry and entry['expires_at'] > time.monotonic():
+            return entry
+        _session_cache.pop(key, None)
+    return None
+
+
+def _cache_session(session_token, google_id, user, session_expires_at=None):
+    ttl = _session_cache_ttl()
+    if not ttl:
+        return
+    if session_expires_at is not None:
+        try:
+            remaining = session_expires_at.timestamp() - time.time()
+        except (AttributeError, TypeError, ValueError, OSError):
+            remaining = ttl
+        ttl = min(ttl, remaining)
+        if ttl <= 0:
+            return
+    with _session_cache_lock:
+        if len(_session_cache) >= _SESSION_CACHE_MAX_ENTRIES:
+            _session_cache.clear()
+        _session_cache[_session_cache_key(session_token)] = {
+            'google_id': google_id,
+            'user': user,
+            'expires_at': time.monotonic() + ttl,
+        }
+
+
+def forget_session(session_token=None, google_id=None):
+    """Evict one session (by token) or every session of a user from the cache."""
+    with _session_cache_lock:
+        if session_token:
+            _session_cache.pop(_session_cache_key(session_token), None)
+        if google_id:
+            for key in [k for k, v in _session_cache.items() if v['google_id'] == google_id]:
+                del _session_cache[key]
+
+
+def _split_context_row(row):
+    user = {k: v for k, v in row.items() if not k.startswith('_')}
+    return (user if user.get('id') is not None else None), row.get('_course_access')
+
+
+def load_request_context(handler, course_id=None):
     """
-    Extract and validate session token from HttpOnly cookie.
-    Returns (google_id, session_token) tuple, or (None, None) if invalid.
+    Resolve the request's session, user row and (optionally) course access at once.
+
+    Returns None when the request is not authenticated, otherwise a dict:
+      google_id, session_token,
+      user           users row, or None if the session has no user record,
+      course_access  bool when course_id was given, else None.
+
+    On a cache miss this is one joined query on one connection; on a hit it is
+    no query at all, or a single access probe when course_id is given.
     """
-    # Local dev bypass: skip cookie/DB checks entirely
     if os.environ.get('DEV_BYPASS_AUTH') == 'true':
         google_id = os.environ.get('DEV_USER_GOOGLE_ID')
         session_token = os.environ.get('DEV_SESSION_TOKEN', 'dev-bypass-session')
-        return google_id, session_token
+        select = "SELECT u.*" + (f", {_COURSE_ACCESS_SQL} AS _course_access" if course_id is not None else "")
+        params = ((course_id,) if course_id is not None else ()) + (google_id,)
+        from .db import get_db
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(select + " FROM users u WHERE u.google_id = %s", params)
+            row = cursor.fetchone()
+            cursor.close()
+        user, course_access = _split_context_row(dict(row)) if row else (None, None)
+        return {
+            'google_id': google_id,
+            'session_token': session_token,
+            'user': user,
+            'course_access': bool(course_access) if course_id is not None else None,
+        }
 
-    # Primary: HttpOnly cookie
     session_token = _parse_cookie(handler.headers.get('Cookie', ''), 'cm_session')
     if not session_token:
-        return None, None
+        return None
+
     from .db import get_db
+    cached = _get_cached_session(session_token)
+    if cached:
+        course_access = None
+        if course_id is not None:
+            user = cached['user']
+            if user is None:
+                course_access = False
+            else:
+                with get_db() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        f"SELECT {_COURSE_ACCESS_SQL} AS _course_access FROM users u WHERE u.id = %s",
+                        (course_id, user['id']),
+                    )
+                    row = cursor.fetchone()
+                    course_access = bool(row and row['_course_access'])
+                    cursor.close()
+        return {
+            'google_id': cached['google_id'],
+            'session_token': session_token,
+            'user': cached['user'],
+            'course_access': course_access,
+        }
+
+    access_select = f", {_COURSE_ACCESS_SQL} AS _course_access" if course_id is not None else ""
+    params = ((course_id,) if course_id is not None else ()) + (session_token,)
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT google_id FROM sessions
-            WHERE session_token = %s
-              AND revoked = FALSE
-              AND expires_at > CURRENT_TIMESTAMP
-        """, (session_token,))
+        cursor.execute(f"""
+            SELECT u.*, s.google_id AS _session_google_id,
+                   s.expires_at AS _session_expires_at{access_select}
+            FROM sessions s
+            LEFT JOIN users u ON u.google_id = s.google_id
+            WHERE s.session_token = %s
+              AND s.revoked = FALSE
+              AND s.expires_at > CURRENT_TIMESTAMP
+        """, params)
         row = cursor.fetchone()
         cursor.close()
-    if row:
-        return row['google_id'], session_token
+    if not row:
+        return None
+    row = dict(row)
+    user, course_access = _split_context_row(row)
+    google_id = row['_session_google_id']
+    _cache_session(session_token, google_id, user, row.get('_session_expires_at'))
+    return {
+        'google_id': google_id,
+        'session_token': session_token,
+        'user': user,
+        'course_access': bool(course_access) if course_id is not None else None,
+    }
+
+
+def authenticate_request(handler):
+    """
+    Extract and validate session token from HttpOnly cookie.
+    Returns (google_id, session_token) tuple, or (None, None) if invalid.
+    """
+    # Local dev bypass: skip cookie/DB checks entirely
+    if os.environ.get('DEV_BYPASS_AUTH') == 'true':
+        google_id = os.environ.get('DEV_USER_GOOGLE_ID')
+        session_token = os.environ.get('DEV_SESSION_TOKEN', 'dev-bypass-session')
+        return google_id, session_token
+
+    context = load_request_context(handler)
+    if context:
+        return context['google_id'], context['session_token']
     return None, None
 
 
@@ -5,6 +5,7 @@ import secrets
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from .db import get_db
+from .middleware import forget_session
 
 
 class User:
@@ -172,15 +173,20 @@ class Material:
         sync: bool = True,
         integration_source_point_id: Optional[int] = None,
         external_id: Optional[str] = None,
+        s3_key: Optional[str] = None,
     ) -> Dict[str, Any]:
-        """Insert a new material record and return it."""
+        """Insert a new material record and return it.
+
+        s3_key is the object key behind file_url; the indexer looks the
+        material up by it (migration 014).
+        """
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO materials (course_id, name, file_url, uploaded_by, file_type, visibility, source_type, doc_type, sync, integration_source_point_id, external_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                INSERT INTO materials (course_id, name, file_url, uploaded_by, file_type, visibility, source_type, doc_type, sync, integration_source_point_id, external_id, s3_key)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 RETURNING *
-            """, (course_id, name, file_url, uploaded_by, file_type, visibility, source_type, doc_type, sync, integration_source_point_id, external_id))
+            """, (course_id, name, file_url, uploaded_by, file_type, visibility, source_type, doc_type, sync, integration_source_point_id, external_id, s3_key))
             material = cursor.fetchone()
             cursor.close()
             return dict(material)
@@ -306,6 +312,7 @@ class Session:
             """, (session_token,))
             result = cursor.fetchone()
             cursor.close()
+        forget_session(session_token=session_token)
         return result is not None
 
     @staticmethod
@@ -318,3 +325,4 @@ class Session:
                 WHERE google_id = %s AND revoked = FALSE
             """, (google_id,))
             cursor.close()
+        forget_session(google_id=google_id)
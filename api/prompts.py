@@ -3,12 +3,10 @@ from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 
 try:
-    from .middleware import send_json, handle_options, authenticate_request
-    from .models import User
+    from .middleware import send_json, handle_options, load_request_context
     from .db import get_db
 except ImportError:
-    from middleware import send_json, handle_options, authenticate_request
-    from models import User
+    from middleware import send_json, handle_options, load_request_context
     from db import get_db
 
 
@@ -28,12 +26,12 @@ class handler(BaseHTTPRequestHandler):
 
     # ------------------------------------------------------------------ GET --
     def do_GET(self):
-        google_id, _ = authenticate_request(self)
-        if not google_id:
+        context = load_request_context(self)
+        if not context:
             send_json(self, 401, {"error": "Unauthorized"})
             return
 
-        user = User.get_by_google_id(google_id)
+        user = context['user']
         if not user:
             send_json(self, 404, {"error": "User not found"})
             return
@@ -54,8 +52,8 @@ class handler(BaseHTTPRequestHandler):
 
     # ----------------------------------------------------------------- POST --
     def do_POST(self):
-        google_id, _ = authenticate_request(self)
-        if not google_id:
+        context = load_request_context(self)
+        if not context:
             send_json(self, 401, {"error": "Unauthorized"})
             return
 
@@ -73,7 +71,7 @@ class handler(BaseHTTPRequestHandler):
             send_json(self, 400, {"error": str(e)})
             return
 
-        user = User.get_by_google_id(google_id)
+        user = context['user']
         if not user:
             send_json(self, 404, {"error": "User not found"})
             return
@@ -92,8 +90,8 @@ class handler(BaseHTTPRequestHandler):
 
     # --------------------------------------------------------------- DELETE --
     def do_DELETE(self):
-        google_id, _ = authenticate_request(self)
-        if not google_id:
+        context = load_request_context(self)
+        if not context:
             send_json(self, 401, {"error": "Unauthorized"})
             return
 
@@ -105,7 +103,7 @@ class handler(BaseHTTPRequestHandler):
             return
         prompt_id = int(prompt_id_raw)
 
-        user = User.get_by_google_id(google_id)
+        user = context['user']
         if not user:
             send_json(self, 404, {"error": "User not found"})
             return
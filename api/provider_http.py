@@ -0,0 +1,76 @@
+"""
+Pooled HTTP transport for outbound LLM provider calls.
+
+requests.post() builds and discards a Session on every call, so each planner
+iteration and synthesis call paid a fresh TCP + TLS handshake to
+api.openai.com / api.anthropic.com / generativelanguage.googleapis.com. One
+process-wide Session keeps a keep-alive connection pool per host (urllib3
+pools are keyed by scheme, host and port) and applies a single retry policy
+for rate limits and transient 5xx responses.
+
+Retries only replay requests whose response status is retryable. A 429 that
+survives every retry is returned to the caller unchanged, so existing
+raise_for_status() handling still sees it.
+
+Optional environment variables:
+    PROVIDER_HTTP_RETRIES     retries for 429/5xx and connect errors (default 2)
+    PROVIDER_HTTP_POOL_SIZE   keep-alive connections kept per host (default 10)
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _safe_int_env(name: str, default: int, low: int, high: int) -> int:
+    try:
+        value = int(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+    return max(low, min(value, high))
+
+
+def _build_session() -> requests.Session:
+    retries = _safe_int_env("PROVIDER_HTTP_RETRIES", 2, 0, 5)
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        status_forcelist=_RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "POST"}),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=_safe_int_env("PROVIDER_HTTP_POOL_SIZE", 10, 1, 64),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the shared provider Session, building it on first use."""
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                _SESSION = _build_session()
+    return _SESSION
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """Drop-in replacement for requests.post() over the pooled Session."""
+    return get_session().post(url, **kwargs)
@@ -13,20 +13,22 @@ from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 
 try:
-    from .middleware import send_json, handle_options, authenticate_request, get_cors_headers
+    from .middleware import send_json, handle_options, authenticate_request, get_cors_headers, check_rate_limit
     from .models import User
     from .courses import Course
     from .db import get_db
     from .crypto_utils import decrypt_api_key
+    from . import provider_http
     from .services.quiz_token_estimator import estimate_quiz_token_ranges
     from .services.quiz_attempt_grader import grade_quiz_attempt
     from .services.quiz_pdf_builder import build_quiz_pdf_bytes
 except ImportError:
-    from middleware import send_json, handle_options, authenticate_request, get_cors_headers
+    from middleware import send_json, handle_options, authenticate_request, get_cors_headers, check_rate_limit
     from models import User
     from courses import Course
     from db import get_db
     from crypto_utils import decrypt_api_key
+    import provider_http
     from services.quiz_token_estimator import estimate_quiz_token_ranges
     from services.quiz_attempt_grader import grade_quiz_attempt
     from services.quiz_pdf_builder import build_quiz_pdf_bytes
@@ -186,7 +188,7 @@ def _build_quiz_prompt(topic: str, tf_count: int, sa_count: int, la_count: int,
 
 
 def _call_openai_json(api_key: str, model_id: str, system: str, user: str) -> dict:
-    resp = requests.post(
+    resp = provider_http.post(
         'https://api.openai.com/v1/chat/completions',
         headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
         json={
@@ -214,7 +216,7 @@ def _call_openai_json(api_key: str, model_id: str, system: str, user: str) -> di
 
 
 def _call_claude_json(api_key: str, model_id: str, system: str, user: str) -> dict:
-    resp = requests.post(
+    resp = provider_http.post(
         'https://api.anthropic.com/v1/messages',
         headers={
             'x-api-key': api_key,
@@ -239,7 +241,7 @@ def _call_claude_json(api_key: str, model_id: str, system: str, user: str) -> di
 
 def _call_gemini_json(api_key: str, model_id: str, system: str, user: str) -> dict:
     url = f'https://generativelanguage.googleapis.com/v1beta/models/{model_id}:generateContent'
-    resp = requests.post(
+    resp = provider_http.post(
         url,
         headers={
             'x-goog-api-key': api_key,
@@ -626,6 +628,9 @@ class handler(BaseHTTPRequestHandler):
         if action == 'estimate':
             self._estimate(body, user)
         elif action == 'generate':
+            if not check_rate_limit(self, bucket='expensive', user_id=user['id']):
+                send_json(self, 429, {'error': 'Rate limit exceeded'})
+                return
             self._generate(body, user)
         elif action == 'submit_attempt':
             self._submit_attempt(body, user)
@@ -19,15 +19,12 @@ def _invoke_embed_query(query: str = None, image_base64: str = None):
     Image path returns (vis_emb, vis_emb) — same vector used for both slots.
     """
     import json
-    import boto3
-
-    region = os.environ.get('AWS_REGION', 'us-east-1')
-    client = boto3.client(
-        'lambda',
-        region_name=region,
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-    )
+    try:
+        from .aws_clients import get_client
+    except ImportError:
+        from aws_clients import get_client
+
+    client = get_client('lambda')
 
     if image_base64:
         payload = json.dumps({'image_base64': image_base64})
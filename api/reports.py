@@ -19,7 +19,7 @@ from urllib.parse import parse_qs, urlparse
 import boto3
 
 try:
-    from .middleware import send_json, handle_options, authenticate_request, get_cors_headers
+    from .middleware import send_json, handle_options, authenticate_request, get_cors_headers, check_rate_limit
     from .models import User
     from .courses import Course
     from .db import get_db
@@ -31,7 +31,7 @@ try:
     )
     from .services.reports_pdf_builder import build_reports_pdf_html
 except ImportError:
-    from middleware import send_json, handle_options, authenticate_request, get_cors_headers
+    from middleware import send_json, handle_options, authenticate_request, get_cors_headers, check_rate_limit
     from models import User
     from courses import Course
     from db import get_db
@@ -651,6 +651,9 @@ class handler(BaseHTTPRequestHandler):
         if action == "estimate":
             self._estimate(body, user)
         elif action == "generate":
+            if not check_rate_limit(self, bucket="expensive", user_id=user["id"]):
+                send_json(self, 429, {"error": "Rate limit exceeded"})
+                return
             self._generate(body, user)
         elif action == "save_artifact":
             self._save_artifact(body, user)
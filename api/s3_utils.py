@@ -1,12 +1,16 @@
 """
 S3 utility helpers for material file storage.
-Initializes a boto3 S3 client from environment variables and exposes
-presigned URL generation, file existence checks, and deletion.
+Uses the shared S3 client from aws_clients and exposes presigned URL
+generation, file existence checks, and deletion.
 """
 import os
-import boto3
 from botocore.exceptions import ClientError
 
+try:
+    from .aws_clients import get_client
+except ImportError:
+    from aws_clients import get_client
+
 PART_SIZE = 50 * 1024 * 1024  # 50 MB — max size per presigned POST / multipart part
 
 ALLOWED_TYPES = {
@@ -35,12 +39,7 @@ _EXTENSION_MAP = {
 
 
 def _get_client():
-    return boto3.client(
-        's3',
-        region_name=os.environ.get('AWS_REGION'),
-        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
-    )
+    return get_client('s3', region_name=os.environ.get('AWS_REGION'))
 
 
 def validate_file_type(file_type: str, allowed_types=None) -> bool:
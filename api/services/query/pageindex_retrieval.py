@@ -1,28 +1,8 @@
+import hashlib
+import math
 import re
 
 
-def _extract_page_summaries(nodes: list) -> list[dict]:
-    # The index tree nests sub-sections under each node's "nodes" key —
-    # flatten the whole tree so nested sections stay visible.
-    result = []
-
-    def _walk(current: list) -> None:
-        for node in current or []:
-            start = node.get("start_page")
-            if start is not None:
-                result.append({
-                    "start_page": start,
-                    "end_page": node.get("end_page") or start,
-                    "summary": (node.get("summary") or "").strip().replace("\n", " "),
-                    "token_count": node.get("token_count"),
-                })
-            _walk(node.get("nodes") or [])
-
-    _walk(nodes)
-    # Parents (wider spans) sort before their children at the same start page.
-    return sorted(result, key=lambda x: (x["start_page"], x["start_page"] - x["end_page"]))
-
-
 def _parse_pages(pages_str: str) -> list[int]:
     result = []
     for part in pages_str.split(","):
@@ -35,30 +15,38 @@ def _parse_pages(pages_str: str) -> list[int]:
     return result
 
 
+def _clean_summary(summary: str | None) -> str:
+    return (summary or "").strip().replace("\n", " ")
+
+
 def get_course_routing_index(conn, course_id: int, material_ids: list[int] | None = None) -> list[dict]:
+    # Sections come pre-flattened from material_sections; parents (wider spans)
+    # sort before their children at the same start page, ties in tree order.
+    scope_filter = "AND cmi.material_id = ANY(%s)" if material_ids else ""
+    params: tuple = (course_id, material_ids) if material_ids else (course_id,)
     cursor = conn.cursor()
-    if material_ids:
-        cursor.execute(
-            """SELECT cmi.material_id, cmi.material_title, cmi.doc_type, cmi.page_count,
-                      cmi.material_summary, cmi.metadata_tags,
-                      mpi.index_json->'nodes' AS nodes
-               FROM course_material_index cmi
-               LEFT JOIN material_page_index mpi USING (material_id)
-               WHERE cmi.course_id = %s AND cmi.material_id = ANY(%s)
-               ORDER BY cmi.material_id""",
-            (course_id, material_ids),
-        )
-    else:
-        cursor.execute(
-            """SELECT cmi.material_id, cmi.material_title, cmi.doc_type, cmi.page_count,
-                      cmi.material_summary, cmi.metadata_tags,
-                      mpi.index_json->'nodes' AS nodes
-               FROM course_material_index cmi
-               LEFT JOIN material_page_index mpi USING (material_id)
-               WHERE cmi.course_id = %s
-               ORDER BY cmi.material_id""",
-            (course_id,),
-        )
+    cursor.execute(
+        f"""SELECT cmi.material_id, cmi.material_title, cmi.doc_type, cmi.page_count,
+                   cmi.material_summary, cmi.metadata_tags, ms.sections
+            FROM course_material_index cmi
+            LEFT JOIN LATERAL (
+                SELECT jsonb_agg(
+                           jsonb_build_object(
+                               'start_page', s.start_page,
+                               'end_page', s.end_page,
+                               'summary', s.summary,
+                               'token_count', s.token_count,
+                               'keywords', s.keywords
+                           )
+                           ORDER BY s.start_page, s.end_page DESC, s.ordinal
+                       ) AS sections
+                FROM material_sections s
+                WHERE s.material_id = cmi.material_id
+            ) ms ON true
+            WHERE cmi.course_id = %s {scope_filter}
+            ORDER BY cmi.material_id""",
+        params,
+    )
     rows = cursor.fetchall()
     cursor.close()
     return [
@@ -69,12 +57,234 @@ def get_course_routing_index(conn, course_id: int, material_ids: list[int] | Non
             "page_count": r["page_count"],
             "summary": r["material_summary"],
             "tags": r["metadata_tags"] or [],
-            "sections": _extract_page_summaries(r.get("nodes") or []),
+            "sections": [
+                {
+                    "start_page": sec["start_page"],
+                    "end_page": sec["end_page"],
+                    "summary": _clean_summary(sec.get("summary")),
+                    "token_count": sec.get("token_count"),
+                    "keywords": sec.get("keywords") or [],
+                }
+                for sec in r.get("sections") or []
+            ],
         }
         for r in rows
     ]
 
 
+def routing_index_scope_key(material_ids: list[int] | None) -> str:
+    if not material_ids:
+        return "all"
+    ids = ",".join(str(m) for m in sorted({int(m) for m in material_ids}))
+    return hashlib.sha256(ids.encode("utf-8")).hexdigest()
+
+
+def get_routing_index_cache_entry(
+    conn, course_id: int, material_ids: list[int] | None = None
+) -> dict:
+    """Return {"version", "material_count", "routing_block"} for a course scope in one round trip.
+
+    The version changes whenever the indexer rewrites course_material_index or
+    material_page_index for a material in scope (both bump updated_at), or when a
+    material enters or leaves the course. routing_block is the shared cached block
+    for that exact version, or None on a miss.
+    """
+    scope_filter = "AND cmi.material_id = ANY(%s)" if material_ids else ""
+    params: tuple = (course_id, material_ids) if material_ids else (course_id,)
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""WITH v AS (
+                SELECT count(*) AS material_count,
+                       count(*)::text || ':' ||
+                       coalesce(max(greatest(cmi.updated_at, mpi.updated_at))::text, '') AS version
+                FROM course_material_index cmi
+                LEFT JOIN material_page_index mpi USING (material_id)
+                WHERE cmi.course_id = %s {scope_filter}
+            )
+            SELECT v.version, v.material_count, ric.routing_block
+            FROM v
+            LEFT JOIN routing_index_cache ric
+              ON ric.course_id = %s AND ric.scope_key = %s AND ric.version = v.version""",
+        params + (course_id, routing_index_scope_key(material_ids)),
+    )
+    row = cursor.fetchone()
+    cursor.close()
+    if not row:
+        return {"version": None, "material_count": 0, "routing_block": None}
+    return {
+        "version": row["version"],
+        "material_count": row["material_count"],
+        "routing_block": row["routing_block"],
+    }
+
+
+def store_routing_index_cache_entry(
+    conn, course_id: int, material_ids: list[int] | None, version: str, routing_block: str
+) -> None:
+    cursor = conn.cursor()
+    cursor.execute(
+        """INSERT INTO routing_index_cache (course_id, scope_key, version, routing_block, updated_at)
+           VALUES (%s, %s, %s, %s, now())
+           ON CONFLICT (course_id, scope_key) DO UPDATE
+           SET version       = EXCLUDED.version,
+               routing_block = EXCLUDED.routing_block,
+               updated_at    = EXCLUDED.updated_at""",
+        (course_id, routing_index_scope_key(material_ids), version, routing_block),
+    )
+    cursor.close()
+
+
+_LEXICAL_STOPWORDS = frozenset(
+    "about and are but can does for from had has have how into its not that the "
+    "their them then there these this was were what when where which who why "
+    "will with you your".split()
+)
+
+# Pages taken from one matching section before moving to the next, so a single
+# wide chapter match cannot use up the whole prefetch budget.
+_PREFETCH_PAGES_PER_SECTION = 2
+# Upper bound on matching sections get_prefetch_sections reads.
+_PREFETCH_SECTION_ROWS = 200
+
+
+def lexical_terms(text: str | None) -> set[str]:
+    return {
+        term
+        for term in re.findall(r"[a-z0-9]+", (text or "").lower())
+        # Short numbers stay: "lecture 5" or "hw 2" name a specific material.
+        if (len(term) > 2 or term.isdigit()) and term not in _LEXICAL_STOPWORDS
+    }
+
+
+def get_prefetch_sections(
+    conn, course_id: int, material_ids: list[int] | None, query: str
+) -> list[dict]:
+    """Sections in scope whose summary or keywords mention a query term, in the
+    get_course_routing_index shape rank_prefetch_pages expects.
+
+    A narrow read for the page prefetch when the routing materials are not
+    already in hand: no material summaries and no per-material aggregation,
+    capped at _PREFETCH_SECTION_ROWS rows, narrowest sections first.
+    """
+    terms = lexical_terms(query)
+    if not terms:
+        return []
+    pattern = r"\m(" + "|".join(sorted(terms)) + r")\M"
+    scope_filter = "AND cmi.material_id = ANY(%s)" if material_ids else ""
+    params: tuple = (course_id,) + ((material_ids,) if material_ids else ()) + (
+        pattern,
+        _PREFETCH_SECTION_ROWS,
+    )
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""SELECT s.material_id, s.start_page, s.end_page, s.summary, s.keywords
+            FROM material_sections s
+            JOIN course_material_index cmi ON cmi.material_id = s.material_id
+            WHERE cmi.course_id = %s {scope_filter}
+              AND (s.summary || ' ' || s.keywords::text) ~* %s
+            ORDER BY s.end_page - s.start_page, s.material_id, s.start_page
+            LIMIT %s""",
+        params,
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    materials: dict[int, dict] = {}
+    for r in rows:
+        material = materials.setdefault(
+            r["material_id"], {"material_id": r["material_id"], "sections": []}
+        )
+        material["sections"].append(
+            {
+                "start_page": r["start_page"],
+                "end_page": r["end_page"],
+                "summary": _clean_summary(r.get("summary")),
+                "keywords": r.get("keywords") or [],
+            }
+        )
+    return list(materials.values())
+
+
+def rank_prefetch_pages(materials: list[dict], query: str, limit: int) -> list[tuple[int, int]]:
+    """Rank routing sections against the query and return up to `limit` pages.
+
+    `materials` is get_course_routing_index output. Keyword hits count double
+    summary hits; among equal scores narrower sections come first.
+    """
+    terms = lexical_terms(query)
+    if not terms or limit <= 0:
+        return []
+    scored = []
+    for material in materials:
+        for section in material.get("sections") or []:
+            keyword_terms = lexical_terms(" ".join(section.get("keywords") or []))
+            score = 2 * len(terms & keyword_terms) + len(terms & lexical_terms(section.get("summary")))
+            if score:
+                start, end = section["start_page"], section["end_page"]
+                scored.append((-score, end - start, material["material_id"], start, end))
+    scored.sort()
+    pages: list[tuple[int, int]] = []
+    seen: set[tuple[int, int]] = set()
+    for _score, _span, material_id, start, end in scored:
+        for page in range(start, min(end, start + _PREFETCH_PAGES_PER_SECTION - 1) + 1):
+            if (material_id, page) in seen:
+                continue
+            seen.add((material_id, page))
+            pages.append((material_id, page))
+            if len(pages) >= limit:
+                return pages
+    return pages
+
+
+# Per-field weight of a term for routing: a title hit says more than a hit in
+# the free-text summary.
+_ROUTING_FIELD_WEIGHTS = {"title": 3.0, "tags": 2.0, "keywords": 2.0, "summary": 1.0}
+
+
+def build_routing_lexical_index(materials: list[dict]) -> dict[str, dict[int, float]]:
+    """Inverted index term -> {material position: field weight} over routing materials.
+
+    Indexes titles, tags, material summaries and section keywords; a term keeps
+    the weight of the strongest field it appears in for that material.
+    """
+    index: dict[str, dict[int, float]] = {}
+    for position, material in enumerate(materials):
+        fields = {
+            "title": material.get("title"),
+            "tags": " ".join(material.get("tags") or []),
+            "keywords": " ".join(
+                keyword
+                for section in material.get("sections") or []
+                for keyword in section.get("keywords") or []
+            ),
+            "summary": material.get("summary"),
+        }
+        for field, text in fields.items():
+            weight = _ROUTING_FIELD_WEIGHTS[field]
+            for term in lexical_terms(text):
+                postings = index.setdefault(term, {})
+                if postings.get(position, 0.0) < weight:
+                    postings[position] = weight
+    return index
+
+
+def rank_routing_materials(
+    index: dict[str, dict[int, float]], material_count: int, query: str
+) -> list[int]:
+    """Material positions ordered by idf-weighted query-term matches.
+
+    Materials with no match keep their original order after the matches.
+    """
+    scores = [0.0] * material_count
+    for term in lexical_terms(query):
+        postings = index.get(term)
+        if not postings:
+            continue
+        idf = math.log(1 + material_count / len(postings))
+        for position, weight in postings.items():
+            scores[position] += idf * weight
+    return sorted(range(material_count), key=lambda position: (-scores[position], position))
+
+
 def get_material_structure(conn, material_id: int) -> dict:
     cursor = conn.cursor()
     cursor.execute(
@@ -105,40 +315,63 @@ def get_page_content(conn, material_id: int, pages: str) -> list[dict]:
     return [dict(r) for r in rows]
 
 
-def get_page_section_summaries(conn, material_ids: list[int]) -> dict[tuple[int, int], dict]:
-    if not material_ids:
+def get_page_contents(conn, locations: list[tuple[int, int]]) -> dict[tuple[int, int], dict]:
+    """Fetch many (material_id, page_number) rows in one round trip, keyed by location."""
+    if not locations:
+        return {}
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT mpt.material_id, mpt.page_number, mpt.text_content, mpt.has_images, mpt.token_count
+           FROM material_page_text mpt
+           JOIN unnest(%s::int[], %s::int[]) AS wanted(material_id, page_number)
+             USING (material_id, page_number)""",
+        ([m for m, _ in locations], [p for _, p in locations]),
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    return {(r["material_id"], r["page_number"]): dict(r) for r in rows}
+
+
+def get_page_section_summaries(
+    conn, locations: list[tuple[int, int]]
+) -> dict[tuple[int, int], dict]:
+    """Return the narrowest indexed section covering each (material_id, page).
+
+    Ties between equally narrow sections go to the one starting later, then to
+    the later node in tree order. Locations with no covering section are absent.
+    """
+    if not locations:
         return {}
     cursor = conn.cursor()
     cursor.execute(
-        """SELECT cmi.material_id, cmi.material_title, mpi.index_json->'nodes' AS nodes
-           FROM course_material_index cmi
-           LEFT JOIN material_page_index mpi USING (material_id)
-           WHERE cmi.material_id = ANY(%s)
-           ORDER BY cmi.material_id""",
-        (material_ids,),
+        """SELECT DISTINCT ON (wanted.material_id, wanted.page)
+                  wanted.material_id, wanted.page, cmi.material_title,
+                  ms.start_page, ms.end_page, ms.summary, ms.token_count
+           FROM unnest(%s::int[], %s::int[]) AS wanted(material_id, page)
+           JOIN course_material_index cmi ON cmi.material_id = wanted.material_id
+           JOIN material_sections ms
+             ON ms.material_id = wanted.material_id
+            AND ms.start_page <= wanted.page
+            AND ms.end_page >= wanted.page
+           ORDER BY wanted.material_id, wanted.page,
+                    ms.end_page - ms.start_page, ms.start_page DESC, ms.ordinal DESC""",
+        ([m for m, _ in locations], [p for _, p in locations]),
     )
     rows = cursor.fetchall()
     cursor.close()
     summaries: dict[tuple[int, int], dict] = {}
     for row in rows:
         material_id = row["material_id"]
-        title = row.get("material_title") or f"Material {material_id}"
-        for section in _extract_page_summaries(row.get("nodes") or []):
-            section_span = section["end_page"] - section["start_page"]
-            for page in range(section["start_page"], section["end_page"] + 1):
-                existing = summaries.get((material_id, page))
-                # Deepest (narrowest) section wins for each page.
-                if existing is not None and existing["end_page"] - existing["start_page"] < section_span:
-                    continue
-                summaries[(material_id, page)] = {
-                    "material_id": material_id,
-                    "title": title,
-                    "page": page,
-                    "start_page": section["start_page"],
-                    "end_page": section["end_page"],
-                    "summary": section["summary"],
-                    "token_count": section.get("token_count") or max(1, len(section.get("summary") or "") // 4),
-                }
+        summary = _clean_summary(row.get("summary"))
+        summaries[(material_id, row["page"])] = {
+            "material_id": material_id,
+            "title": row.get("material_title") or f"Material {material_id}",
+            "page": row["page"],
+            "start_page": row["start_page"],
+            "end_page": row["end_page"],
+            "summary": summary,
+            "token_count": row.get("token_count") or max(1, len(summary) // 4),
+        }
     return summaries
 
 
@@ -43,6 +43,18 @@ def evaluate_agentic_result(
     return evaluate_hits(query, hits, "agentic_pageindex", k)
 
 
+def routing_recall(tool_trace: list[dict], material_id: int) -> float:
+    """1.0 when the gold material reached the planner with full routing detail.
+
+    Only the lexical pre-router can drop detail, so runs without a pre-route
+    entry score 1.0.
+    """
+    for entry in tool_trace:
+        if entry.get("phase") == "routing_index" and entry.get("preroute"):
+            return float(material_id in entry["preroute"].get("detailed_material_ids", []))
+    return 1.0
+
+
 def serialize_tool_trace(tool_trace: list[dict]) -> str:
     return json.dumps(tool_trace, separators=(",", ":"), ensure_ascii=False)
 
@@ -54,6 +66,7 @@ def _averages(rows: list[dict]) -> dict[str, float]:
         "ndcg_at_k",
         "evidence_location_hit_at_k",
         "answerability_coverage",
+        "routing_recall",
         "tool_call_count",
         "fetched_location_count",
         "latency_ms",
@@ -71,8 +84,8 @@ def _write_summary(path: Path, rows: list[dict], k: int) -> None:
         "",
         "## Metrics",
         "",
-        f"| Variant | Recall@{k} | MRR@{k} | NDCG@{k} | Evidence Location Hit@{k} | Answerability Coverage | Tool Calls | Fetched Locations | Avg Latency ms |",
-        "| --- | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: |",
+        f"| Variant | Recall@{k} | MRR@{k} | NDCG@{k} | Evidence Location Hit@{k} | Answerability Coverage | Routing Recall | Tool Calls | Fetched Locations | Avg Latency ms |",
+        "| --- | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: |",
         (
             "| agentic_pageindex | "
             f"{averages['recall_at_k']:.3f} | "
@@ -80,6 +93,7 @@ def _write_summary(path: Path, rows: list[dict], k: int) -> None:
             f"{averages['ndcg_at_k']:.3f} | "
             f"{averages['evidence_location_hit_at_k']:.3f} | "
             f"{averages['answerability_coverage']:.3f} | "
+            f"{averages['routing_recall']:.3f} | "
             f"{averages['tool_call_count']:.2f} | "
             f"{averages['fetched_location_count']:.2f} | "
             f"{averages['latency_ms']:.0f} |"
@@ -103,9 +117,20 @@ def run_agentic_eval(
     dataset_source: str = "json",
     hf_dataset: str = "allenai/qasper",
     split: str = "test",
+    routing_scope: str = "paper",
+    preroute_threshold: int | None = None,
+    preroute_top_k: int | None = None,
 ) -> list[dict]:
     from llm import run_agent_pageindex
 
+    if routing_scope not in {"paper", "course"}:
+        raise ValueError(f"Unsupported routing scope: {routing_scope}")
+    # The pre-router reads its settings from the environment, like production.
+    if preroute_threshold is not None:
+        os.environ["PAGEINDEX_PREROUTE_THRESHOLD"] = str(preroute_threshold)
+    if preroute_top_k is not None:
+        os.environ["PAGEINDEX_PREROUTE_TOP_K"] = str(preroute_top_k)
+
     if dataset_source == "json":
         if qasper_json is None:
             raise ValueError("--qasper-json is required when --dataset-source=json")
@@ -137,6 +162,7 @@ def run_agentic_eval(
         "ndcg_at_k",
         "evidence_location_hit_at_k",
         "answerability_coverage",
+        "routing_recall",
         "paper_id",
         "question",
         "tool_call_count",
@@ -163,11 +189,14 @@ def run_agentic_eval(
                     api_key=openai_key,
                     chat_id=None,
                     course_id=course_id,
-                    context_material_ids=[material_id],
+                    # "course" routes over every indexed paper, which is what
+                    # exercises the lexical pre-router on large stores.
+                    context_material_ids=[material_id] if routing_scope == "paper" else [],
                 )
                 fetched_locations = fetched_locations_from_tool_trace(tool_trace, adapter, limit=k)
                 result = evaluate_agentic_result(query, fetched_locations, k)
                 row = result.__dict__ | {
+                    "routing_recall": routing_recall(tool_trace, material_id),
                     "paper_id": query.paper_id,
                     "question": query.question,
                     "tool_call_count": sum(1 for entry in tool_trace if "tool" in entry),
@@ -213,6 +242,18 @@ def main() -> None:
         help="Read indexed QASPER PageIndex data from this SQLite store instead of building an in-memory adapter.",
     )
     parser.add_argument("--course-id", type=int, default=1)
+    parser.add_argument(
+        "--routing-scope",
+        choices=["paper", "course"],
+        default="paper",
+        help="Route over the question's paper only, or over every indexed paper in the course.",
+    )
+    parser.add_argument(
+        "--preroute-threshold",
+        type=int,
+        help="Override PAGEINDEX_PREROUTE_THRESHOLD (0 disables the lexical pre-router).",
+    )
+    parser.add_argument("--preroute-top-k", type=int, help="Override PAGEINDEX_PREROUTE_TOP_K.")
     args = parser.parse_args()
 
     if not args.openai_key:
@@ -232,6 +273,9 @@ def main() -> None:
         dataset_source=args.dataset_source,
         hf_dataset=args.hf_dataset,
         split=args.split,
+        routing_scope=args.routing_scope,
+        preroute_threshold=args.preroute_threshold,
+        preroute_top_k=args.preroute_top_k,
     )
     averages = _averages(rows)
     print(
@@ -31,10 +31,9 @@ from llm_client import (
     RELATION_CONFIDENCE_THRESHOLD,
     build_doc_summary_prompt,
     build_metadata_tags_prompt,
-    build_node_keywords_prompt,
-    build_node_summary_prompt,
+    build_node_enrichment_prompt,
     build_relations_prompt,
-    extract_keywords,
+    enrich_node,
     extract_tags,
     summarize,
 )
@@ -145,32 +144,27 @@ def _fallback_keywords(title: str) -> list[str]:
 
 
 def _enrich_material_index(material_index, page_rows: dict[int, dict], doc_type: str, api_key: str) -> dict:
-    stats = {"node_summary_calls": 0, "node_keyword_calls": 0}
+    stats = {"node_enrichment_calls": 0}
     nodes = list(_walk_nodes(material_index.nodes))
     total = len(nodes)
     for idx, node in enumerate(nodes, start=1):
         text = _node_page_text(node, page_rows).strip()
+        result = {}
         if text:
-            node.summary = _call_with_retries(
-                "node summary",
-                summarize,
-                build_node_summary_prompt(doc_type, text),
+            result = _call_with_retries(
+                "node enrichment",
+                enrich_node,
+                build_node_enrichment_prompt(doc_type, text),
                 api_key,
             )
-            stats["node_summary_calls"] += 1
-        keywords_text = text or node.title
-        keywords = _call_with_retries(
-            "node keywords",
-            extract_keywords,
-            build_node_keywords_prompt(doc_type, keywords_text),
-            api_key,
-        )
+            stats["node_enrichment_calls"] += 1
+        node.summary = result.get("summary") or ""
+        keywords = result.get("keywords") or []
         node.keywords = keywords[:15] if keywords else _fallback_keywords(node.title)
-        stats["node_keyword_calls"] += 1
         if total > 10 and (idx == 1 or idx % 10 == 0 or idx == total):
             print(
                 f"  enrich nodes {idx}/{total} for current material; "
-                f"llm_calls={stats['node_summary_calls'] + stats['node_keyword_calls']}",
+                f"llm_calls={stats['node_enrichment_calls']}",
                 flush=True,
             )
     return stats
@@ -347,7 +341,7 @@ def index_qasper_to_sqlite(
                     "academic_paper",
                     api_key,
                 )
-                llm_calls += enrich_stats["node_summary_calls"] + enrich_stats["node_keyword_calls"]
+                llm_calls += enrich_stats["node_enrichment_calls"]
                 node_titles = [node.title for node in material_index.nodes]
                 doc_summary = _call_with_retries(
                     "doc summary",
@@ -287,7 +287,11 @@ def test_sqlite_indexer_llm_enriched_writes_llm_fields_and_relations(monkeypatch
         return "llm summary"
 
     monkeypatch.setattr(qasper_sqlite_indexer, "summarize", fake_summarize)
-    monkeypatch.setattr(qasper_sqlite_indexer, "extract_keywords", lambda prompt, api_key: ["attention", "method"])
+    monkeypatch.setattr(
+        qasper_sqlite_indexer,
+        "enrich_node",
+        lambda prompt, api_key: {"summary": "node summary", "keywords": ["attention", "method"]},
+    )
     monkeypatch.setattr(qasper_sqlite_indexer, "extract_tags", lambda prompt, api_key: ["attention"])
 
     sqlite_db = tmp_path / "qasper.sqlite"
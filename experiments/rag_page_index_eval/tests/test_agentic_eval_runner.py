@@ -100,3 +100,17 @@ def test_run_agentic_eval_accepts_huggingface_source(monkeypatch, tmp_path):
     )
 
     assert rows[0]["recall_at_k"] == 1.0
+
+
+def test_routing_recall_checks_gold_material_kept_full_detail():
+    from experiments.rag_page_index_eval.agentic_eval_runner import routing_recall
+
+    trace = [
+        {"phase": "routing_index", "cache": "preroute",
+         "preroute": {"materials": 200, "detailed": 2, "detailed_material_ids": [7, 3]}},
+        {"tool": "get_page_content", "args": {"material_id": 7, "pages": "1"}},
+    ]
+
+    assert routing_recall(trace, 3) == 1.0
+    assert routing_recall(trace, 9) == 0.0
+    assert routing_recall([{"phase": "routing_index", "cache": "miss"}], 9) == 1.0
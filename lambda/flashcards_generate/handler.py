@@ -11,6 +11,8 @@ import os
 import re
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from cryptography.fernet import Fernet, InvalidToken
 
 from db import get_db
@@ -21,6 +23,29 @@ CONTEXT_CHAR_BUDGET = 24_000
 ALLOWED_DEPTHS = {"brief", "moderate", "in-depth"}
 
 
+def _build_http_session() -> requests.Session:
+    """Keep-alive session reused by every provider call in a warm container.
+
+    Retries 429/5xx with backoff (honouring Retry-After); a response that is still
+    failing after the retries is returned as-is so the callers' error handling runs.
+    """
+    retry = Retry(
+        total=2,
+        read=0,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retry))
+    return session
+
+
+_HTTP = _build_http_session()
+
+
 def _get_fernet() -> Fernet:
     raw = os.environ.get("API_KEY_ENCRYPTION_KEY")
     if not raw:
@@ -147,7 +172,7 @@ def _parse_model_json(raw: str) -> dict:
 
 
 def _call_openai_json(api_key: str, model_id: str, system: str, user: str) -> dict:
-    resp = requests.post(
+    resp = _HTTP.post(
         "https://api.openai.com/v1/chat/completions",
         headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
         json={
@@ -175,7 +200,7 @@ def _call_openai_json(api_key: str, model_id: str, system: str, user: str) -> di
 
 
 def _call_claude_json(api_key: str, model_id: str, system: str, user: str) -> dict:
-    resp = requests.post(
+    resp = _HTTP.post(
         "https://api.anthropic.com/v1/messages",
         headers={
             "x-api-key": api_key,
@@ -200,7 +225,7 @@ def _call_claude_json(api_key: str, model_id: str, system: str, user: str) -> di
 
 def _call_gemini_json(api_key: str, model_id: str, system: str, user: str) -> dict:
     url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_id}:generateContent"
-    resp = requests.post(
+    resp = _HTTP.post(
         url,
         headers={
             "x-goog-api-key": api_key,
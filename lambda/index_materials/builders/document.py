@@ -167,15 +167,19 @@ def build_from_pages(
     return MaterialIndex(title=title, doc_type=doc_type, page_count=page_count, nodes=nodes)
 
 
-def build(pdf_path: str, full_md: str, doc_type: str = "reading", api_key: str | None = None) -> MaterialIndex:
-    import fitz
-    import pymupdf4llm
+def build(
+    pdf_path: str,
+    full_md: str,
+    doc_type: str = "reading",
+    api_key: str | None = None,
+    parsed=None,
+) -> MaterialIndex:
     from hybrid_detector import HybridSectionDetector
 
-    doc = fitz.open(pdf_path)
-    page_count = len(doc)
-    pages = [pymupdf4llm.to_markdown(doc, pages=[i]).strip() for i in range(page_count)]
-    doc.close()
+    if parsed is None:
+        from page_model import parse_pdf
+        parsed = parse_pdf(pdf_path)
+    pages = parsed.page_texts
 
     title = ""
     h1 = _H1_RE.search(pages[0] if pages else "")
@@ -183,7 +187,7 @@ def build(pdf_path: str, full_md: str, doc_type: str = "reading", api_key: str |
         title = h1.group(1).strip()
 
     detector = HybridSectionDetector(doc_type=doc_type)
-    candidates = detector.detect(pdf_path, pages, api_key=api_key)
+    candidates = detector.detect(pdf_path, pages, api_key=api_key, parsed=parsed)
 
     if candidates:
         headings = [(c.page_num - 1, c.text) for c in candidates]
@@ -112,9 +112,12 @@ def build_from_markdown(full_md: str, doc_type: str, page_count: int) -> Materia
     )
 
 
-def build(pdf_path: str, full_md: str, doc_type: str = "hw_instruction") -> MaterialIndex:
-    import fitz
-    doc = fitz.open(pdf_path)
-    page_count = len(doc)
-    doc.close()
+def build(pdf_path: str, full_md: str, doc_type: str = "hw_instruction", parsed=None) -> MaterialIndex:
+    if parsed is not None:
+        page_count = parsed.page_count
+    else:
+        import fitz
+        doc = fitz.open(pdf_path)
+        page_count = len(doc)
+        doc.close()
     return build_from_markdown(full_md, doc_type=doc_type, page_count=page_count)
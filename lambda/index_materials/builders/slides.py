@@ -97,20 +97,19 @@ def build_from_pages(
     return MaterialIndex(title=lecture_title, doc_type=doc_type, page_count=page_count, nodes=nodes)
 
 
-def build(pdf_path: str, full_md: str, api_key: str | None = None) -> MaterialIndex:
-    import fitz
-    import pymupdf4llm
+def build(pdf_path: str, full_md: str, api_key: str | None = None, parsed=None) -> MaterialIndex:
     from hybrid_detector import HybridSectionDetector
 
-    doc = fitz.open(pdf_path)
-    page_count = len(doc)
-    pages = [pymupdf4llm.to_markdown(doc, pages=[i]).strip() for i in range(page_count)]
-    doc.close()
+    if parsed is None:
+        from page_model import parse_pdf
+        parsed = parse_pdf(pdf_path)
+    pages = parsed.page_texts
+    page_count = parsed.page_count
 
     lecture_title = _extract_h1(pages[0] if pages else "", "Lecture")
 
     detector = HybridSectionDetector(doc_type="lecture_slide")
-    candidates = detector.detect(pdf_path, pages, api_key=api_key)
+    candidates = detector.detect(pdf_path, pages, api_key=api_key, parsed=parsed)
     section_indices = [c.page_num - 1 for c in candidates]
 
     return build_from_pages(
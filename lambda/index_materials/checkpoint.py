@@ -0,0 +1,100 @@
+"""Resumable indexing across Step Functions iterations.
+
+A large PDF can outlive one Lambda invocation. The worker checks the remaining
+time after extraction, after each enrichment wave and after the store. When
+less than INDEX_CHECKPOINT_RESERVE_MS is left it persists progress and raises
+IndexYield. The handler then returns status "continue" with the next cursor,
+and the state machine loops back into a fresh invocation.
+
+Progress lives in two places:
+  * LLM results go to index_enrichment_cache (Postgres) as each wave finishes,
+    so a resumed run gets cache hits for every node already enriched.
+  * The parsed page model and the stage reached go to one gzipped JSON object
+    in S3, keyed by material and source ETag, so a resumed run skips the PDF
+    conversion and an edited file never reuses a stale parse.
+
+Optional environment variables:
+    INDEX_CHECKPOINT_RESERVE_MS   time kept back for persisting state (default 90000)
+    INDEX_CHECKPOINT_MIN_PAGES    documents this long save their parse eagerly (default 40)
+    INDEX_MAX_RESUMES             invocations after which time checks stop (default 10)
+"""
+import gzip
+import json
+import logging
+import os
+
+from page_model import ParsedDocument
+
+logger = logging.getLogger(__name__)
+
+# Checkpoints share the materials bucket, whose ObjectCreated notification
+# invokes this Lambda; lambda_handler ignores events under this prefix.
+CHECKPOINT_PREFIX = "index-checkpoints"
+STAGE_PARSED = "parsed"
+STAGE_STORED = "stored"
+
+
+class IndexYield(Exception):
+    """Raised by the worker after persisting progress, when the invocation is nearly out of time."""
+
+
+def _safe_int_env(name: str, default: int, low: int, high: int) -> int:
+    try:
+        value = int(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+    return max(low, min(value, high))
+
+
+def max_resumes() -> int:
+    return _safe_int_env("INDEX_MAX_RESUMES", 10, 0, 100)
+
+
+class IndexCheckpoint:
+    """Persisted progress of one material's indexing run."""
+
+    def __init__(self, s3, bucket: str, material_id: int, etag: str | None, context=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = f"{CHECKPOINT_PREFIX}/{material_id}/{(etag or 'none').strip(chr(34))}.json.gz"
+        self.context = context
+        self.reserve_ms = _safe_int_env("INDEX_CHECKPOINT_RESERVE_MS", 90000, 0, 600000)
+        self.min_pages = _safe_int_env("INDEX_CHECKPOINT_MIN_PAGES", 40, 1, 100000)
+        self.stage = None
+        self.saved = False
+
+    def out_of_time(self) -> bool:
+        if self.context is None:
+            return False
+        return self.context.get_remaining_time_in_millis() < self.reserve_ms
+
+    def load(self) -> ParsedDocument | None:
+        """Parsed document from an earlier invocation, or None. Sets stage; a
+        STAGE_STORED checkpoint carries no parse because only relations remain."""
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self.key)
+            state = json.loads(gzip.decompress(obj["Body"].read()))
+        except Exception as exc:
+            if getattr(exc, "response", {}).get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                logger.warning("Index checkpoint %s unreadable (%s); starting over", self.key, exc)
+            return None
+        self.stage = state.get("stage")
+        self.saved = True
+        logger.info("Resuming from checkpoint %s at stage %s", self.key, self.stage)
+        return ParsedDocument.from_dict(state["parsed"]) if state.get("parsed") else None
+
+    def save(self, parsed: ParsedDocument | None, stage: str) -> None:
+        state = {"stage": stage, "parsed": parsed.to_dict() if parsed is not None else None}
+        body = gzip.compress(json.dumps(state).encode("utf-8"))
+        self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=body, ContentType="application/json")
+        self.stage = stage
+        self.saved = True
+
+    def clear(self) -> None:
+        if not self.saved:
+            return
+        try:
+            self.s3.delete_object(Bucket=self.bucket, Key=self.key)
+        except Exception as exc:
+            logger.warning("Could not delete index checkpoint %s: %s", self.key, exc)
+        self.saved = False
@@ -1,21 +1,94 @@
+"""Postgres access for the indexing Lambda.
+
+Every caller (the handler's material lookup, mark_job, the worker's snapshot
+and cache reads, the per-document store and the relation builder) goes through
+get_db(), which lends out one psycopg connection kept for the life of the
+Lambda container. A warm invocation therefore pays no TCP/TLS handshake to
+Neon. Each get_db() block is one transaction: committed on exit, rolled back on
+error.
+
+Optional environment variables:
+    INDEX_DB_PING_AFTER_SECONDS   idle time after which the connection is
+                                  checked with SELECT 1 before reuse (default 60)
+"""
 import json
+import logging
 import os
+import threading
+import time
 import psycopg
 from contextlib import contextmanager
 
+logger = logging.getLogger(__name__)
 
-@contextmanager
-def get_db():
-    url = os.environ["DATABASE_URL"]
-    conn = psycopg.connect(url, row_factory=psycopg.rows.dict_row)
+_CONN = None
+_CONN_LOCK = threading.RLock()
+_LAST_USED = 0.0
+
+
+def _ping_after_seconds() -> int:
+    try:
+        return max(0, int(os.environ.get("INDEX_DB_PING_AFTER_SECONDS", "60")))
+    except ValueError:
+        return 60
+
+
+def _connect():
+    return psycopg.connect(os.environ["DATABASE_URL"], row_factory=psycopg.rows.dict_row)
+
+
+def _usable(conn) -> bool:
+    if conn is None or conn.closed or getattr(conn, "broken", False):
+        return False
+    if time.monotonic() - _LAST_USED < _ping_after_seconds():
+        return True
+    # Neon closes idle connections when its compute suspends; probe before reuse.
     try:
-        yield conn
-        conn.commit()
-    except Exception:
+        conn.execute("SELECT 1")
         conn.rollback()
-        raise
-    finally:
-        conn.close()
+        return True
+    except Exception as exc:
+        logger.info("Warm database connection is stale (%s); reconnecting", exc)
+        return False
+
+
+def get_connection():
+    """Return the container-wide connection, reconnecting if it was dropped."""
+    global _CONN
+    with _CONN_LOCK:
+        if not _usable(_CONN):
+            close_connection()
+            _CONN = _connect()
+        return _CONN
+
+
+def close_connection() -> None:
+    global _CONN
+    with _CONN_LOCK:
+        if _CONN is not None:
+            try:
+                _CONN.close()
+            except Exception:
+                pass
+        _CONN = None
+
+
+@contextmanager
+def get_db():
+    global _LAST_USED
+    with _CONN_LOCK:
+        conn = get_connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                close_connection()
+            raise
+        finally:
+            _LAST_USED = time.monotonic()
 
 
 def mark_job(material_id: int, status: str, error: str = None) -> None:
@@ -43,7 +116,63 @@ def mark_job(material_id: int, status: str, error: str = None) -> None:
             )
 
 
+# Page rows per statement; each batch travels as one jsonb parameter.
+PAGE_TEXT_BATCH_ROWS = 250
+
+_PAGE_TEXT_UPSERT = """INSERT INTO material_page_text
+                           (material_id, page_number, text_content, has_images, section_name,
+                            token_count, content_hash, section_path)
+                       SELECT %s, p.page_number, p.text_content, p.has_images, p.section_name,
+                              p.token_count, p.content_hash, coalesce(p.section_path, '[]'::jsonb)
+                       FROM jsonb_to_recordset(%s::jsonb) AS p(
+                           page_number int, text_content text, has_images boolean,
+                           section_name text, token_count int, content_hash text,
+                           section_path jsonb)
+                       ON CONFLICT (material_id, page_number) DO UPDATE
+                       SET text_content = EXCLUDED.text_content,
+                           has_images   = EXCLUDED.has_images,
+                           section_name = EXCLUDED.section_name,
+                           token_count  = EXCLUDED.token_count,
+                           content_hash = EXCLUDED.content_hash,
+                           section_path = EXCLUDED.section_path"""
+
+# Pre-013 schema: token_count and section_path (009) but no content_hash.
+_PAGE_TEXT_UPSERT_NO_HASH = """INSERT INTO material_page_text
+                                   (material_id, page_number, text_content, has_images, section_name,
+                                    token_count, section_path)
+                               SELECT %s, p.page_number, p.text_content, p.has_images, p.section_name,
+                                      p.token_count, coalesce(p.section_path, '[]'::jsonb)
+                               FROM jsonb_to_recordset(%s::jsonb) AS p(
+                                   page_number int, text_content text, has_images boolean,
+                                   section_name text, token_count int, section_path jsonb)
+                               ON CONFLICT (material_id, page_number) DO UPDATE
+                               SET text_content = EXCLUDED.text_content,
+                                   has_images   = EXCLUDED.has_images,
+                                   section_name = EXCLUDED.section_name,
+                                   token_count  = EXCLUDED.token_count,
+                                   section_path = EXCLUDED.section_path"""
+
+_PAGE_TEXT_UPSERT_LEGACY = """INSERT INTO material_page_text
+                                  (material_id, page_number, text_content, has_images, section_name)
+                              SELECT %s, p.page_number, p.text_content, p.has_images, p.section_name
+                              FROM jsonb_to_recordset(%s::jsonb) AS p(
+                                  page_number int, text_content text, has_images boolean,
+                                  section_name text)
+                              ON CONFLICT (material_id, page_number) DO UPDATE
+                              SET text_content = EXCLUDED.text_content,
+                                  has_images   = EXCLUDED.has_images,
+                                  section_name = EXCLUDED.section_name"""
+
+_PAGE_TEXT_UPSERTS = (_PAGE_TEXT_UPSERT, _PAGE_TEXT_UPSERT_NO_HASH, _PAGE_TEXT_UPSERT_LEGACY)
+
+
 def store_page_texts(conn, material_id: int, page_rows: list[dict]) -> None:
+    """Upsert page rows in batches of PAGE_TEXT_BATCH_ROWS, one statement each.
+
+    The first batch finds the newest column set the schema supports (dropping
+    content_hash, then token_count/section_path, on UndefinedColumn); later
+    batches reuse it.
+    """
     def _execute_with_savepoint(sql: str, params: tuple) -> None:
         transaction = getattr(conn, "transaction", None)
         if callable(transaction):
@@ -52,43 +181,110 @@ def store_page_texts(conn, material_id: int, page_rows: list[dict]) -> None:
         else:
             conn.execute(sql, params)
 
-    for row in page_rows:
-        params = (
-            material_id,
-            row["page_number"],
-            row.get("text_content"),
-            row.get("has_images", False),
-            row.get("section_name"),
-            row.get("token_count"),
-            json.dumps(row.get("section_path", [])),
-        )
-        try:
-            _execute_with_savepoint(
-                """INSERT INTO material_page_text
-                       (material_id, page_number, text_content, has_images, section_name,
-                        token_count, section_path)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb)
-                   ON CONFLICT (material_id, page_number) DO UPDATE
-                   SET text_content = EXCLUDED.text_content,
-                       has_images   = EXCLUDED.has_images,
-                       section_name = EXCLUDED.section_name,
-                       token_count  = EXCLUDED.token_count,
-                       section_path = EXCLUDED.section_path""",
-                params,
-            )
-        except Exception as exc:
-            if getattr(exc, "sqlstate", None) != "42703" and exc.__class__.__name__ != "UndefinedColumn":
-                raise
-            conn.execute(
-                """INSERT INTO material_page_text
-                       (material_id, page_number, text_content, has_images, section_name)
-                   VALUES (%s, %s, %s, %s, %s)
-                   ON CONFLICT (material_id, page_number) DO UPDATE
-                   SET text_content = EXCLUDED.text_content,
-                       has_images   = EXCLUDED.has_images,
-                       section_name = EXCLUDED.section_name""",
-                params[:5],
-            )
+    rows = [
+        {
+            "page_number": row["page_number"],
+            "text_content": row.get("text_content"),
+            "has_images": bool(row.get("has_images", False)),
+            "section_name": row.get("section_name"),
+            "token_count": row.get("token_count"),
+            "content_hash": row.get("content_hash"),
+            "section_path": row.get("section_path", []),
+        }
+        for row in page_rows
+    ]
+    tier = 0
+    for start in range(0, len(rows), PAGE_TEXT_BATCH_ROWS):
+        params = (material_id, json.dumps(rows[start:start + PAGE_TEXT_BATCH_ROWS]))
+        while True:
+            sql = _PAGE_TEXT_UPSERTS[tier]
+            if tier == len(_PAGE_TEXT_UPSERTS) - 1:
+                conn.execute(sql, params)
+                break
+            try:
+                _execute_with_savepoint(sql, params)
+                break
+            except Exception as exc:
+                if getattr(exc, "sqlstate", None) != "42703" and exc.__class__.__name__ != "UndefinedColumn":
+                    raise
+                tier += 1
+
+
+def delete_page_rows_after(conn, material_id: int, page_count: int) -> None:
+    """Drop page text and visuals rows past the end of a document that shrank."""
+    conn.execute(
+        "DELETE FROM material_page_text WHERE material_id = %s AND page_number > %s",
+        (material_id, page_count),
+    )
+    conn.execute(
+        "DELETE FROM material_page_visuals WHERE material_id = %s AND page_number > %s",
+        (material_id, page_count),
+    )
+
+
+def load_index_snapshot(conn, material_id: int, course_id: int | None = None) -> dict | None:
+    """Previously stored index state of a material, for incremental re-indexing.
+
+    Returns None when there is nothing to diff against: the material was never
+    indexed, or migration 013 has not been applied so page hashes are unknown.
+    """
+    transaction = getattr(conn, "transaction", None)
+    try:
+        if callable(transaction):
+            with transaction():
+                page_rows = _select_page_hashes(conn, material_id)
+        else:
+            page_rows = _select_page_hashes(conn, material_id)
+    except Exception as exc:
+        if getattr(exc, "sqlstate", None) != "42703" and exc.__class__.__name__ != "UndefinedColumn":
+            raise
+        return None
+    if not page_rows:
+        return None
+
+    index_row = conn.execute(
+        "SELECT doc_type, index_json FROM material_page_index WHERE material_id = %s",
+        (material_id,),
+    ).fetchone()
+    if not index_row or not index_row.get("index_json"):
+        return None
+    index_json = index_row["index_json"]
+    if isinstance(index_json, str):
+        index_json = json.loads(index_json)
+
+    course_row = None
+    if course_id is not None:
+        course_row = conn.execute(
+            """SELECT material_summary, metadata_tags
+               FROM course_material_index
+               WHERE course_id = %s AND material_id = %s""",
+            (course_id, material_id),
+        ).fetchone()
+
+    return {
+        "doc_type": index_row.get("doc_type"),
+        "index": index_json,
+        "pages": {
+            row["page_number"]: {
+                "content_hash": row.get("content_hash"),
+                "section_name": row.get("section_name"),
+                "section_path": list(row.get("section_path") or []),
+            }
+            for row in page_rows
+        },
+        "material_summary": (course_row or {}).get("material_summary"),
+        "metadata_tags": list((course_row or {}).get("metadata_tags") or []),
+    }
+
+
+def _select_page_hashes(conn, material_id: int) -> list[dict]:
+    cursor = conn.execute(
+        """SELECT page_number, content_hash, section_name, section_path
+           FROM material_page_text
+           WHERE material_id = %s""",
+        (material_id,),
+    )
+    return cursor.fetchall()
 
 
 def store_page_visuals(conn, material_id: int, page_number: int, visuals: dict) -> None:
@@ -127,6 +323,65 @@ def store_page_index(conn, material_id: int, index_dict: dict) -> None:
             index_dict.get("page_count"),
         ),
     )
+    store_material_sections(conn, material_id, index_dict)
+
+
+def _flatten_sections(nodes: list, depth: int = 0, out: list | None = None) -> list[dict]:
+    """Pre-order walk of the index tree; nodes without a start page are skipped
+    but their children are still visited."""
+    out = [] if out is None else out
+    for node in nodes or []:
+        start = node.get("start_page")
+        if start is not None:
+            out.append({
+                "ordinal": len(out),
+                "node_id": node.get("node_id") or "",
+                "title": node.get("title") or "",
+                "start_page": start,
+                "end_page": node.get("end_page") or start,
+                "depth": depth,
+                "summary": node.get("summary") or "",
+                "token_count": node.get("token_count"),
+                "keywords": list(node.get("keywords") or []),
+            })
+        _flatten_sections(node.get("nodes") or [], depth + 1, out)
+    return out
+
+
+def store_material_sections(conn, material_id: int, index_dict: dict) -> None:
+    """Replace the flattened material_sections rows for one material.
+
+    Skipped (not failed) when migration 011 has not been applied yet, so the
+    indexer keeps working against older databases.
+    """
+    sections = _flatten_sections(index_dict.get("nodes") or [])
+    transaction = getattr(conn, "transaction", None)
+    try:
+        if callable(transaction):
+            with transaction():
+                _replace_material_sections(conn, material_id, sections)
+        else:
+            _replace_material_sections(conn, material_id, sections)
+    except Exception as exc:
+        if getattr(exc, "sqlstate", None) != "42P01" and exc.__class__.__name__ != "UndefinedTable":
+            raise
+
+
+def _replace_material_sections(conn, material_id: int, sections: list[dict]) -> None:
+    conn.execute("DELETE FROM material_sections WHERE material_id = %s", (material_id,))
+    if not sections:
+        return
+    conn.execute(
+        """INSERT INTO material_sections
+               (material_id, ordinal, node_id, title, start_page, end_page, depth,
+                summary, token_count, keywords)
+           SELECT %s, s.ordinal, s.node_id, s.title, s.start_page, s.end_page, s.depth,
+                  s.summary, s.token_count, coalesce(s.keywords, '[]'::jsonb)
+           FROM jsonb_to_recordset(%s::jsonb) AS s(
+               ordinal int, node_id text, title text, start_page int, end_page int,
+               depth int, summary text, token_count int, keywords jsonb)""",
+        (material_id, json.dumps(sections)),
+    )
 
 
 def store_course_index(
@@ -175,21 +430,92 @@ def load_course_materials_for_relations(conn, course_id: int) -> list[dict]:
 
 
 def store_material_relations(conn, relations: list[dict]) -> None:
-    for rel in relations:
-        conn.execute(
-            """INSERT INTO course_material_relations
-                   (course_id, source_id, target_id, relation_type, shared_tags, similarity_score)
-               VALUES (%s, %s, %s, %s, %s::jsonb, %s)
-               ON CONFLICT (course_id, source_id, target_id) DO UPDATE
-               SET relation_type    = EXCLUDED.relation_type,
-                   shared_tags      = EXCLUDED.shared_tags,
-                   similarity_score = EXCLUDED.similarity_score""",
-            (
-                rel["course_id"],
-                rel["source_id"],
-                rel["target_id"],
-                rel["relation_type"],
-                json.dumps(rel.get("shared_tags", [])),
-                rel.get("similarity_score"),
-            ),
-        )
+    """Upsert all relations in one statement.
+
+    A pair listed twice keeps its last entry; ON CONFLICT cannot update the
+    same row twice in one statement.
+    """
+    if not relations:
+        return
+    by_pair = {
+        (rel["course_id"], rel["source_id"], rel["target_id"]): {
+            "course_id": rel["course_id"],
+            "source_id": rel["source_id"],
+            "target_id": rel["target_id"],
+            "relation_type": rel["relation_type"],
+            "shared_tags": rel.get("shared_tags", []),
+            "similarity_score": rel.get("similarity_score"),
+        }
+        for rel in relations
+    }
+    rows = list(by_pair.values())
+    conn.execute(
+        """INSERT INTO course_material_relations
+               (course_id, source_id, target_id, relation_type, shared_tags, similarity_score)
+           SELECT r.course_id, r.source_id, r.target_id, r.relation_type,
+                  coalesce(r.shared_tags, '[]'::jsonb), r.similarity_score
+           FROM jsonb_to_recordset(%s::jsonb) AS r(
+               course_id bigint, source_id bigint, target_id bigint, relation_type text,
+               shared_tags jsonb, similarity_score float8)
+           ON CONFLICT (course_id, source_id, target_id) DO UPDATE
+           SET relation_type    = EXCLUDED.relation_type,
+               shared_tags      = EXCLUDED.shared_tags,
+               similarity_score = EXCLUDED.similarity_score""",
+        (json.dumps(rows),),
+    )
+
+
+def load_enrichment_cache(conn, keys: list[str]) -> dict[str, dict]:
+    """Return cache_key -> payload for the cached keys, touching last_hit_at.
+
+    Empty (not failed) when migration 012 has not been applied yet.
+    """
+    if not keys:
+        return {}
+    transaction = getattr(conn, "transaction", None)
+    try:
+        if callable(transaction):
+            with transaction():
+                rows = _touch_enrichment_cache(conn, keys)
+        else:
+            rows = _touch_enrichment_cache(conn, keys)
+    except Exception as exc:
+        if getattr(exc, "sqlstate", None) != "42P01" and exc.__class__.__name__ != "UndefinedTable":
+            raise
+        return {}
+    return {row["cache_key"]: row["payload"] for row in rows}
+
+
+def _touch_enrichment_cache(conn, keys: list[str]) -> list[dict]:
+    cursor = conn.execute(
+        """UPDATE index_enrichment_cache
+           SET last_hit_at = now()
+           WHERE cache_key = ANY(%s)
+           RETURNING cache_key, payload""",
+        (list(keys),),
+    )
+    return cursor.fetchall()
+
+
+def store_enrichment_cache(conn, entries: dict[str, tuple[str, dict]]) -> None:
+    """Insert fresh cache_key -> (kind, payload) entries; existing keys are left alone."""
+    if not entries:
+        return
+    rows = [
+        {"cache_key": key, "kind": kind, "payload": payload}
+        for key, (kind, payload) in entries.items()
+    ]
+    transaction = getattr(conn, "transaction", None)
+    sql = """INSERT INTO index_enrichment_cache (cache_key, kind, payload)
+             SELECT e.cache_key, e.kind, e.payload
+             FROM jsonb_to_recordset(%s::jsonb) AS e(cache_key text, kind text, payload jsonb)
+             ON CONFLICT (cache_key) DO NOTHING"""
+    try:
+        if callable(transaction):
+            with transaction():
+                conn.execute(sql, (json.dumps(rows),))
+        else:
+            conn.execute(sql, (json.dumps(rows),))
+    except Exception as exc:
+        if getattr(exc, "sqlstate", None) != "42P01" and exc.__class__.__name__ != "UndefinedTable":
+            raise
@@ -5,6 +5,7 @@ import os
 
 import boto3
 
+from checkpoint import CHECKPOINT_PREFIX, IndexCheckpoint, IndexYield, max_resumes
 from db import get_db, mark_job
 from worker import index_document
 
@@ -13,6 +14,9 @@ sfn = boto3.client("stepfunctions", region_name=os.environ.get("AWS_REGION", "us
 
 BUCKET = os.environ["AWS_S3_BUCKET_NAME"]
 STATE_MACHINE_ARN = os.environ["INDEX_STATE_MACHINE_ARN"]
+# Lookups the state machine makes (WaitForMaterial, 5s apart) before giving up
+# on an S3 event whose material row was never written.
+MAX_MATERIAL_WAITS = 6
 
 
 def _execution_name(s3_key: str) -> str:
@@ -22,6 +26,16 @@ def _execution_name(s3_key: str) -> str:
 
 
 def _resolve_material(s3_key: str):
+    try:
+        with get_db() as conn:
+            return conn.execute(
+                "SELECT id, course_id, file_type, doc_type, name FROM materials WHERE s3_key = %s",
+                (s3_key,),
+            ).fetchone()
+    except Exception as exc:
+        if getattr(exc, "sqlstate", None) != "42703" and exc.__class__.__name__ != "UndefinedColumn":
+            raise
+    # Migration 014 not applied yet: fall back to the file_url scan.
     with get_db() as conn:
         return conn.execute(
             "SELECT id, course_id, file_type, doc_type, name FROM materials WHERE file_url LIKE %s",
@@ -33,6 +47,9 @@ def lambda_handler(event, context):
     if "Records" in event:
         for record in event["Records"]:
             s3_key = record["s3"]["object"]["key"]
+            if s3_key.startswith(f"{CHECKPOINT_PREFIX}/"):
+                # Our own checkpoint writes; they are not materials to index.
+                continue
             try:
                 sfn.start_execution(
                     stateMachineArn=STATE_MACHINE_ARN,
@@ -69,17 +86,13 @@ def lambda_handler(event, context):
 
 
 def _worker(event: dict, context, row) -> dict:
-    import time
     s3_key = event["s3_key"]
     if not row:
         # S3 trigger may have fired before confirm_upload wrote the material row.
-        # Retry for up to 30s so the race resolves without losing the job.
-        for _ in range(6):
-            time.sleep(5)
-            row = _resolve_material(s3_key)
-            if row:
-                break
-    if not row:
+        # Hand the wait to the state machine rather than sleeping in the Lambda.
+        waits = int(event.get("wait") or 0)
+        if waits < MAX_MATERIAL_WAITS:
+            return {"status": "waiting", "s3_key": s3_key, "cursor": 0, "wait": waits + 1}
         return {"status": "done", "s3_key": s3_key, "cursor": 0}
 
     material_id = row["id"]
@@ -97,16 +110,27 @@ def _worker(event: dict, context, row) -> dict:
     obj = s3.get_object(Bucket=BUCKET, Key=s3_key)
     file_bytes = obj["Body"].read()
 
-    asyncio.run(
-        index_document(
-            material_id=material_id,
-            course_id=course_id,
-            s3_key=s3_key,
-            doc_type=doc_type,
-            material_title=material_title,
-            file_bytes=file_bytes,
-        )
+    # Past INDEX_MAX_RESUMES the run stops yielding and must finish (or time out).
+    cursor = int(event.get("cursor") or 0)
+    checkpoint = IndexCheckpoint(
+        s3, BUCKET, material_id, obj.get("ETag"),
+        context=context if cursor < max_resumes() else None,
     )
+    try:
+        asyncio.run(
+            index_document(
+                material_id=material_id,
+                course_id=course_id,
+                s3_key=s3_key,
+                doc_type=doc_type,
+                material_title=material_title,
+                file_bytes=file_bytes,
+                checkpoint=checkpoint,
+            )
+        )
+    except IndexYield:
+        return {"status": "continue", "s3_key": s3_key, "cursor": cursor + 1}
 
+    checkpoint.clear()
     mark_job(material_id, "done")
     return {"status": "done", "s3_key": s3_key, "cursor": 0}
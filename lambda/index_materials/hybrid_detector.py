@@ -66,8 +66,9 @@ class HybridSectionDetector:
         pdf_path: str,
         page_texts: list[str],
         api_key: str | None = None,
+        parsed=None,
     ) -> list[CandidateHeading]:
-        font_cands, median_size, stdev_size = self._extract_font_signals(pdf_path)
+        font_cands, median_size, stdev_size = self._extract_font_signals(pdf_path, parsed)
         regex_cands = self._extract_regex_signals(page_texts)
         merged = self._merge_and_score(font_cands, regex_cands, median_size, stdev_size)
 
@@ -80,41 +81,19 @@ class HybridSectionDetector:
 
         return confident
 
-    def _extract_font_signals(self, pdf_path: str) -> tuple[list[CandidateHeading], float, float]:
-        try:
-            import fitz
-        except ImportError:
-            return [], 12.0, 0.0
-
-        try:
-            doc = fitz.open(pdf_path)
-        except Exception:
-            return [], 12.0, 0.0
-
-        all_sizes = []
-        spans_data = []
-
-        for page_num, page in enumerate(doc, start=1):
-            blocks = page.get_text("dict").get("blocks", [])
-            page_height = page.rect.height or 1.0
-            for block in blocks:
-                for line in block.get("lines", []):
-                    for span in line.get("spans", []):
-                        size = span.get("size", 0.0)
-                        text = span.get("text", "").strip()
-                        if not text or size < 4:
-                            continue
-                        all_sizes.append(size)
-                        spans_data.append({
-                            "page_num": page_num,
-                            "text": text,
-                            "size": size,
-                            "bold": bool(span.get("flags", 0) & 16),
-                            "y_rel": span.get("origin", [0, 0])[1] / page_height,
-                        })
-
-        doc.close()
-
+    def _extract_font_signals(
+        self,
+        pdf_path: str,
+        parsed=None,
+    ) -> tuple[list[CandidateHeading], float, float]:
+        if parsed is not None:
+            spans_by_page = [page.spans for page in parsed.pages]
+        else:
+            spans_by_page = self._read_page_spans(pdf_path)
+            if spans_by_page is None:
+                return [], 12.0, 0.0
+
+        all_sizes = [span.size for spans in spans_by_page for span in spans]
         if len(all_sizes) < 3:
             return [], 12.0, 0.0
 
@@ -122,23 +101,41 @@ class HybridSectionDetector:
         stdev_size = statistics.stdev(all_sizes) if len(all_sizes) > 1 else 1.0
 
         candidates = []
-        for s in spans_data:
-            delta = s["size"] - median_size
-            if delta < stdev_size * 0.5:
-                continue
-            if len(s["text"]) > MAX_HEADING_CHARS:
-                continue
-            candidates.append(CandidateHeading(
-                page_num=s["page_num"],
-                text=s["text"],
-                font_size=s["size"],
-                is_bold=s["bold"],
-                y_position=s["y_rel"],
-                source="font",
-            ))
+        for page_num, spans in enumerate(spans_by_page, start=1):
+            for s in spans:
+                delta = s.size - median_size
+                if delta < stdev_size * 0.5:
+                    continue
+                if len(s.text) > MAX_HEADING_CHARS:
+                    continue
+                candidates.append(CandidateHeading(
+                    page_num=page_num,
+                    text=s.text,
+                    font_size=s.size,
+                    is_bold=s.bold,
+                    y_position=s.y_rel,
+                    source="font",
+                ))
 
         return candidates, median_size, stdev_size
 
+    def _read_page_spans(self, pdf_path: str):
+        try:
+            import fitz
+            from page_model import page_spans
+        except ImportError:
+            return None
+
+        try:
+            doc = fitz.open(pdf_path)
+        except Exception:
+            return None
+
+        try:
+            return [page_spans(page) for page in doc]
+        finally:
+            doc.close()
+
     def _extract_regex_signals(self, page_texts: list[str]) -> list[CandidateHeading]:
         pattern = _REGEX_PATTERNS.get(self.doc_type)
         if not pattern:
@@ -1,11 +1,39 @@
+import hashlib
+import json
 import os
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 _URL = "https://api.openai.com/v1/chat/completions"
 _MODEL = "gpt-4o-mini"
 _TIMEOUT = 30
 
+
+def _build_http_session() -> requests.Session:
+    """Keep-alive session shared by every enrichment call in a warm container.
+
+    A document makes hundreds of summarize() calls; reusing one pooled TLS
+    connection avoids a handshake per call. 429/5xx are retried with backoff
+    (honouring Retry-After) before raise_for_status() sees them.
+    """
+    retry = Retry(
+        total=3,
+        read=0,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry))
+    return session
+
+
+_HTTP = _build_http_session()
+
 _NODE_SUMMARY_PROMPTS = {
     "lecture_slide": (
         "Summarize this lecture slide section in at most 120 tokens. "
@@ -47,6 +75,18 @@ _DEFAULT_NODE_PROMPT = (
     "Focus on the main concept or topic covered."
 )
 
+# One enrichment call sees this much section text (the separate summary and
+# keyword prompts used to send 2,000 + 6,000 characters of the same text).
+ENRICHMENT_TEXT_CHARS = 4000
+# Bump whenever an enrichment prompt changes so cached results are not reused.
+ENRICHMENT_PROMPT_VERSION = "1"
+_ENRICHMENT_MAX_TOKENS = 350
+
+_NODE_ENRICHMENT_FORMAT = (
+    "Also extract 5 to 15 retrieval keywords: methods, datasets, metrics, "
+    "named entities, formulas, and key concepts when present."
+)
+
 _DOC_SUMMARY_PROMPT = (
     "Write a 2-3 sentence summary of this course document. "
     "Mention the document type, main topics covered, and what a student would learn from it."
@@ -73,17 +113,31 @@ _RELATIONS_SYSTEM = (
 RELATION_CONFIDENCE_THRESHOLD = 0.6
 
 
-def build_node_summary_prompt(doc_type: str, section_text: str) -> str:
+def enrichment_cache_key(kind: str, doc_type: str, text: str) -> str:
+    """Content address for one enrichment result (see migration 012)."""
+    raw = "\x00".join([kind, ENRICHMENT_PROMPT_VERSION, _MODEL, doc_type or "", text])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def build_node_enrichment_prompt(doc_type: str, section_text: str) -> str:
     system_instruction = _NODE_SUMMARY_PROMPTS.get(doc_type, _DEFAULT_NODE_PROMPT)
-    return f"{system_instruction}\n\nContent:\n{section_text[:2000]}"
+    return (
+        f"{system_instruction}\n{_NODE_ENRICHMENT_FORMAT}\n"
+        'Return only a JSON object: {"summary": str, "keywords": [str]}\n\n'
+        f"Content:\n{section_text[:ENRICHMENT_TEXT_CHARS]}"
+    )
 
 
-def build_node_keywords_prompt(doc_type: str, section_text: str) -> str:
+def build_packed_enrichment_prompt(doc_type: str, sections: list[tuple[str, str]]) -> str:
+    """One request for several small sibling sections, each tagged with its id."""
+    system_instruction = _NODE_SUMMARY_PROMPTS.get(doc_type, _DEFAULT_NODE_PROMPT)
+    blocks = "\n\n".join(f"[Section {key}]\n{text[:ENRICHMENT_TEXT_CHARS]}" for key, text in sections)
     return (
-        f"Extract 5 to 15 retrieval keywords for this {doc_type} section. "
-        "Return only a JSON array of short strings. Include methods, datasets, "
-        "metrics, named entities, formulas, and key concepts when present.\n\n"
-        f"{section_text[:6000]}"
+        f"{system_instruction}\n{_NODE_ENRICHMENT_FORMAT}\n"
+        "Treat each section below independently. Return only a JSON object: "
+        '{"sections": [{"id": str, "summary": str, "keywords": [str]}]} '
+        "with one entry per section id.\n\n"
+        f"{blocks}"
     )
 
 
@@ -129,14 +183,14 @@ def build_relations_prompt(target: dict, others: list[dict]) -> str:
     )
 
 
-def summarize(prompt: str, api_key: str) -> str:
-    resp = requests.post(
+def summarize(prompt: str, api_key: str, max_tokens: int = 150) -> str:
+    resp = _HTTP.post(
         _URL,
         headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
         json={
             "model": _MODEL,
             "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": 150,
+            "max_tokens": max_tokens,
             "temperature": 0.0,
         },
         timeout=_TIMEOUT,
@@ -145,6 +199,54 @@ def summarize(prompt: str, api_key: str) -> str:
     return resp.json()["choices"][0]["message"]["content"].strip()
 
 
+def _complete_json(prompt: str, api_key: str, max_tokens: int) -> dict:
+    resp = _HTTP.post(
+        _URL,
+        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        json={
+            "model": _MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": 0.0,
+            "response_format": {"type": "json_object"},
+        },
+        timeout=_TIMEOUT,
+    )
+    resp.raise_for_status()
+    raw = resp.json()["choices"][0]["message"]["content"]
+    try:
+        value = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+def _clean_enrichment(value: dict) -> dict:
+    keywords = value.get("keywords")
+    if not isinstance(keywords, list):
+        keywords = []
+    return {
+        "summary": str(value.get("summary") or "").strip(),
+        "keywords": [str(k).strip().lower() for k in keywords if k],
+    }
+
+
+def enrich_node(prompt: str, api_key: str) -> dict:
+    """Return {"summary", "keywords"} for one node from a single JSON-mode call."""
+    return _clean_enrichment(_complete_json(prompt, api_key, _ENRICHMENT_MAX_TOKENS))
+
+
+def enrich_nodes(prompt: str, api_key: str, keys: list[str]) -> dict[str, dict]:
+    """Packed variant: section id -> {"summary", "keywords"}; ids the model skipped are absent."""
+    payload = _complete_json(prompt, api_key, _ENRICHMENT_MAX_TOKENS * len(keys))
+    wanted = set(keys)
+    results = {}
+    for item in payload.get("sections") or []:
+        if isinstance(item, dict) and str(item.get("id")) in wanted:
+            results[str(item["id"])] = _clean_enrichment(item)
+    return results
+
+
 def get_api_key() -> str:
     key = os.environ.get("OPENAI_API_KEY_INDEXER")
     if not key:
@@ -165,10 +267,6 @@ def extract_tags(prompt: str, api_key: str) -> list[str]:
         return []
 
 
-def extract_keywords(prompt: str, api_key: str) -> list[str]:
-    return extract_tags(prompt, api_key)
-
-
 def describe_visuals(png_b64: str, api_key: str) -> str:
     """Send a page image to gpt-4o-mini and return the raw JSON string response."""
     prompt_text = (
@@ -181,7 +279,7 @@ def describe_visuals(png_b64: str, api_key: str) -> str:
         "}\n"
         "Use empty arrays when there are no figures or tables. Output JSON only — no other text."
     )
-    resp = requests.post(
+    resp = _HTTP.post(
         _URL,
         headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
         json={
@@ -0,0 +1,233 @@
+"""Single-pass PDF parse shared by the worker, the builders and the heading detector.
+
+The worker, the document/slides builders and HybridSectionDetector each used
+to open the PDF on their own: two full markdown conversions plus a third
+walk of get_text("dict"). Worse, every per-page pymupdf4llm.to_markdown call
+without hdr_info rescans the font sizes of *every* page to decide heading
+levels, so each conversion loop was quadratic in page count.
+
+parse_pdf opens the file once, computes the heading font table once, and
+records per page the markdown, the font spans the detector scores, the image
+flag and the token estimate.
+
+Large documents are split into contiguous page ranges converted in separate
+processes, each opening its own fitz document (INDEX_EXTRACT_WORKERS, default
+the CPU count). Lambda has no /dev/shm, so multiprocessing.Pool and
+ProcessPoolExecutor are unavailable there; shards use Process + Pipe instead.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+from dataclasses import dataclass, field
+
+import fitz
+import pymupdf4llm
+
+from token_counter import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+PAGE_SEPARATOR = "\n\n---\n\n"
+MIN_SPAN_FONT_SIZE = 4
+# Below this many pages per shard, process start-up costs more than it saves.
+MIN_PAGES_PER_SHARD = 16
+MAX_EXTRACT_WORKERS = 8
+
+
+@dataclass
+class PageSpan:
+    text: str
+    size: float
+    bold: bool
+    y_rel: float
+
+
+@dataclass
+class ParsedPage:
+    page_number: int
+    markdown: str
+    has_images: bool
+    token_count: int
+    spans: list[PageSpan] = field(default_factory=list)
+
+    @property
+    def content_hash(self) -> str:
+        """Stable fingerprint of what the page contributes to the index."""
+        digest = hashlib.sha256()
+        digest.update(b"1" if self.has_images else b"0")
+        digest.update(self.markdown.encode("utf-8"))
+        return digest.hexdigest()
+
+    def to_row(self) -> dict:
+        return {
+            "page_number": self.page_number,
+            "text_content": self.markdown or None,
+            "has_images": self.has_images,
+            "token_count": self.token_count,
+            "content_hash": self.content_hash,
+        }
+
+
+@dataclass
+class ParsedDocument:
+    pages: list[ParsedPage] = field(default_factory=list)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    @property
+    def page_texts(self) -> list[str]:
+        return [page.markdown for page in self.pages]
+
+    def full_markdown(self) -> str:
+        return PAGE_SEPARATOR.join(page.markdown for page in self.pages)
+
+    def page_rows(self) -> list[dict]:
+        return [page.to_row() for page in self.pages]
+
+    def to_dict(self) -> dict:
+        return {
+            "pages": [
+                {
+                    "page_number": page.page_number,
+                    "markdown": page.markdown,
+                    "has_images": page.has_images,
+                    "token_count": page.token_count,
+                    "spans": [[span.text, span.size, span.bold, span.y_rel] for span in page.spans],
+                }
+                for page in self.pages
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ParsedDocument":
+        return cls(pages=[
+            ParsedPage(
+                page_number=page["page_number"],
+                markdown=page["markdown"],
+                has_images=page["has_images"],
+                token_count=page["token_count"],
+                spans=[PageSpan(*span) for span in page.get("spans") or []],
+            )
+            for page in data.get("pages") or []
+        ])
+
+
+def page_spans(page) -> list[PageSpan]:
+    """Non-empty text spans of a fitz page with their font size, weight and vertical position."""
+    page_height = page.rect.height or 1.0
+    spans = []
+    for block in page.get_text("dict").get("blocks", []):
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                size = span.get("size", 0.0)
+                text = span.get("text", "").strip()
+                if not text or size < MIN_SPAN_FONT_SIZE:
+                    continue
+                spans.append(PageSpan(
+                    text=text,
+                    size=size,
+                    bold=bool(span.get("flags", 0) & 16),
+                    y_rel=span.get("origin", [0, 0])[1] / page_height,
+                ))
+    return spans
+
+
+def extract_workers() -> int:
+    raw = os.environ.get("INDEX_EXTRACT_WORKERS")
+    try:
+        value = int(raw) if raw else (os.cpu_count() or 1)
+    except ValueError:
+        value = 1
+    return max(1, min(value, MAX_EXTRACT_WORKERS))
+
+
+def shard_ranges(page_count: int, workers: int) -> list[tuple[int, int]]:
+    """Split [0, page_count) into at most workers contiguous (start, end) ranges."""
+    shards = max(1, min(workers, page_count // MIN_PAGES_PER_SHARD))
+    size, extra = divmod(page_count, shards)
+    ranges = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _parse_pages(doc, start: int, end: int, hdr_info, counter) -> list[ParsedPage]:
+    pages = []
+    for i in range(start, end):
+        page = doc[i]
+        md = pymupdf4llm.to_markdown(doc, pages=[i], hdr_info=hdr_info).strip()
+        pages.append(ParsedPage(
+            page_number=i + 1,
+            markdown=md,
+            has_images=bool(page.get_images(full=False)),
+            token_count=counter.estimate_text(md),
+            spans=page_spans(page),
+        ))
+    return pages
+
+
+def _parse_shard(conn, pdf_path: str, start: int, end: int, hdr_info) -> None:
+    """Process target: convert pages [start, end) of its own copy of the document."""
+    try:
+        doc = fitz.open(pdf_path)
+        try:
+            conn.send(("ok", _parse_pages(doc, start, end, hdr_info, TokenCounter())))
+        finally:
+            doc.close()
+    except Exception as exc:
+        conn.send(("error", repr(exc)))
+    finally:
+        conn.close()
+
+
+def _parse_sharded(doc, pdf_path: str, ranges, hdr_info, counter) -> list[ParsedPage]:
+    jobs = []
+    for start, end in ranges:
+        parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        proc = multiprocessing.Process(
+            target=_parse_shard,
+            args=(child_conn, pdf_path, start, end, hdr_info),
+            daemon=True,
+        )
+        proc.start()
+        child_conn.close()
+        jobs.append((start, end, parent_conn, proc))
+
+    pages = []
+    for start, end, parent_conn, proc in jobs:
+        # Receive before join: a shard blocks on send until its pages are read.
+        try:
+            status, payload = parent_conn.recv()
+        except EOFError:
+            status, payload = "error", f"worker exited with code {proc.exitcode}"
+        finally:
+            parent_conn.close()
+        proc.join()
+        if status == "ok":
+            pages.extend(payload)
+        else:
+            logger.warning("Page shard %d-%d failed (%s); converting in-process", start + 1, end, payload)
+            pages.extend(_parse_pages(doc, start, end, hdr_info, counter))
+    return pages
+
+
+def parse_pdf(pdf_path: str, workers: int | None = None) -> ParsedDocument:
+    doc = fitz.open(pdf_path)
+    try:
+        hdr_info = pymupdf4llm.IdentifyHeaders(doc)
+        # Built before any fork so shards inherit the loaded encoding.
+        counter = TokenCounter()
+        ranges = shard_ranges(len(doc), extract_workers() if workers is None else workers)
+        if len(ranges) > 1:
+            pages = _parse_sharded(doc, pdf_path, ranges, hdr_info, counter)
+        else:
+            pages = _parse_pages(doc, 0, len(doc), hdr_info, counter)
+        return ParsedDocument(pages=pages)
+    finally:
+        doc.close()
@@ -1,15 +1,33 @@
+"""Course material relations, built in two stages.
+
+Candidate generation scores every other material in the course against the
+newly indexed one by tag Jaccard and term Jaccard over title + summary, and
+keeps the top INDEX_RELATION_TOP_K (default 12). Only those pairs go to the
+LLM, RELATION_BATCH_SIZE candidates per call, so the prompt and the output
+budget stay bounded however large the course grows.
+"""
 import asyncio
 import json
 import logging
+import os
 import re
 
-import psycopg
-
+from db import get_db, load_course_materials_for_relations, store_material_relations
 from llm_client import build_relations_prompt, summarize, RELATION_CONFIDENCE_THRESHOLD
 
 logger = logging.getLogger(__name__)
 
 _VALID_RELATION_TYPES = {"prerequisite", "extends", "practice_for", "solution_for"}
+RELATION_BATCH_SIZE = 6
+RELATION_CONCURRENCY = 3
+# Output budget per classification call: a fixed overhead plus one relation per candidate.
+_RELATION_BASE_TOKENS = 60
+_RELATION_TOKENS_PER_CANDIDATE = 90
+_TAG_WEIGHT = 0.6
+_TERM_STOPWORDS = {
+    "about", "also", "and", "are", "based", "covers", "from", "into", "lecture",
+    "material", "that", "their", "these", "this", "using", "what", "which", "with",
+}
 
 
 def _extract_json(raw: str) -> list[dict]:
@@ -44,46 +62,120 @@ def _build_relations_prompt(target: dict, others: list[dict]) -> str:
     return build_relations_prompt(target, others)
 
 
-async def build_course_relations(
-    db_url: str,
+def _relation_top_k() -> int:
+    try:
+        value = int(os.environ.get("INDEX_RELATION_TOP_K", "12"))
+    except ValueError:
+        return 12
+    return max(1, min(value, 50))
+
+
+def _material_tags(material: dict) -> set[str]:
+    return {str(tag).strip().lower() for tag in material.get("metadata_tags") or [] if tag}
+
+
+def _material_terms(material: dict) -> set[str]:
+    text = f"{material.get('material_title') or ''} {material.get('material_summary') or ''}"
+    return {
+        token
+        for token in re.findall(r"[a-z][a-z0-9_-]{3,}", text.lower())
+        if token not in _TERM_STOPWORDS
+    }
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _select_candidates(target: dict, others: list[dict], top_k: int) -> list[dict]:
+    """The top_k materials sharing the most tags and terms with target; no overlap, no candidate."""
+    target_tags = _material_tags(target)
+    target_terms = _material_terms(target)
+    scored = []
+    for other in others:
+        score = (
+            _TAG_WEIGHT * _jaccard(target_tags, _material_tags(other))
+            + (1 - _TAG_WEIGHT) * _jaccard(target_terms, _material_terms(other))
+        )
+        if score > 0:
+            scored.append((score, other["material_id"], other))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [other for _score, _id, other in scored[:top_k]]
+
+
+def _relations_for_batch(raw: str, course_id: int, target_id: int, batch_ids: set[int]) -> list[dict]:
+    """Valid relations from one batch response that link target to one of its candidates."""
+    relations = []
+    for rel in _filter_relations(_extract_json(raw), course_id):
+        pair = {rel["source_id"], rel["target_id"]}
+        if target_id in pair and len(pair) == 2 and pair - {target_id} <= batch_ids:
+            relations.append(rel)
+    return relations
+
+
+async def _classify_batch(
+    target: dict,
+    batch: list[dict],
     course_id: int,
-    updated_material_id: int,
     api_key: str,
-) -> None:
-    with psycopg.connect(db_url, row_factory=psycopg.rows.dict_row) as conn:
-        from db import load_course_materials_for_relations, store_material_relations
-
-        rows = load_course_materials_for_relations(conn, course_id)
-        target = next((r for r in rows if r["material_id"] == updated_material_id), None)
-        if not target:
-            logger.warning(
-                "Material %d not found in course_material_index for course %d",
-                updated_material_id,
-                course_id,
-            )
-            return
-
-        others = [r for r in rows if r["material_id"] != updated_material_id]
-        if not others:
-            logger.info("No other materials in course %d; skipping relation building", course_id)
-            return
-
-        prompt = _build_relations_prompt(target, others)
+    sem: asyncio.Semaphore,
+) -> list[dict]:
+    prompt = _build_relations_prompt(target, batch)
+    max_tokens = _RELATION_BASE_TOKENS + _RELATION_TOKENS_PER_CANDIDATE * len(batch)
+    async with sem:
         try:
-            raw = await asyncio.to_thread(summarize, prompt, api_key)
+            raw = await asyncio.to_thread(summarize, prompt, api_key, max_tokens)
         except Exception as exc:
             logger.warning("LLM call for relations failed: %s", exc)
-            return
+            return []
+    return _relations_for_batch(
+        raw, course_id, target["material_id"], {other["material_id"] for other in batch}
+    )
 
-        raw_relations = _extract_json(raw)
-        relations = _filter_relations(raw_relations, course_id)
 
-        if relations:
+async def build_course_relations(
+    course_id: int,
+    updated_material_id: int,
+    api_key: str,
+) -> None:
+    # The LLM calls run between two short transactions rather than inside one.
+    with get_db() as conn:
+        rows = load_course_materials_for_relations(conn, course_id)
+    target = next((r for r in rows if r["material_id"] == updated_material_id), None)
+    if not target:
+        logger.warning(
+            "Material %d not found in course_material_index for course %d",
+            updated_material_id,
+            course_id,
+        )
+        return
+
+    others = [r for r in rows if r["material_id"] != updated_material_id]
+    candidates = _select_candidates(target, others, _relation_top_k())
+    if not candidates:
+        logger.info("No relation candidates for material %d in course %d", updated_material_id, course_id)
+        return
+
+    sem = asyncio.Semaphore(RELATION_CONCURRENCY)
+    batches = [
+        candidates[i:i + RELATION_BATCH_SIZE]
+        for i in range(0, len(candidates), RELATION_BATCH_SIZE)
+    ]
+    results = await asyncio.gather(
+        *(_classify_batch(target, batch, course_id, api_key, sem) for batch in batches)
+    )
+    relations = [rel for batch_relations in results for rel in batch_relations]
+
+    if relations:
+        with get_db() as conn:
             store_material_relations(conn, relations)
-            conn.commit()
-            logger.info(
-                "Stored %d relations for course %d (material %d)",
-                len(relations),
-                course_id,
-                updated_material_id,
-            )
+        logger.info(
+            "Stored %d relations for course %d (material %d; %d of %d materials classified)",
+            len(relations),
+            course_id,
+            updated_material_id,
+            len(candidates),
+            len(others),
+        )
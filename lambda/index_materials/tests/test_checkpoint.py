@@ -0,0 +1,74 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+
+from checkpoint import STAGE_PARSED, STAGE_STORED, IndexCheckpoint, IndexYield
+from page_model import PageSpan, ParsedDocument, ParsedPage
+
+
+class _FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            error = Exception("missing")
+            error.response = {"Error": {"Code": "NoSuchKey"}}
+            raise error
+        body = self.objects[Key]
+        return {"Body": types.SimpleNamespace(read=lambda: body)}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[Key] = Body
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+class _Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_checkpoint_round_trips_parse_and_is_keyed_by_etag():
+    s3 = _FakeS3()
+    parsed = ParsedDocument(pages=[ParsedPage(1, "# Intro", True, 3, [PageSpan("Intro", 20.0, True, 0.1)])])
+
+    first = IndexCheckpoint(s3, "bucket", 7, '"etag-1"')
+    assert first.load() is None and first.stage is None
+    first.save(parsed, STAGE_PARSED)
+    assert first.key == "index-checkpoints/7/etag-1.json.gz"
+
+    resumed = IndexCheckpoint(s3, "bucket", 7, '"etag-1"')
+    assert resumed.load() == parsed and resumed.stage == STAGE_PARSED
+    assert IndexCheckpoint(s3, "bucket", 7, '"etag-2"').load() is None
+
+    resumed.save(None, STAGE_STORED)
+    stored = IndexCheckpoint(s3, "bucket", 7, '"etag-1"')
+    assert stored.load() is None and stored.stage == STAGE_STORED
+    stored.clear()
+    assert s3.objects == {}
+
+
+def test_yield_if_out_of_time_saves_parse_once(monkeypatch):
+    from worker import _yield_if_out_of_time
+
+    monkeypatch.setenv("INDEX_CHECKPOINT_RESERVE_MS", "1000")
+    s3 = _FakeS3()
+    parsed = ParsedDocument(pages=[ParsedPage(1, "text", False, 1)])
+
+    _yield_if_out_of_time(IndexCheckpoint(s3, "b", 1, "e", context=_Context(5000)), parsed, STAGE_PARSED)
+    _yield_if_out_of_time(None, parsed, STAGE_PARSED)
+    assert s3.objects == {}
+
+    checkpoint = IndexCheckpoint(s3, "b", 1, "e", context=_Context(500))
+    with pytest.raises(IndexYield):
+        _yield_if_out_of_time(checkpoint, parsed, STAGE_PARSED)
+    assert checkpoint.saved and list(s3.objects) == ["index-checkpoints/1/e.json.gz"]
@@ -10,7 +10,16 @@ sys.modules.setdefault(
     types.SimpleNamespace(rows=types.SimpleNamespace(dict_row=object)),
 )
 
-from db import store_page_texts, store_page_visuals
+import db
+from db import (
+    load_enrichment_cache,
+    load_index_snapshot,
+    store_enrichment_cache,
+    store_material_relations,
+    store_page_index,
+    store_page_texts,
+    store_page_visuals,
+)
 
 
 class FakeConn:
@@ -37,7 +46,8 @@ def test_store_page_texts_accepts_section_path():
 
     sql, params = conn.calls[0]
     assert "section_path" in sql
-    assert params[-1] == '["Paper", "Introduction"]'
+    assert params[0] == 42
+    assert json.loads(params[1])[0]["section_path"] == ["Paper", "Introduction"]
 
 
 def test_store_page_visuals_upserts_correct_columns():
@@ -100,4 +110,244 @@ def test_store_page_texts_includes_token_count():
     )
 
     assert "token_count" in calls[0][0]
-    assert calls[0][1][5] == 7
+    assert json.loads(calls[0][1][1])[0]["token_count"] == 7
+
+
+def test_store_page_texts_drops_content_hash_before_migration_013():
+    class UndefinedColumn(Exception):
+        sqlstate = "42703"
+
+    class Conn(FakeConn):
+        def execute(self, sql, params):
+            if "content_hash" in sql:
+                raise UndefinedColumn('column "content_hash" does not exist')
+            super().execute(sql, params)
+
+    conn = Conn()
+    store_page_texts(conn, 5, [{"page_number": 2, "text_content": "x", "token_count": 3, "content_hash": "h"}])
+
+    assert len(conn.calls) == 1
+    sql, params = conn.calls[0]
+    assert "token_count" in sql and "content_hash" not in sql
+    assert params[0] == 5
+    assert json.loads(params[1])[0]["page_number"] == 2
+
+
+def test_store_page_texts_batches_rows_and_falls_back_once(monkeypatch):
+    class UndefinedColumn(Exception):
+        sqlstate = "42703"
+
+    attempts = []
+
+    class Conn(FakeConn):
+        def execute(self, sql, params):
+            attempts.append(sql)
+            if "token_count" in sql:
+                raise UndefinedColumn('column "token_count" does not exist')
+            super().execute(sql, params)
+
+    monkeypatch.setattr("db.PAGE_TEXT_BATCH_ROWS", 2)
+    conn = Conn()
+    rows = [{"page_number": n, "text_content": f"p{n}"} for n in range(1, 6)]
+    store_page_texts(conn, 8, rows)
+
+    # Two failed probes on the first batch, then one statement per batch.
+    assert len(attempts) == 5
+    assert [len(json.loads(params[1])) for _sql, params in conn.calls] == [2, 2, 1]
+    assert all("section_path" not in sql for sql, _params in conn.calls)
+
+
+def test_store_material_relations_writes_one_statement():
+    conn = FakeConn()
+    store_material_relations(conn, [
+        {"course_id": 1, "source_id": 2, "target_id": 3, "relation_type": "related", "shared_tags": ["x"]},
+        {"course_id": 1, "source_id": 2, "target_id": 4, "relation_type": "related", "similarity_score": 0.5},
+        # A repeated pair keeps its last entry.
+        {"course_id": 1, "source_id": 2, "target_id": 3, "relation_type": "prerequisite", "shared_tags": ["x"]},
+    ])
+    store_material_relations(conn, [])
+
+    assert len(conn.calls) == 1
+    sql, params = conn.calls[0]
+    assert "ON CONFLICT (course_id, source_id, target_id)" in sql
+    rows = json.loads(params[0])
+    assert [row["target_id"] for row in rows] == [3, 4]
+    assert rows[0]["relation_type"] == "prerequisite"
+    assert rows[1]["shared_tags"] == [] and rows[0]["similarity_score"] is None
+
+
+def test_load_index_snapshot_maps_pages_and_course_fields():
+    class Cursor:
+        def __init__(self, rows):
+            self.rows = rows
+
+        def fetchall(self):
+            return self.rows
+
+        def fetchone(self):
+            return self.rows[0] if self.rows else None
+
+    results = {
+        "material_page_text": [
+            {"page_number": 1, "content_hash": "a", "section_name": "Intro", "section_path": ["Intro"]},
+        ],
+        "material_page_index": [{"doc_type": "reading", "index_json": '{"nodes": []}'}],
+        "course_material_index": [{"material_summary": "S", "metadata_tags": ["t"]}],
+    }
+
+    class Conn(FakeConn):
+        def execute(self, sql, params):
+            super().execute(sql, params)
+            table = next(name for name in results if name in sql)
+            return Cursor(results[table])
+
+    snapshot = load_index_snapshot(Conn(), 9, course_id=3)
+
+    assert snapshot == {
+        "doc_type": "reading",
+        "index": {"nodes": []},
+        "pages": {1: {"content_hash": "a", "section_name": "Intro", "section_path": ["Intro"]}},
+        "material_summary": "S",
+        "metadata_tags": ["t"],
+    }
+    results["material_page_text"] = []
+    assert load_index_snapshot(Conn(), 9) is None
+
+
+def test_store_page_index_writes_flattened_sections_in_preorder():
+    conn = FakeConn()
+    index_dict = {
+        "doc_type": "reading",
+        "page_count": 12,
+        "nodes": [
+            {
+                "node_id": "0001",
+                "title": "Chapter 1",
+                "start_page": 1,
+                "end_page": 10,
+                "summary": "Overview",
+                "keywords": ["intro"],
+                "nodes": [
+                    {"node_id": "0002", "title": "1.1", "start_page": 3, "end_page": 4,
+                     "summary": "Detail", "token_count": 9, "nodes": []},
+                ],
+            },
+            {"node_id": "0003", "title": "Untitled", "start_page": None, "nodes": [
+                {"node_id": "0004", "title": "Appendix", "start_page": 11, "summary": "Extra"},
+            ]},
+        ],
+    }
+
+    store_page_index(conn, material_id=742, index_dict=index_dict)
+
+    assert "material_page_index" in conn.calls[0][0]
+    assert conn.calls[1] == ("DELETE FROM material_sections WHERE material_id = %s", (742,))
+    sql, params = conn.calls[2]
+    assert "INSERT INTO material_sections" in sql
+    assert params[0] == 742
+    sections = json.loads(params[1])
+    assert [(s["ordinal"], s["node_id"], s["depth"]) for s in sections] == [
+        (0, "0001", 0), (1, "0002", 1), (2, "0004", 1),
+    ]
+    assert sections[0]["keywords"] == ["intro"]
+    assert sections[1]["token_count"] == 9
+    assert (sections[2]["start_page"], sections[2]["end_page"]) == (11, 11)
+
+
+def test_store_page_index_tolerates_missing_sections_table():
+    class UndefinedTable(Exception):
+        sqlstate = "42P01"
+
+    class Conn(FakeConn):
+        def execute(self, sql, params):
+            if "material_sections" in sql:
+                raise UndefinedTable("relation material_sections does not exist")
+            super().execute(sql, params)
+
+    conn = Conn()
+    store_page_index(conn, 1, {"doc_type": "reading", "nodes": [{"start_page": 1}]})
+
+    assert len(conn.calls) == 1
+
+
+def test_load_enrichment_cache_maps_keys_and_tolerates_missing_table():
+    class Cursor:
+        def fetchall(self):
+            return [{"cache_key": "abc", "payload": {"summary": "s", "keywords": ["k"]}}]
+
+    class Conn(FakeConn):
+        def execute(self, sql, params):
+            super().execute(sql, params)
+            return Cursor()
+
+    conn = Conn()
+    assert load_enrichment_cache(conn, ["abc", "def"]) == {"abc": {"summary": "s", "keywords": ["k"]}}
+    sql, params = conn.calls[0]
+    assert "last_hit_at = now()" in sql and params == (["abc", "def"],)
+    assert load_enrichment_cache(conn, []) == {}
+    assert len(conn.calls) == 1
+
+    class UndefinedTable(Exception):
+        sqlstate = "42P01"
+
+    class MissingConn(FakeConn):
+        def execute(self, sql, params):
+            raise UndefinedTable("relation index_enrichment_cache does not exist")
+
+    assert load_enrichment_cache(MissingConn(), ["abc"]) == {}
+
+
+def test_store_enrichment_cache_inserts_one_batch():
+    conn = FakeConn()
+    store_enrichment_cache(conn, {"abc": ("node", {"summary": "s", "keywords": []})})
+    store_enrichment_cache(conn, {})
+
+    assert len(conn.calls) == 1
+    sql, params = conn.calls[0]
+    assert "ON CONFLICT (cache_key) DO NOTHING" in sql
+    assert json.loads(params[0]) == [
+        {"cache_key": "abc", "kind": "node", "payload": {"summary": "s", "keywords": []}}
+    ]
+
+
+def test_get_db_reuses_warm_connection_and_reconnects_when_closed(monkeypatch):
+    class Conn:
+        def __init__(self):
+            self.closed = False
+            self.commits = 0
+            self.rollbacks = 0
+
+        def commit(self):
+            self.commits += 1
+
+        def rollback(self):
+            self.rollbacks += 1
+
+        def close(self):
+            self.closed = True
+
+    connects = []
+
+    def fake_connect():
+        connects.append(Conn())
+        return connects[-1]
+
+    monkeypatch.setattr(db, "_connect", fake_connect)
+    monkeypatch.setattr(db, "_CONN", None)
+    monkeypatch.setenv("INDEX_DB_PING_AFTER_SECONDS", "600")
+
+    with db.get_db() as first:
+        pass
+    try:
+        with db.get_db() as second:
+            raise RuntimeError("store failed")
+    except RuntimeError:
+        pass
+
+    assert first is second and len(connects) == 1
+    assert (first.commits, first.rollbacks) == (1, 1)
+
+    first.closed = True
+    with db.get_db() as third:
+        pass
+    assert third is not first and len(connects) == 2
@@ -4,36 +4,22 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 from unittest.mock import patch, MagicMock
 from llm_client import (
     build_doc_summary_prompt,
-    build_node_keywords_prompt,
-    build_node_summary_prompt,
+    build_node_enrichment_prompt,
+    build_packed_enrichment_prompt,
     describe_visuals,
+    enrich_node,
+    enrich_nodes,
     extract_tags,
     summarize,
 )
 
 
-def test_node_summary_prompt_for_slides():
-    prompt = build_node_summary_prompt("lecture_slide", "Chain Rule\n\ndy/dx = dy/du * du/dx")
-    assert "120 tokens" in prompt or "equation" in prompt.lower() or "concept" in prompt.lower()
-
-
-def test_node_summary_prompt_for_hw():
-    prompt = build_node_summary_prompt("hw_instruction", "Problem 1\nDerive the gradient.")
-    assert "concept" in prompt.lower() or "problem" in prompt.lower()
-
-
 def test_doc_summary_prompt_includes_nodes():
     prompt = build_doc_summary_prompt("Lecture 5", "lecture_slide", ["Intro", "Backprop", "Conclusion"])
     assert "Lecture 5" in prompt
     assert "Intro" in prompt
 
 
-def test_build_node_keywords_prompt_requests_json_array():
-    prompt = build_node_keywords_prompt("reading", "Transformer attention datasets")
-    assert "JSON array" in prompt
-    assert "Transformer attention datasets" in prompt
-
-
 def test_summarize_calls_openai_and_returns_text():
     mock_resp = MagicMock()
     mock_resp.json.return_value = {
@@ -41,7 +27,7 @@ def test_summarize_calls_openai_and_returns_text():
     }
     mock_resp.raise_for_status = MagicMock()
 
-    with patch("llm_client.requests.post", return_value=mock_resp) as mock_post:
+    with patch("llm_client._HTTP.post", return_value=mock_resp) as mock_post:
         result = summarize("Some prompt", "sk-test")
         assert result == "Summary of content."
         mock_post.assert_called_once()
@@ -56,7 +42,7 @@ def test_extract_tags_parses_json_array():
     }
     mock_resp.raise_for_status = MagicMock()
 
-    with patch("llm_client.requests.post", return_value=mock_resp):
+    with patch("llm_client._HTTP.post", return_value=mock_resp):
         tags = extract_tags("extract tags prompt", "sk-test")
     assert "backpropagation" in tags
     assert "chain-rule" in tags
@@ -69,7 +55,7 @@ def test_extract_tags_returns_empty_on_bad_json():
     }
     mock_resp.raise_for_status = MagicMock()
 
-    with patch("llm_client.requests.post", return_value=mock_resp):
+    with patch("llm_client._HTTP.post", return_value=mock_resp):
         tags = extract_tags("prompt", "sk-test")
     assert tags == []
 
@@ -81,7 +67,7 @@ def test_describe_visuals_sends_multimodal_message():
     }
     mock_resp.raise_for_status = MagicMock()
 
-    with patch("llm_client.requests.post", return_value=mock_resp) as mock_post:
+    with patch("llm_client._HTTP.post", return_value=mock_resp) as mock_post:
         result = describe_visuals("abc123base64encoded", "sk-test")
 
     assert "visual_summary" in result
@@ -92,3 +78,37 @@ def test_describe_visuals_sends_multimodal_message():
     assert any(c.get("type") == "text" for c in content)
     image_part = next(c for c in content if c.get("type") == "image_url")
     assert "abc123base64encoded" in image_part["image_url"]["url"]
+
+
+def test_enrich_node_requests_json_and_normalizes_keywords():
+    mock_resp = MagicMock()
+    mock_resp.json.return_value = {
+        "choices": [{"message": {"content": '{"summary": " Chain rule. ", "keywords": ["Chain-Rule", ""]}'}}]
+    }
+    mock_resp.raise_for_status = MagicMock()
+    prompt = build_node_enrichment_prompt("lecture_slide", "x" * 10_000)
+
+    with patch("llm_client._HTTP.post", return_value=mock_resp) as mock_post:
+        result = enrich_node(prompt, "sk-test")
+
+    assert result == {"summary": "Chain rule.", "keywords": ["chain-rule"]}
+    assert "x" * 4000 in prompt and "x" * 4001 not in prompt
+    assert mock_post.call_args[1]["json"]["response_format"] == {"type": "json_object"}
+
+
+def test_enrich_nodes_keeps_only_requested_ids():
+    mock_resp = MagicMock()
+    mock_resp.json.return_value = {
+        "choices": [{"message": {"content": (
+            '{"sections": [{"id": "1", "summary": "a", "keywords": ["k"]},'
+            ' {"id": "9", "summary": "stray", "keywords": []}]}'
+        )}}]
+    }
+    mock_resp.raise_for_status = MagicMock()
+    prompt = build_packed_enrichment_prompt("lecture_slide", [("1", "alpha"), ("2", "beta")])
+
+    with patch("llm_client._HTTP.post", return_value=mock_resp):
+        result = enrich_nodes(prompt, "sk-test", ["1", "2"])
+
+    assert "[Section 1]\nalpha" in prompt and "[Section 2]\nbeta" in prompt
+    assert result == {"1": {"summary": "a", "keywords": ["k"]}}
@@ -0,0 +1,163 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import page_model
+from page_model import PageSpan, ParsedDocument, ParsedPage, parse_pdf
+
+
+class _FakeCounter:
+    def estimate_text(self, text):
+        return max(1, len(text or "") // 4)
+
+
+class _FakePage:
+    def __init__(self, spans):
+        self.rect = types.SimpleNamespace(height=100.0)
+        self._spans = spans
+
+    def get_images(self, full=False):
+        return [object()] if self._spans else []
+
+    def get_text(self, kind):
+        assert kind == "dict"
+        return {"blocks": [{"lines": [{"spans": self._spans}]}]}
+
+
+class _FakeDoc:
+    def __init__(self, pages):
+        self.pages = pages
+        self.closed = False
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __getitem__(self, index):
+        return self.pages[index]
+
+    def close(self):
+        self.closed = True
+
+
+def test_parse_pdf_opens_once_and_shares_header_info(monkeypatch):
+    heading = {"text": "Intro", "size": 24.0, "flags": 16, "origin": [0, 10]}
+    tiny = {"text": "footnote", "size": 3.0, "flags": 0, "origin": [0, 90]}
+    doc = _FakeDoc([_FakePage([heading, tiny]), _FakePage([])])
+    opened, hdr_objects, md_calls = [], [], []
+
+    def fake_open(path):
+        opened.append(path)
+        return doc
+
+    def fake_headers(d):
+        hdr_objects.append(object())
+        return hdr_objects[-1]
+
+    def fake_to_markdown(d, pages, hdr_info):
+        md_calls.append((pages, hdr_info))
+        return f"# Page {pages[0] + 1}\n" if pages[0] == 0 else "  "
+
+    monkeypatch.setattr(page_model, "fitz", types.SimpleNamespace(open=fake_open))
+    monkeypatch.setattr(
+        page_model,
+        "pymupdf4llm",
+        types.SimpleNamespace(IdentifyHeaders=fake_headers, to_markdown=fake_to_markdown),
+    )
+    monkeypatch.setattr(page_model, "TokenCounter", _FakeCounter)
+
+    parsed = parse_pdf("/tmp/fake.pdf")
+
+    assert opened == ["/tmp/fake.pdf"]
+    assert doc.closed
+    assert len(hdr_objects) == 1
+    assert [hdr for _pages, hdr in md_calls] == [hdr_objects[0], hdr_objects[0]]
+    assert parsed.page_texts == ["# Page 1", ""]
+    assert parsed.pages[0].spans == [PageSpan(text="Intro", size=24.0, bold=True, y_rel=0.1)]
+    rows = parsed.page_rows()
+    assert [{k: v for k, v in row.items() if k != "content_hash"} for row in rows] == [
+        {"page_number": 1, "text_content": "# Page 1", "has_images": True, "token_count": 2},
+        {"page_number": 2, "text_content": None, "has_images": False, "token_count": 1},
+    ]
+    assert rows[0]["content_hash"] == ParsedPage(1, "# Page 1", True, 0).content_hash
+    assert rows[0]["content_hash"] != ParsedPage(1, "# Page 1", False, 0).content_hash
+    assert parsed.full_markdown() == "# Page 1\n\n---\n\n"
+
+
+def _parsed_slides() -> ParsedDocument:
+    body = [PageSpan(text=f"body {i}", size=11.0, bold=False, y_rel=0.5) for i in range(6)]
+    return ParsedDocument(pages=[
+        ParsedPage(1, "# Lecture\n", False, 2, [PageSpan("Lecture", 30.0, True, 0.1)] + body[:2]),
+        ParsedPage(2, "# Part A\n", False, 2, [PageSpan("Part A", 30.0, True, 0.1)] + body[2:4]),
+        ParsedPage(3, "# Part B\n", False, 2, [PageSpan("Part B", 30.0, True, 0.1)] + body[4:]),
+    ])
+
+
+def test_detector_uses_parsed_spans_without_reopening_pdf(monkeypatch):
+    from hybrid_detector import HybridSectionDetector
+
+    def fail_read(self, pdf_path):
+        raise AssertionError("PDF re-opened")
+
+    monkeypatch.setattr(HybridSectionDetector, "_read_page_spans", fail_read)
+    parsed = _parsed_slides()
+
+    detected = HybridSectionDetector(doc_type="lecture_slide").detect(
+        "/tmp/fake.pdf", parsed.page_texts, parsed=parsed
+    )
+
+    assert [c.page_num for c in detected] == [1, 2, 3]
+    assert all(c.source == "font" for c in detected)
+
+
+def test_slides_build_reuses_parsed_document(monkeypatch):
+    from builders import slides
+
+    monkeypatch.setitem(
+        sys.modules,
+        "page_model",
+        types.SimpleNamespace(parse_pdf=lambda path: (_ for _ in ()).throw(AssertionError("re-parsed"))),
+    )
+    parsed = _parsed_slides()
+
+    index = slides.build("/tmp/fake.pdf", parsed.full_markdown(), parsed=parsed)
+
+    assert index.page_count == 3
+    assert [node.title for node in index.nodes] == ["Lecture", "Part A", "Part B"]
+
+
+def test_shard_ranges_are_contiguous_and_respect_minimum_size():
+    from page_model import MIN_PAGES_PER_SHARD, shard_ranges
+
+    assert shard_ranges(10, 4) == [(0, 10)]
+    ranges = shard_ranges(4 * MIN_PAGES_PER_SHARD + 3, 4)
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0 and ranges[-1][1] == 4 * MIN_PAGES_PER_SHARD + 3
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+def test_sharded_parse_merges_in_page_order_and_recovers_failed_shards(monkeypatch):
+    parent_pid = os.getpid()
+    page_count = 2 * page_model.MIN_PAGES_PER_SHARD
+
+    def fake_open(path):
+        if path == "/tmp/broken.pdf" and os.getpid() != parent_pid:
+            raise RuntimeError("shard cannot open")
+        return _FakeDoc([_FakePage([]) for _ in range(page_count)])
+
+    monkeypatch.setattr(page_model, "fitz", types.SimpleNamespace(open=fake_open))
+    monkeypatch.setattr(
+        page_model,
+        "pymupdf4llm",
+        types.SimpleNamespace(
+            IdentifyHeaders=lambda doc: None,
+            to_markdown=lambda doc, pages, hdr_info: f"page {pages[0] + 1}",
+        ),
+    )
+    monkeypatch.setattr(page_model, "TokenCounter", _FakeCounter)
+
+    for path in ("/tmp/fake.pdf", "/tmp/broken.pdf"):
+        parsed = parse_pdf(path, workers=2)
+        assert [p.page_number for p in parsed.pages] == list(range(1, page_count + 1))
+        assert parsed.page_texts[-1] == f"page {page_count}"
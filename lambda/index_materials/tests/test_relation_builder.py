@@ -2,8 +2,9 @@ import sys, os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 import json
+import re
 from unittest.mock import patch, MagicMock
-from relation_builder import _extract_json, _build_relations_prompt, _filter_relations
+from relation_builder import _extract_json, _build_relations_prompt, _filter_relations, _select_candidates
 
 SAMPLE_TARGET = {
     "material_id": 10,
@@ -74,3 +75,62 @@ def test_build_relations_prompt_target_is_marked():
     prompt = _build_relations_prompt(SAMPLE_TARGET, SAMPLE_OTHERS)
     assert "TARGET" in prompt
     assert "EXISTING" in prompt
+
+
+def _material(material_id, title, summary, tags):
+    return {
+        "material_id": material_id,
+        "material_title": title,
+        "doc_type": "lecture_slide",
+        "material_summary": summary,
+        "metadata_tags": tags,
+    }
+
+
+def test_select_candidates_ranks_by_overlap_and_drops_unrelated():
+    others = [
+        _material(11, "HW 3", "Problems on backpropagation.", ["backpropagation", "gradient-computation"]),
+        _material(12, "Lecture 4: Chain rule", "Chain rule for gradients.", ["chain-rule", "gradient-descent"]),
+        _material(13, "Syllabus", "Course policies and grading.", ["logistics"]),
+    ]
+
+    candidates = _select_candidates(SAMPLE_TARGET, others, top_k=5)
+    assert [c["material_id"] for c in candidates] == [12, 11]
+    assert [c["material_id"] for c in _select_candidates(SAMPLE_TARGET, others, top_k=1)] == [12]
+
+
+def test_build_course_relations_classifies_candidates_in_bounded_batches(monkeypatch):
+    import asyncio
+    from contextlib import contextmanager
+    import relation_builder
+
+    others = [
+        _material(100 + i, f"Backprop exercise {i}", "Backpropagation practice.", ["backpropagation"])
+        for i in range(9)
+    ] + [_material(200 + i, f"Unrelated {i}", "Course policies.", ["logistics"]) for i in range(50)]
+    stored, calls = [], []
+
+    @contextmanager
+    def fake_db():
+        yield object()
+
+    def fake_summarize(prompt, api_key, max_tokens):
+        ids = [int(m) for m in re.findall(r"ID: (\d+)", prompt) if int(m) != 10]
+        calls.append((ids, max_tokens))
+        return json.dumps([
+            {"source_id": i, "target_id": 10, "relation_type": "prerequisite", "confidence": 0.9}
+            for i in ids
+        ] + [{"source_id": 999, "target_id": 10, "relation_type": "extends", "confidence": 0.9}])
+
+    monkeypatch.setattr(relation_builder, "get_db", fake_db)
+    monkeypatch.setattr(relation_builder, "load_course_materials_for_relations", lambda conn, cid: [SAMPLE_TARGET] + others)
+    monkeypatch.setattr(relation_builder, "store_material_relations", lambda conn, rels: stored.extend(rels))
+    monkeypatch.setattr(relation_builder, "summarize", fake_summarize)
+    monkeypatch.setenv("INDEX_RELATION_TOP_K", "8")
+
+    asyncio.run(relation_builder.build_course_relations(1, 10, "sk"))
+
+    assert [len(ids) for ids, _ in calls] == [relation_builder.RELATION_BATCH_SIZE, 2]
+    assert all(200 > i >= 100 for ids, _ in calls for i in ids)
+    # Hallucinated ids outside the batch are dropped.
+    assert len(stored) == 8 and {r["target_id"] for r in stored} == {10}
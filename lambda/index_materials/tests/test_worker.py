@@ -5,13 +5,20 @@ import asyncio
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
-sys.modules.setdefault("asyncpg", types.SimpleNamespace())
 sys.modules.setdefault("fitz", types.SimpleNamespace(Page=object))
 sys.modules.setdefault("pymupdf4llm", types.SimpleNamespace())
 
 from builders.base import IndexNode, MaterialIndex
-from token_counter import TokenCounter
-from worker import _annotate_index_token_counts, _assign_keywords_all_nodes, _extract_pages, _resolve_section_names
+from worker import (
+    EnrichmentCache,
+    _annotate_index_token_counts,
+    _changed_pages,
+    _enrich_all_nodes,
+    _node_enrichment_keys,
+    _page_rows_to_write,
+    _resolve_section_names,
+    _reusable_enrichment,
+)
 
 
 def test_resolve_section_names_adds_leaf_and_path():
@@ -77,7 +84,7 @@ def test_resolve_section_names_ignores_evidence_leaf_for_page_label():
     assert resolved[0]["section_path"] == ["Methods"]
 
 
-def test_assign_keywords_all_nodes_uses_extractor(monkeypatch):
+def test_enrich_all_nodes_sets_summary_and_keywords_from_one_call(monkeypatch):
     node = IndexNode(
         node_id="node_attention",
         title="Attention",
@@ -87,60 +94,209 @@ def test_assign_keywords_all_nodes_uses_extractor(monkeypatch):
     page_rows = {
         1: {"page_number": 1, "text_content": "Transformer attention datasets"}
     }
+    prompts = []
 
-    monkeypatch.setattr(
-        "worker.extract_keywords",
-        lambda prompt, api_key: ["transformer", "attention", "datasets"],
-    )
+    def fake_enrich(prompt, api_key):
+        prompts.append(prompt)
+        return {"summary": "Attention overview.", "keywords": ["transformer", "attention", "datasets"]}
+
+    monkeypatch.setattr("worker.enrich_node", fake_enrich)
+    monkeypatch.setenv("INDEX_ENRICH_PACK_MAX_NODES", "1")
 
-    asyncio.run(_assign_keywords_all_nodes([node], page_rows, "reading", "sk-test"))
+    asyncio.run(_enrich_all_nodes([node], page_rows, "reading", "sk-test"))
 
+    assert len(prompts) == 1
+    assert node.summary == "Attention overview."
     assert node.keywords == ["transformer", "attention", "datasets"]
 
 
-def test_assign_keywords_all_nodes_falls_back_to_title_words(monkeypatch):
+def test_enrich_all_nodes_falls_back_to_title_words(monkeypatch):
     node = IndexNode(
         node_id="node_gradient_descent",
         title="Gradient Descent",
         start_page=1,
         end_page=1,
     )
+    empty = IndexNode(node_id="node_blank", title="Blank Slide", start_page=2, end_page=2)
     page_rows = {
-        1: {"page_number": 1, "text_content": "optimizer details"}
+        1: {"page_number": 1, "text_content": "optimizer details"},
+        2: {"page_number": 2, "text_content": None},
     }
 
-    def fail_extract(prompt, api_key):
+    def fail_enrich(prompt, api_key):
         raise RuntimeError("api unavailable")
 
-    monkeypatch.setattr("worker.extract_keywords", fail_extract)
+    monkeypatch.setattr("worker.enrich_node", fail_enrich)
+    monkeypatch.setenv("INDEX_ENRICH_PACK_MAX_NODES", "1")
 
-    asyncio.run(_assign_keywords_all_nodes([node], page_rows, "reading", "sk-test"))
+    asyncio.run(_enrich_all_nodes([node, empty], page_rows, "reading", "sk-test"))
 
+    assert node.summary == ""
     assert node.keywords == ["gradient", "descent"]
+    assert empty.summary == ""
+    assert empty.keywords == ["blank", "slide"]
+
+
+def test_enrich_all_nodes_packs_small_siblings_and_retries_omitted_ones(monkeypatch):
+    slides = [
+        IndexNode(node_id=f"node_{i}", title=f"Slide {i}", start_page=i, end_page=i)
+        for i in range(1, 4)
+    ]
+    page_rows = {
+        i: {"page_number": i, "text_content": f"short slide text {i}"} for i in range(1, 4)
+    }
+    packed_calls, single_calls = [], []
+
+    def fake_enrich_nodes(prompt, api_key, keys):
+        packed_calls.append(keys)
+        # The model skipped section "2".
+        return {
+            "1": {"summary": "one", "keywords": ["first"]},
+            "3": {"summary": "three", "keywords": ["third"]},
+        }
+
+    def fake_enrich(prompt, api_key):
+        single_calls.append(prompt)
+        return {"summary": "two", "keywords": ["second"]}
+
+    monkeypatch.setattr("worker.enrich_nodes", fake_enrich_nodes)
+    monkeypatch.setattr("worker.enrich_node", fake_enrich)
+    monkeypatch.setenv("INDEX_ENRICH_PACK_MAX_NODES", "4")
+
+    asyncio.run(_enrich_all_nodes(slides, page_rows, "lecture_slide", "sk-test"))
+
+    assert packed_calls == [["1", "2", "3"]]
+    assert len(single_calls) == 1 and "short slide text 2" in single_calls[0]
+    assert [n.summary for n in slides] == ["one", "two", "three"]
+    assert [n.keywords for n in slides] == [["first"], ["second"], ["third"]]
+
+
+def test_enrich_all_nodes_reuses_cached_results_and_records_new_ones(monkeypatch):
+    unchanged = IndexNode(node_id="node_a", title="Slide A", start_page=1, end_page=1)
+    edited = IndexNode(node_id="node_b", title="Slide B", start_page=2, end_page=2)
+    failing = IndexNode(node_id="node_c", title="Slide C", start_page=3, end_page=3)
+    page_rows = {
+        1: {"page_number": 1, "text_content": "same text as last time"},
+        2: {"page_number": 2, "text_content": "edited slide text"},
+        3: {"page_number": 3, "text_content": "model will fail here"},
+    }
+    keys = _node_enrichment_keys([unchanged, edited, failing], page_rows, "lecture_slide")
+    cache = EnrichmentCache({keys[0]: {"summary": "cached", "keywords": ["old"]}})
+    prompts = []
+
+    def fake_enrich(prompt, api_key):
+        prompts.append(prompt)
+        if "model will fail" in prompt:
+            raise RuntimeError("api unavailable")
+        return {"summary": "fresh", "keywords": ["new"]}
+
+    monkeypatch.setattr("worker.enrich_node", fake_enrich)
+    monkeypatch.setenv("INDEX_ENRICH_PACK_MAX_NODES", "1")
+
+    asyncio.run(_enrich_all_nodes([unchanged, edited, failing], page_rows, "lecture_slide", "sk", cache))
+
+    assert len(prompts) == 2
+    assert (unchanged.summary, unchanged.keywords) == ("cached", ["old"])
+    assert (edited.summary, edited.keywords) == ("fresh", ["new"])
+    assert cache.hits == 1
+    # Failures are not cached, so the next run retries them.
+    assert cache.fresh == {keys[1]: ("node", {"summary": "fresh", "keywords": ["new"]})}
+
 
+def test_enrich_all_nodes_runs_waves_with_checkpoint_hook(monkeypatch):
+    import worker
 
-def test_extract_pages_sets_token_count(monkeypatch):
-    class FakePage:
-        def get_images(self, full=False):
-            return []
+    nodes = [IndexNode(node_id=f"n{i}", title=f"Slide {i}", start_page=i, end_page=i) for i in range(1, 6)]
+    page_rows = {i: {"page_number": i, "text_content": f"slide text {i}"} for i in range(1, 6)}
+    completed, waves = [], []
 
-    class FakeDoc:
-        def __len__(self):
-            return 1
+    def fake_enrich(prompt, api_key):
+        completed.append(prompt)
+        return {"summary": "s", "keywords": ["k"]}
 
-        def __getitem__(self, index):
-            return FakePage()
+    async def on_wave():
+        waves.append(len(completed))
+
+    monkeypatch.setattr("worker.enrich_node", fake_enrich)
+    monkeypatch.setattr(worker, "ENRICH_WAVE_TASKS", 2)
+    monkeypatch.setenv("INDEX_ENRICH_PACK_MAX_NODES", "1")
+
+    asyncio.run(_enrich_all_nodes(nodes, page_rows, "lecture_slide", "sk", on_wave=on_wave))
+
+    assert waves == [2, 4, 5]
+
+
+def _snapshot(pages, nodes=None, doc_type="reading"):
+    return {
+        "doc_type": doc_type,
+        "index": {"nodes": nodes or []},
+        "pages": {
+            number: {"content_hash": digest, "section_name": "Intro", "section_path": ["Intro"]}
+            for number, digest in pages.items()
+        },
+    }
+
+
+def test_changed_pages_diffs_hashes_and_flags_removed_pages():
+    rows = [
+        {"page_number": 1, "content_hash": "a", "section_name": "Intro", "section_path": ["Intro"]},
+        {"page_number": 2, "content_hash": "B", "section_name": "Intro", "section_path": ["Intro"]},
+    ]
+    snapshot = _snapshot({1: "a", 2: "b", 3: "c"})
+
+    assert _changed_pages(snapshot, rows, "reading") == {2, 3}
+    assert _changed_pages(snapshot, rows, "lecture_slide") is None
+    assert _changed_pages(None, rows, "reading") is None
+    # Rows written before migration 013 have no hash: re-index everything.
+    assert _changed_pages(_snapshot({1: "a", 2: None}), rows, "reading") is None
+
+    rows[0]["section_name"] = "Background"
+    assert [row["page_number"] for row in _page_rows_to_write(snapshot, rows, {2, 3})] == [1, 2]
+
+
+def test_reusable_enrichment_skips_nodes_spanning_changed_pages():
+    nodes = [
+        {"node_id": "n1", "start_page": 1, "end_page": 4, "summary": "whole", "keywords": ["w"], "nodes": [
+            {"node_id": "n2", "start_page": 1, "end_page": 2, "summary": "first", "keywords": ["f"]},
+            {"node_id": "n3", "start_page": 3, "end_page": 4, "summary": "second", "keywords": []},
+        ]},
+    ]
+
+    assert _reusable_enrichment({"nodes": nodes}, {3}) == {"n2": {"summary": "first", "keywords": ["f"]}}
+
+
+def test_reusable_enrichment_retries_nodes_without_summary():
+    nodes = [
+        {"node_id": "n1", "start_page": 1, "end_page": 1, "summary": "", "keywords": ["slide"]},
+        {"node_id": "n2", "start_page": 2, "end_page": 2, "summary": "kept", "keywords": ["k"]},
+    ]
+
+    assert _reusable_enrichment({"nodes": nodes}, set()) == {"n2": {"summary": "kept", "keywords": ["k"]}}
+
+
+def test_enrich_all_nodes_keeps_reused_nodes_without_calls(monkeypatch):
+    kept = IndexNode(node_id="node_a", title="Slide A", start_page=1, end_page=1)
+    edited = IndexNode(node_id="node_b", title="Slide B", start_page=2, end_page=2)
+    page_rows = {
+        1: {"page_number": 1, "text_content": "unchanged"},
+        2: {"page_number": 2, "text_content": "edited"},
+    }
+    prompts = []
 
-        def close(self):
-            pass
+    def fake_enrich(prompt, api_key):
+        prompts.append(prompt)
+        return {"summary": "fresh", "keywords": ["new"]}
 
-    import types as _types
-    monkeypatch.setattr("worker.fitz", _types.SimpleNamespace(open=lambda path: FakeDoc()))
-    monkeypatch.setattr("worker.pymupdf4llm", _types.SimpleNamespace(to_markdown=lambda doc, pages: "a" * 400))
+    monkeypatch.setattr("worker.enrich_node", fake_enrich)
+    monkeypatch.setenv("INDEX_ENRICH_PACK_MAX_NODES", "1")
+    reuse = {"node_a": {"summary": "stored", "keywords": ["old"]}}
 
-    rows = _extract_pages("/tmp/fake.pdf")
+    assert len(_node_enrichment_keys([kept, edited], page_rows, "lecture_slide", reuse)) == 1
+    asyncio.run(_enrich_all_nodes([kept, edited], page_rows, "lecture_slide", "sk", reuse=reuse))
 
-    assert rows[0]["token_count"] == TokenCounter().estimate_text("a" * 400)
+    assert len(prompts) == 1 and "edited" in prompts[0]
+    assert (kept.summary, kept.keywords) == ("stored", ["old"])
+    assert edited.summary == "fresh"
 
 
 def test_annotate_index_token_counts_sets_node_span_tokens():
@@ -1,27 +1,34 @@
 import asyncio
+import functools
 import logging
 import os
 import re
 import tempfile
 
-import asyncpg
-import fitz
-import pymupdf4llm
-
 from builders import route_builder
+from checkpoint import STAGE_PARSED, STAGE_STORED, IndexYield
+from page_model import parse_pdf
 from token_counter import TokenCounter
 from db import (
+    delete_page_rows_after,
+    get_db,
+    load_enrichment_cache,
+    load_index_snapshot,
     store_course_index,
+    store_enrichment_cache,
     store_metadata_tags,
     store_page_index,
     store_page_texts,
 )
 from llm_client import (
+    ENRICHMENT_TEXT_CHARS,
     build_doc_summary_prompt,
     build_metadata_tags_prompt,
-    build_node_keywords_prompt,
-    build_node_summary_prompt,
-    extract_keywords,
+    build_node_enrichment_prompt,
+    build_packed_enrichment_prompt,
+    enrich_node,
+    enrich_nodes,
+    enrichment_cache_key,
     extract_tags,
     get_api_key,
     summarize,
@@ -30,6 +37,10 @@ from relation_builder import build_course_relations
 
 logger = logging.getLogger(__name__)
 SUMMARY_CONCURRENCY = 4
+# Sibling nodes with at most this much text share one enrichment request.
+ENRICH_PACK_NODE_CHARS = 1200
+# Enrichment requests per wave when checkpointing; results are flushed between waves.
+ENRICH_WAVE_TASKS = SUMMARY_CONCURRENCY * 4
 _KEYWORD_STOPWORDS = {
     "and",
     "for",
@@ -41,10 +52,6 @@ _KEYWORD_STOPWORDS = {
 }
 
 
-def _has_images(page: fitz.Page) -> bool:
-    return bool(page.get_images(full=False))
-
-
 def _resolve_section_names(page_rows: list[dict], material_index) -> list[dict]:
     """Stamp each page row with nearest section title and full breadcrumb path."""
 
@@ -76,26 +83,6 @@ def _resolve_section_names(page_rows: list[dict], material_index) -> list[dict]:
     return result
 
 
-def _extract_pages(pdf_path: str) -> list[dict]:
-    doc = fitz.open(pdf_path)
-    try:
-        pages = []
-        for i in range(len(doc)):
-            page = doc[i]
-            md = pymupdf4llm.to_markdown(doc, pages=[i]).strip()
-            pages.append(
-                {
-                    "page_number": i + 1,
-                    "text_content": md or None,
-                    "has_images": _has_images(page),
-                    "token_count": TokenCounter().estimate_text(md),
-                }
-            )
-        return pages
-    finally:
-        doc.close()
-
-
 def _annotate_index_token_counts(material_index, page_rows: dict[int, dict]) -> None:
     TokenCounter().annotate_material_index(material_index, page_rows)
 
@@ -114,71 +101,264 @@ def _fallback_node_keywords(title: str) -> list[str]:
     return [word for word in words if word not in _KEYWORD_STOPWORDS][:15]
 
 
-async def _summarize_node(
+class EnrichmentCache:
+    """Content-addressed enrichment results for one document.
+
+    Entries are preloaded from index_enrichment_cache; results the model
+    produces during this run are also kept in `fresh` for write-back.
+    """
+
+    def __init__(self, entries: dict | None = None):
+        self.entries = dict(entries or {})
+        self.fresh: dict[str, tuple[str, dict]] = {}
+        self.hits = 0
+
+    def get(self, key: str) -> dict | None:
+        payload = self.entries.get(key)
+        if payload is not None:
+            self.hits += 1
+        return payload
+
+    def put(self, key: str, kind: str, payload: dict) -> None:
+        self.entries[key] = payload
+        self.fresh[key] = (kind, payload)
+
+
+def _load_enrichment_cache(keys: list[str]) -> dict[str, dict]:
+    try:
+        with get_db() as conn:
+            return load_enrichment_cache(conn, keys)
+    except Exception as exc:
+        logger.warning("Enrichment cache lookup failed: %s", exc)
+        return {}
+
+
+def _node_cache_key(doc_type: str, text: str) -> str:
+    return enrichment_cache_key("node", doc_type, text[:ENRICHMENT_TEXT_CHARS])
+
+
+def _node_enrichment_keys(nodes, page_rows: dict, doc_type: str, skip=()) -> list[str]:
+    keys = []
+    for node in nodes:
+        text = _node_page_text(node, page_rows).strip() if node.node_id not in skip else ""
+        if text:
+            keys.append(_node_cache_key(doc_type, text))
+        keys.extend(_node_enrichment_keys(node.nodes, page_rows, doc_type, skip))
+    return keys
+
+
+def _flush_enrichment_cache(cache: EnrichmentCache) -> None:
+    """Persist results gathered so far, so a resumed run finds them in the cache."""
+    if not cache.fresh:
+        return
+    try:
+        with get_db() as conn:
+            store_enrichment_cache(conn, cache.fresh)
+        cache.fresh = {}
+    except Exception as exc:
+        logger.warning("Enrichment cache flush failed: %s", exc)
+
+
+def _yield_if_out_of_time(checkpoint, parsed, stage: str, cache: EnrichmentCache | None = None) -> None:
+    if checkpoint is None or not checkpoint.out_of_time():
+        return
+    if cache is not None:
+        _flush_enrichment_cache(cache)
+    if stage == STAGE_STORED:
+        checkpoint.save(None, STAGE_STORED)
+    elif not checkpoint.saved:
+        checkpoint.save(parsed, STAGE_PARSED)
+    raise IndexYield(stage)
+
+
+def _load_index_snapshot(material_id: int, course_id: int | None) -> dict | None:
+    try:
+        with get_db() as conn:
+            return load_index_snapshot(conn, material_id, course_id)
+    except Exception as exc:
+        logger.warning("Previous index lookup failed: %s", exc)
+        return None
+
+
+def _changed_pages(snapshot: dict | None, page_rows_list: list[dict], doc_type: str) -> set[int] | None:
+    """Page numbers whose content differs from the stored index, including pages
+    past the new end of the document; None when a full re-index is needed."""
+    if not snapshot or snapshot.get("doc_type") != doc_type:
+        return None
+    stored = snapshot["pages"]
+    if any(not page.get("content_hash") for page in stored.values()):
+        return None
+    changed = {
+        row["page_number"]
+        for row in page_rows_list
+        if (stored.get(row["page_number"]) or {}).get("content_hash") != row.get("content_hash")
+    }
+    changed.update(page for page in stored if page > len(page_rows_list))
+    return changed
+
+
+def _page_rows_to_write(snapshot: dict, page_rows_list: list[dict], changed: set[int]) -> list[dict]:
+    """Rows whose content changed or whose section assignment moved."""
+    stored = snapshot["pages"]
+    rows = []
+    for row in page_rows_list:
+        previous = stored.get(row["page_number"])
+        if (
+            row["page_number"] in changed
+            or previous is None
+            or previous.get("section_name") != row.get("section_name")
+            or previous.get("section_path") != row.get("section_path")
+        ):
+            rows.append(row)
+    return rows
+
+
+def _reusable_enrichment(index_dict: dict, changed: set[int]) -> dict[str, dict]:
+    """node_id -> stored summary and keywords for nodes whose page span misses every
+    changed page. node_id hashes title, span and path, so a match covers the same text.
+    Nodes stored without a summary (a failed enrichment) are left to be enriched again."""
+    reusable = {}
+
+    def _walk(nodes):
+        for node in nodes or []:
+            start = node.get("start_page")
+            end = node.get("end_page") or start
+            if (
+                start is not None
+                and node.get("node_id")
+                and node.get("summary")
+                and not any(start <= page <= end for page in changed)
+            ):
+                reusable[node["node_id"]] = {
+                    "summary": node["summary"],
+                    "keywords": list(node.get("keywords") or []),
+                }
+            _walk(node.get("nodes"))
+
+    _walk(index_dict.get("nodes"))
+    return reusable
+
+
+def _enrich_pack_max_nodes() -> int:
+    """INDEX_ENRICH_PACK_MAX_NODES: small siblings per enrichment request (1 disables packing)."""
+    try:
+        value = int(os.environ.get("INDEX_ENRICH_PACK_MAX_NODES", "4"))
+    except ValueError:
+        return 4
+    return max(1, min(value, 8))
+
+
+def _apply_enrichment(node, result: dict) -> None:
+    node.summary = result.get("summary") or ""
+    keywords = result.get("keywords") or []
+    node.keywords = keywords[:15] if keywords else _fallback_node_keywords(node.title)
+
+
+async def _enrich_node(
     node,
-    page_rows: dict,
+    text: str,
+    key: str,
     doc_type: str,
     api_key: str,
     sem: asyncio.Semaphore,
+    cache: EnrichmentCache,
 ) -> None:
     async with sem:
-        combined = _node_page_text(node, page_rows)
-        if not combined.strip():
-            node.summary = ""
-            return
-        prompt = build_node_summary_prompt(doc_type, combined)
+        prompt = build_node_enrichment_prompt(doc_type, text)
         try:
-            node.summary = await asyncio.to_thread(summarize, prompt, api_key)
+            result = await asyncio.to_thread(enrich_node, prompt, api_key)
         except Exception as exc:
-            logger.warning("Node summarization failed: %s", exc)
-            node.summary = ""
+            logger.warning("Node enrichment failed: %s", exc)
+            result = {}
+    if result.get("summary") or result.get("keywords"):
+        cache.put(key, "node", result)
+    _apply_enrichment(node, result)
 
 
-async def _assign_node_keywords(
-    node,
-    page_rows: dict,
+async def _enrich_node_pack(
+    pack: list[tuple],
     doc_type: str,
     api_key: str,
     sem: asyncio.Semaphore,
+    cache: EnrichmentCache,
 ) -> None:
+    sections = [(str(i), text) for i, (_node, text, _key) in enumerate(pack, start=1)]
     async with sem:
-        combined = _node_page_text(node, page_rows).strip()
-        section_text = combined or node.title
-        prompt = build_node_keywords_prompt(doc_type, section_text)
+        prompt = build_packed_enrichment_prompt(doc_type, sections)
         try:
-            keywords = await asyncio.to_thread(extract_keywords, prompt, api_key)
+            results = await asyncio.to_thread(enrich_nodes, prompt, api_key, [key for key, _ in sections])
         except Exception as exc:
-            logger.warning("Node keyword extraction failed: %s", exc)
-            keywords = []
-        node.keywords = keywords[:15] if keywords else _fallback_node_keywords(node.title)
-
-
-async def _summarize_all_nodes(nodes, page_rows: dict, doc_type: str, api_key: str) -> None:
-    sem = asyncio.Semaphore(SUMMARY_CONCURRENCY)
-    tasks = []
-
-    def _collect(current_nodes):
-        for node in current_nodes:
-            tasks.append(_summarize_node(node, page_rows, doc_type, api_key, sem))
-            _collect(node.nodes)
+            logger.warning("Packed node enrichment failed: %s", exc)
+            results = {}
+    missing = []
+    for (section_id, _text), (node, text, key) in zip(sections, pack):
+        result = results.get(section_id)
+        if result and (result.get("summary") or result.get("keywords")):
+            cache.put(key, "node", result)
+            _apply_enrichment(node, result)
+        else:
+            missing.append(_enrich_node(node, text, key, doc_type, api_key, sem, cache))
+    if missing:
+        await asyncio.gather(*missing)
 
-    _collect(nodes)
-    if tasks:
-        await asyncio.gather(*tasks)
 
+async def _enrich_all_nodes(
+    nodes,
+    page_rows: dict,
+    doc_type: str,
+    api_key: str,
+    cache: EnrichmentCache | None = None,
+    reuse: dict[str, dict] | None = None,
+    on_wave=None,
+) -> None:
+    """Fill summary and keywords for every node from the previous index (reuse),
+    the cache, or with one JSON call per node or per pack of small siblings.
 
-async def _assign_keywords_all_nodes(nodes, page_rows: dict, doc_type: str, api_key: str) -> None:
+    With on_wave, requests run in waves of ENRICH_WAVE_TASKS and the coroutine
+    on_wave() is awaited after each one (the worker's checkpoint hook)."""
+    cache = cache if cache is not None else EnrichmentCache()
+    reuse = reuse or {}
     sem = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    pack_max = _enrich_pack_max_nodes()
     tasks = []
 
-    def _collect(current_nodes):
-        for node in current_nodes:
-            tasks.append(_assign_node_keywords(node, page_rows, doc_type, api_key, sem))
+    def _flush(pack):
+        if len(pack) == 1:
+            node, text, key = pack[0]
+            tasks.append(functools.partial(_enrich_node, node, text, key, doc_type, api_key, sem, cache))
+        elif pack:
+            tasks.append(functools.partial(_enrich_node_pack, list(pack), doc_type, api_key, sem, cache))
+        pack.clear()
+
+    def _collect(siblings):
+        pack = []
+        for node in siblings:
+            if node.node_id in reuse:
+                _apply_enrichment(node, reuse[node.node_id])
+                _collect(node.nodes)
+                continue
+            text = _node_page_text(node, page_rows).strip()
+            key = _node_cache_key(doc_type, text) if text else None
+            cached = cache.get(key) if key else None
+            if not text:
+                _apply_enrichment(node, {})
+            elif cached is not None:
+                _apply_enrichment(node, cached)
+            elif pack_max > 1 and len(text) <= ENRICH_PACK_NODE_CHARS:
+                pack.append((node, text, key))
+                if len(pack) >= pack_max:
+                    _flush(pack)
+            else:
+                tasks.append(functools.partial(_enrich_node, node, text, key, doc_type, api_key, sem, cache))
             _collect(node.nodes)
+        _flush(pack)
 
     _collect(nodes)
-    if tasks:
-        await asyncio.gather(*tasks)
+    wave = ENRICH_WAVE_TASKS if on_wave is not None else max(len(tasks), 1)
+    for start in range(0, len(tasks), wave):
+        await asyncio.gather(*(task() for task in tasks[start:start + wave]))
+        if on_wave is not None:
+            await on_wave()
 
 
 async def index_document(
@@ -188,9 +368,15 @@ async def index_document(
     doc_type: str,
     material_title: str,
     file_bytes: bytes,
+    checkpoint=None,
 ) -> None:
-    db_url = os.environ["DATABASE_URL"]
-    pool = await asyncpg.create_pool(db_url)
+    """Index one PDF. With a checkpoint (see checkpoint.py), progress is
+    persisted and IndexYield raised when the invocation runs low on time."""
+    parsed = checkpoint.load() if checkpoint is not None else None
+    if checkpoint is not None and checkpoint.stage == STAGE_STORED:
+        if course_id:
+            await _build_relations(course_id, material_id)
+        return
     pdf_path = None
 
     try:
@@ -198,64 +384,128 @@ async def index_document(
             tmp.write(file_bytes)
             pdf_path = tmp.name
 
-        page_rows_list = _extract_pages(pdf_path)
-        page_rows = {row["page_number"]: row for row in page_rows_list}
+        # One parse feeds the page rows, the builder and its heading detector.
+        if parsed is None:
+            parsed = parse_pdf(pdf_path)
+            if checkpoint is not None and parsed.page_count >= checkpoint.min_pages:
+                await asyncio.to_thread(checkpoint.save, parsed, STAGE_PARSED)
+        _yield_if_out_of_time(checkpoint, parsed, STAGE_PARSED)
+        page_rows_list = parsed.page_rows()
 
         build_fn = route_builder(doc_type)
-        full_md = "\n\n---\n\n".join(row["text_content"] or "" for row in page_rows_list)
-        material_index = build_fn(pdf_path, full_md)
+        material_index = build_fn(pdf_path, parsed.full_markdown(), parsed=parsed)
 
         page_rows_list = _resolve_section_names(page_rows_list, material_index)
         page_rows = {row["page_number"]: row for row in page_rows_list}
 
+        # Diff against the stored index: unchanged pages keep their rows and
+        # nodes that touch no changed page keep their enrichment.
+        snapshot = await asyncio.to_thread(_load_index_snapshot, material_id, course_id)
+        changed = _changed_pages(snapshot, page_rows_list, doc_type)
+        node_titles = [node.title for node in material_index.nodes]
+        previous_titles = None
+        if changed is None:
+            rows_to_write = page_rows_list
+            reuse = {}
+        else:
+            rows_to_write = _page_rows_to_write(snapshot, page_rows_list, changed)
+            reuse = _reusable_enrichment(snapshot["index"], changed)
+            previous_titles = [node.get("title") for node in snapshot["index"].get("nodes") or []]
+            if (
+                not changed
+                and not rows_to_write
+                and previous_titles == node_titles
+                and (not course_id or snapshot.get("material_summary") is not None)
+            ):
+                logger.info("Material %s unchanged since last index; skipping", material_id)
+                return
+            logger.info(
+                "Incremental re-index of material %s: %d changed pages, %d rows to write, %d nodes reused",
+                material_id, len(changed), len(rows_to_write), len(reuse),
+            )
+
         api_key = get_api_key()
-        await _summarize_all_nodes(material_index.nodes, page_rows, doc_type, api_key)
-        await _assign_keywords_all_nodes(material_index.nodes, page_rows, doc_type, api_key)
+        doc_summary_prompt = build_doc_summary_prompt(material_title, doc_type, node_titles)
+        doc_summary_key = enrichment_cache_key("doc_summary", doc_type, doc_summary_prompt)
+        cache_keys = _node_enrichment_keys(material_index.nodes, page_rows, doc_type, reuse) + [doc_summary_key]
+        enrichment_cache = EnrichmentCache(await asyncio.to_thread(_load_enrichment_cache, cache_keys))
+
+        async def _checkpoint_wave():
+            if checkpoint is not None:
+                await asyncio.to_thread(_flush_enrichment_cache, enrichment_cache)
+                _yield_if_out_of_time(checkpoint, parsed, STAGE_PARSED)
+
+        await _enrich_all_nodes(
+            material_index.nodes, page_rows, doc_type, api_key, enrichment_cache, reuse,
+            on_wave=_checkpoint_wave if checkpoint is not None else None,
+        )
         _annotate_index_token_counts(material_index, page_rows)
 
-        node_titles = [node.title for node in material_index.nodes]
-        doc_summary_prompt = build_doc_summary_prompt(material_title, doc_type, node_titles)
-        try:
-            doc_summary = await asyncio.to_thread(summarize, doc_summary_prompt, api_key)
-        except Exception as exc:
-            logger.warning("Doc summary failed: %s", exc)
-            doc_summary = ""
+        cached = enrichment_cache.get(doc_summary_key)
+        if previous_titles == node_titles and snapshot.get("material_summary"):
+            # The doc summary prompt only sees the top-level titles.
+            doc_summary = snapshot["material_summary"]
+        elif cached is not None:
+            doc_summary = cached.get("summary") or ""
+        else:
+            try:
+                doc_summary = await asyncio.to_thread(summarize, doc_summary_prompt, api_key)
+                enrichment_cache.put(doc_summary_key, "doc_summary", {"summary": doc_summary})
+            except Exception as exc:
+                logger.warning("Doc summary failed: %s", exc)
+                doc_summary = ""
 
         tags_prompt = build_metadata_tags_prompt(
             material_title, doc_type, doc_summary, node_titles
         )
-        try:
-            metadata_tags = await asyncio.to_thread(extract_tags, tags_prompt, api_key)
-        except Exception as exc:
-            logger.warning("Tag extraction failed: %s", exc)
-            metadata_tags = []
-
-        async with pool.acquire() as conn:
-            await asyncio.to_thread(
-                _sync_store,
-                conn,
-                material_id,
-                course_id,
-                material_title,
-                doc_type,
-                material_index,
-                page_rows_list,
-                doc_summary,
-                metadata_tags,
-            )
-
-        if course_id:
+        tags_key = enrichment_cache_key("metadata_tags", doc_type, tags_prompt)
+        enrichment_cache.entries.update(await asyncio.to_thread(_load_enrichment_cache, [tags_key]))
+        cached = enrichment_cache.get(tags_key)
+        if previous_titles == node_titles and snapshot.get("metadata_tags") and (
+            doc_summary == snapshot.get("material_summary")
+        ):
+            metadata_tags = list(snapshot["metadata_tags"])
+        elif cached is not None:
+            metadata_tags = list(cached.get("tags") or [])
+        else:
             try:
-                await build_course_relations(
-                    db_url=os.environ["DATABASE_URL"],
-                    course_id=course_id,
-                    updated_material_id=material_id,
-                    api_key=api_key,
-                )
+                metadata_tags = await asyncio.to_thread(extract_tags, tags_prompt, api_key)
+                if metadata_tags:
+                    enrichment_cache.put(tags_key, "metadata_tags", {"tags": metadata_tags})
             except Exception as exc:
-                logger.warning("Relation building failed: %s", exc)
+                logger.warning("Tag extraction failed: %s", exc)
+                metadata_tags = []
+        logger.info(
+            "Enrichment cache for material %s: %d hits, %d new results",
+            material_id, enrichment_cache.hits, len(enrichment_cache.fresh),
+        )
+
+        _yield_if_out_of_time(checkpoint, parsed, STAGE_PARSED, enrichment_cache)
+        await asyncio.to_thread(
+            _sync_store,
+            material_id,
+            course_id,
+            material_title,
+            doc_type,
+            material_index,
+            rows_to_write,
+            doc_summary,
+            metadata_tags,
+            enrichment_cache.fresh,
+        )
+
+        # Relations depend only on the summary and tags of each material.
+        relations_stale = (
+            not snapshot
+            or doc_summary != snapshot.get("material_summary")
+            or sorted(metadata_tags) != sorted(snapshot.get("metadata_tags") or [])
+        )
+        if course_id and not relations_stale:
+            logger.info("Summary and tags of material %s unchanged; keeping relations", material_id)
+        elif course_id:
+            _yield_if_out_of_time(checkpoint, parsed, STAGE_STORED)
+            await _build_relations(course_id, material_id, api_key)
     finally:
-        await pool.close()
         if pdf_path:
             try:
                 os.unlink(pdf_path)
@@ -263,8 +513,18 @@ async def index_document(
                 pass
 
 
+async def _build_relations(course_id: int, material_id: int, api_key: str | None = None) -> None:
+    try:
+        await build_course_relations(
+            course_id=course_id,
+            updated_material_id=material_id,
+            api_key=api_key or get_api_key(),
+        )
+    except Exception as exc:
+        logger.warning("Relation building failed: %s", exc)
+
+
 def _sync_store(
-    _async_conn,
     material_id,
     course_id,
     material_title,
@@ -273,12 +533,12 @@ def _sync_store(
     page_rows_list,
     doc_summary,
     metadata_tags,
+    enrichment_entries=None,
 ) -> None:
-    import psycopg
-
-    db_url = os.environ["DATABASE_URL"]
-    with psycopg.connect(db_url, row_factory=psycopg.rows.dict_row) as sync_conn:
+    """Write every row for one document in a single transaction."""
+    with get_db() as sync_conn:
         store_page_texts(sync_conn, material_id, page_rows_list)
+        delete_page_rows_after(sync_conn, material_id, material_index.page_count)
         store_page_index(sync_conn, material_id, material_index.to_dict())
         if course_id:
             store_course_index(
@@ -292,4 +552,4 @@ def _sync_store(
             )
             if metadata_tags:
                 store_metadata_tags(sync_conn, course_id, material_id, metadata_tags)
-        sync_conn.commit()
+        store_enrichment_cache(sync_conn, enrichment_entries or {})
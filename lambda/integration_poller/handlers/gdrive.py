@@ -267,9 +267,9 @@ def _update_material_after_upload(material_id, s3_key, modified_time):
     with get_db() as db:
         db.execute("""
             UPDATE materials
-            SET file_url = %s, external_last_edited = %s, updated_at = CURRENT_TIMESTAMP
+            SET file_url = %s, s3_key = %s, external_last_edited = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = %s
-        """, (file_url, modified_time, material_id))
+        """, (file_url, s3_key, modified_time, material_id))
     print(f'[gdrive_handler] Updated material after upload material_id={material_id} file_url={file_url}')
 
 
@@ -0,0 +1,15 @@
+-- Migration: 010_routing_index_cache
+-- Shared cache of the formatted PageIndex routing block (api/llm.py
+-- _load_routing_block). One row per (course, material scope); `version` is
+-- derived from course_material_index / material_page_index updated_at, so any
+-- indexer write makes the stored block stale without explicit invalidation.
+-- Idempotent — safe to re-run.
+
+CREATE TABLE IF NOT EXISTS routing_index_cache (
+  course_id     INTEGER NOT NULL REFERENCES courses(id) ON DELETE CASCADE,
+  scope_key     TEXT NOT NULL,
+  version       TEXT NOT NULL,
+  routing_block TEXT NOT NULL,
+  updated_at    TIMESTAMP NOT NULL DEFAULT now(),
+  PRIMARY KEY (course_id, scope_key)
+);
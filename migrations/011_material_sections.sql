@@ -0,0 +1,67 @@
+-- Migration: 011_material_sections
+-- Flattened, one-row-per-node copy of material_page_index.index_json so the
+-- PageIndex readers (api/pageindex_retrieval.py) can answer "narrowest section
+-- covering page P" and "routing sections for course C" with indexed range
+-- queries instead of walking JSONB trees in Python. Written by the indexer
+-- alongside material_page_index (lambda/index_materials/db.py store_page_index).
+-- `ordinal` is the node's pre-order position within its material's tree.
+-- Idempotent — safe to re-run.
+
+CREATE TABLE IF NOT EXISTS material_sections (
+  material_id INTEGER NOT NULL REFERENCES materials(id) ON DELETE CASCADE,
+  ordinal     INTEGER NOT NULL,
+  node_id     TEXT NOT NULL DEFAULT '',
+  title       TEXT NOT NULL DEFAULT '',
+  start_page  INTEGER NOT NULL,
+  end_page    INTEGER NOT NULL,
+  depth       INTEGER NOT NULL DEFAULT 0,
+  summary     TEXT NOT NULL DEFAULT '',
+  token_count INTEGER,
+  keywords    JSONB NOT NULL DEFAULT '[]'::jsonb,
+  PRIMARY KEY (material_id, ordinal)
+);
+
+CREATE INDEX IF NOT EXISTS idx_material_sections_page_range
+  ON material_sections (material_id, start_page, end_page);
+
+-- Backfill materials indexed before this migration.
+WITH RECURSIVE walk AS (
+  SELECT mpi.material_id,
+         n.node,
+         ARRAY[n.ord::int] AS path,
+         0 AS depth
+  FROM material_page_index mpi
+  CROSS JOIN LATERAL jsonb_array_elements(
+    CASE WHEN jsonb_typeof(mpi.index_json->'nodes') = 'array'
+         THEN mpi.index_json->'nodes' ELSE '[]'::jsonb END
+  ) WITH ORDINALITY AS n(node, ord)
+  WHERE NOT EXISTS (
+    SELECT 1 FROM material_sections ms WHERE ms.material_id = mpi.material_id
+  )
+  UNION ALL
+  SELECT w.material_id,
+         c.node,
+         w.path || c.ord::int,
+         w.depth + 1
+  FROM walk w
+  CROSS JOIN LATERAL jsonb_array_elements(
+    CASE WHEN jsonb_typeof(w.node->'nodes') = 'array'
+         THEN w.node->'nodes' ELSE '[]'::jsonb END
+  ) WITH ORDINALITY AS c(node, ord)
+)
+INSERT INTO material_sections
+  (material_id, ordinal, node_id, title, start_page, end_page, depth, summary, token_count, keywords)
+SELECT material_id,
+       (row_number() OVER (PARTITION BY material_id ORDER BY path) - 1)::int,
+       coalesce(node->>'node_id', ''),
+       coalesce(node->>'title', ''),
+       (node->>'start_page')::int,
+       coalesce((node->>'end_page')::int, (node->>'start_page')::int),
+       depth,
+       coalesce(node->>'summary', ''),
+       (node->>'token_count')::int,
+       CASE WHEN jsonb_typeof(node->'keywords') = 'array'
+            THEN node->'keywords' ELSE '[]'::jsonb END
+FROM walk
+WHERE node->>'start_page' IS NOT NULL
+ON CONFLICT (material_id, ordinal) DO NOTHING;
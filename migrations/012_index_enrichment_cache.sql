@@ -0,0 +1,22 @@
+-- Migration: 012_index_enrichment_cache
+-- Content-addressed cache of the indexer's LLM enrichment: node summary +
+-- keywords, document summary, and metadata tags. cache_key is a sha256 over
+-- (kind, prompt version, model, doc_type, input text) computed by
+-- lambda/index_materials/llm_client.py enrichment_cache_key, so re-indexing a
+-- material whose sections are unchanged (force_full_sync, doc_type drift,
+-- re-upload) reuses earlier results instead of calling the model again.
+-- Rows are not tied to a material and survive _delete_old_index; prune by
+-- last_hit_at if the table grows, e.g.
+--   DELETE FROM index_enrichment_cache WHERE last_hit_at < now() - interval '180 days';
+-- Idempotent — safe to re-run.
+
+CREATE TABLE IF NOT EXISTS index_enrichment_cache (
+  cache_key   TEXT PRIMARY KEY,
+  kind        TEXT NOT NULL,
+  payload     JSONB NOT NULL,
+  created_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  last_hit_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_index_enrichment_cache_last_hit
+  ON index_enrichment_cache (last_hit_at);
@@ -0,0 +1,10 @@
+-- Migration: 013_page_content_hash
+-- Per-page content hash written by the indexer (lambda/index_materials
+-- page_model.ParsedPage.content_hash). On re-index the worker diffs the new
+-- hashes against these to rewrite only changed page rows and re-enrich only
+-- the index nodes whose page span intersects a change. Rows written before
+-- this migration have NULL hashes, which forces one full re-index.
+-- Idempotent — safe to re-run.
+
+ALTER TABLE material_page_text
+  ADD COLUMN IF NOT EXISTS content_hash TEXT;
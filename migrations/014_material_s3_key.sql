@@ -0,0 +1,18 @@
+-- Migration: 014_material_s3_key
+-- Exact S3 object key for each stored file, so the indexer resolves the
+-- material for an S3 event with an index lookup instead of a
+-- `file_url LIKE '%key%'` sequential scan. Written by confirm_upload and the
+-- integration pollers; existing rows are backfilled from file_url.
+-- Idempotent — safe to re-run.
+
+ALTER TABLE materials
+  ADD COLUMN IF NOT EXISTS s3_key TEXT;
+
+UPDATE materials
+SET s3_key = substring(file_url from '^https://[^/]+\.amazonaws\.com/(.+)$')
+WHERE s3_key IS NULL
+  AND file_url ~ '^https://[^/]+\.amazonaws\.com/.+';
+
+CREATE INDEX IF NOT EXISTS idx_materials_s3_key
+  ON materials (s3_key)
+  WHERE s3_key IS NOT NULL;
@@ -0,0 +1,19 @@
+-- Migration: 015_course_members_access
+-- Course access checks and "my courses" lists now go through course_members
+-- (unique (course_id, user_id), index on user_id) plus courses.primary_creator,
+-- instead of `co_creator_ids @> '[id]'` containment scans over courses.
+-- Backfills membership rows for co-creators recorded only in the JSONB column
+-- and indexes primary_creator. co_creator_ids stays in sync for display.
+-- Idempotent — safe to re-run.
+
+INSERT INTO course_members (course_id, user_id, role)
+SELECT c.id, (e.value #>> '{}')::int, 'creator'
+FROM courses c
+CROSS JOIN LATERAL jsonb_array_elements(c.co_creator_ids) AS e(value)
+WHERE (e.value #>> '{}') ~ '^[0-9]+$'
+  AND (e.value #>> '{}')::int <> c.primary_creator
+  AND EXISTS (SELECT 1 FROM users u WHERE u.id = (e.value #>> '{}')::int)
+ON CONFLICT (course_id, user_id) DO NOTHING;
+
+CREATE INDEX IF NOT EXISTS idx_courses_primary_creator
+  ON courses (primary_creator);
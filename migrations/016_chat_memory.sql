@@ -0,0 +1,13 @@
+-- Migration: 016_chat_memory
+-- Rolling conversation memory per chat. After each reply, turns older than the
+-- raw history window are folded into memory_summary; memory_through_index is
+-- the last message_index it covers, so the planner replays the summary plus
+-- only the later turns. Edits, regenerates and deletes at or before that index
+-- reset both columns.
+-- Idempotent — safe to re-run.
+
+ALTER TABLE chats
+  ADD COLUMN IF NOT EXISTS memory_summary TEXT;
+
+ALTER TABLE chats
+  ADD COLUMN IF NOT EXISTS memory_through_index INTEGER;
@@ -0,0 +1,15 @@
+-- Migration: 017_rate_limit_buckets
+-- Shared token buckets for api/middleware.check_rate_limit, one row per
+-- "<class>:ip:<addr>" or "<class>:user:<id>" key. UNLOGGED: the counters are
+-- disposable, so they skip WAL and replication and are emptied after a crash.
+-- Idle buckets (full again) are pruned by the limiter via updated_at.
+-- Idempotent — safe to re-run.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+  bucket_key TEXT PRIMARY KEY,
+  tokens DOUBLE PRECISION NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_updated
+  ON rate_limit_buckets(updated_at);
@@ -5,24 +5,24 @@ This module centralizes embed_query Lambda invocation and updating
 `chat_messages.message_embedding` on existing rows.
 """
 import json
-import os
 import logging
 
 
 logger = logging.getLogger(__name__)
 
 
+def _lambda_client():
+    """Shared Lambda client from the api/ registry (flat import inside the Vercel runtime)."""
+    try:
+        from aws_clients import get_client
+    except ImportError:
+        from api.aws_clients import get_client
+    return get_client('lambda')
+
+
 def embed_text_via_lambda(text: str) -> list | None:
     """Invoke embed_query Lambda and return the text embedding."""
-    import boto3
-
-    region = os.environ.get('AWS_REGION', 'us-east-1')
-    client = boto3.client(
-        'lambda',
-        region_name=region,
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-    )
+    client = _lambda_client()
 
     payload = json.dumps({'query': text})
     response = client.invoke(
@@ -44,15 +44,8 @@ def embed_text_via_lambda(text: str) -> list | None:
 def embed_image_via_lambda(image_bytes: bytes) -> list | None:
     """Invoke embed_query Lambda with image_base64 and return the visual embedding."""
     import base64
-    import boto3
-
-    region = os.environ.get('AWS_REGION', 'us-east-1')
-    client = boto3.client(
-        'lambda',
-        region_name=region,
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-    )
+
+    client = _lambda_client()
 
     payload = json.dumps({'image_base64': base64.b64encode(image_bytes).decode('utf-8')})
     response = client.invoke(
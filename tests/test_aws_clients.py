@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import aws_clients
+
+
+def _fake_boto3_client(calls):
+    def _client(service, **kwargs):
+        calls.append((service, kwargs))
+        return object()
+    return _client
+
+
+def test_get_client_reuses_one_client_per_service(monkeypatch):
+    calls = []
+    aws_clients.reset_clients()
+    monkeypatch.setattr(aws_clients.boto3, "client", _fake_boto3_client(calls))
+    monkeypatch.setenv("AWS_REGION", "us-west-2")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "key")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+
+    s3_a = aws_clients.get_client("s3")
+    s3_b = aws_clients.get_client("s3")
+    lmbd = aws_clients.get_client("lambda")
+
+    assert s3_a is s3_b
+    assert lmbd is not s3_a
+    assert [service for service, _ in calls] == ["s3", "lambda"]
+    assert calls[0][1]["region_name"] == "us-west-2"
+    assert calls[0][1]["config"].max_pool_connections == 16
+    aws_clients.reset_clients()
+
+
+def test_get_client_rebuilds_after_credential_rotation_or_region_override(monkeypatch):
+    calls = []
+    aws_clients.reset_clients()
+    monkeypatch.setattr(aws_clients.boto3, "client", _fake_boto3_client(calls))
+    monkeypatch.delenv("AWS_REGION", raising=False)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "old")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+
+    first = aws_clients.get_client("s3")
+    assert calls[-1][1]["region_name"] == "us-east-1"
+    assert aws_clients.get_client("s3", region_name=None) is not first
+    assert calls[-1][1]["region_name"] is None
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "new")
+    assert aws_clients.get_client("s3") is not first
+    assert len(calls) == 3
+    aws_clients.reset_clients()
@@ -89,7 +89,7 @@ def test_responses_api_sets_model_output_cap(monkeypatch):
         captured["json"] = json
         return response
 
-    monkeypatch.setattr(llm.requests, "post", fake_post)
+    monkeypatch.setattr(llm.provider_http, "post", fake_post)
 
     llm._pageindex_call_responses(
         api_key="sk-test",
@@ -112,7 +112,7 @@ def test_claude_pageindex_call_sets_model_output_cap(monkeypatch):
         captured["json"] = json
         return response
 
-    monkeypatch.setattr(llm.requests, "post", fake_post)
+    monkeypatch.setattr(llm.provider_http, "post", fake_post)
 
     llm._pageindex_stream_call_claude(
         api_key="sk-test",
@@ -136,7 +136,7 @@ def test_gemini_pageindex_call_sets_model_output_cap(monkeypatch):
         captured["json"] = json
         return response
 
-    monkeypatch.setattr(llm.requests, "post", fake_post)
+    monkeypatch.setattr(llm.provider_http, "post", fake_post)
 
     llm._pageindex_stream_call_gemini(
         api_key="gm-test",
@@ -150,6 +150,119 @@ def test_gemini_pageindex_call_sets_model_output_cap(monkeypatch):
     assert captured["json"]["generationConfig"]["maxOutputTokens"] == llm._output_token_cap("gemini-2.5-flash")
 
 
+def test_openai_pageindex_call_sends_prompt_cache_key_and_reads_cached_tokens(monkeypatch):
+    captured = {}
+    response = MagicMock()
+    response.raise_for_status.return_value = None
+    response.iter_lines.return_value = iter([
+        b'data: {"choices":[{"delta":{"content":"hi"},"finish_reason":"stop"}]}',
+        b'data: {"choices":[],"usage":{"prompt_tokens":5000,"prompt_tokens_details":{"cached_tokens":4096}}}',
+        b"data: [DONE]",
+    ])
+
+    def fake_post(url, headers=None, json=None, stream=None, timeout=None):
+        captured["json"] = json
+        return response
+
+    monkeypatch.setattr(llm.provider_http, "post", fake_post)
+    usage = {}
+
+    message, _ = llm._pageindex_stream_call(
+        "sk-test", "gpt-4o", [{"role": "system", "content": "routing"}], None, None,
+        prompt_cache_key="pageindex-abc", usage=usage,
+    )
+
+    assert message["content"] == "hi"
+    assert captured["json"]["prompt_cache_key"] == "pageindex-abc"
+    assert captured["json"]["stream_options"] == {"include_usage": True}
+    assert usage == {"input_tokens": 5000, "cached_tokens": 4096}
+
+
+def test_claude_pageindex_call_marks_system_prefix_cacheable(monkeypatch):
+    captured = {}
+    response = MagicMock()
+    response.raise_for_status.return_value = None
+    response.iter_lines.return_value = iter([
+        b'data: {"type":"message_start","message":{"usage":{"input_tokens":12,'
+        b'"cache_read_input_tokens":3000,"cache_creation_input_tokens":0}}}',
+    ])
+
+    def fake_post(url, headers=None, json=None, stream=None, timeout=None):
+        captured["json"] = json
+        return response
+
+    monkeypatch.setattr(llm.provider_http, "post", fake_post)
+    usage = {}
+
+    llm._pageindex_stream_call_claude(
+        "sk-test", "claude-sonnet-4-6", "routing block", [{"role": "user", "content": "hi"}],
+        [], None, cache_prefix=True, usage=usage,
+    )
+
+    assert captured["json"]["system"] == [
+        {"type": "text", "text": "routing block", "cache_control": {"type": "ephemeral"}}
+    ]
+    assert usage == {"input_tokens": 3012, "cached_tokens": 3000}
+
+
+def test_gemini_pageindex_call_uses_cached_content_for_large_prefix(monkeypatch):
+    posts = []
+    cache_response = MagicMock()
+    cache_response.raise_for_status.return_value = None
+    cache_response.json.return_value = {"name": "cachedContents/abc"}
+    stream_response = MagicMock()
+    stream_response.raise_for_status.return_value = None
+    stream_response.iter_lines.return_value = iter([
+        b'data: {"candidates":[],"usageMetadata":{"promptTokenCount":9000,"cachedContentTokenCount":8000}}',
+    ])
+
+    def fake_post(url, json=None, stream=None, timeout=None):
+        posts.append((url, json))
+        return cache_response if "cachedContents" in url else stream_response
+
+    monkeypatch.setattr(llm.provider_http, "post", fake_post)
+    monkeypatch.setattr(llm, "_GEMINI_CONTEXT_CACHE", llm.OrderedDict())
+    system = "routing " * 20000
+    usage = {}
+
+    for _ in range(2):
+        stream_response.iter_lines.return_value = iter([
+            b'data: {"candidates":[],"usageMetadata":{"promptTokenCount":9000,"cachedContentTokenCount":8000}}',
+        ])
+        llm._pageindex_stream_call_gemini(
+            "gm-test", "gemini-2.5-flash", system, [{"role": "user", "parts": [{"text": "hi"}]}],
+            [], None, cache_prefix=True, usage=usage,
+        )
+
+    cache_posts = [body for url, body in posts if "cachedContents" in url]
+    stream_bodies = [body for url, body in posts if "cachedContents" not in url]
+    # The cache is created once and reused by the next planner iteration.
+    assert len(cache_posts) == 1
+    assert all(body["cachedContent"] == "cachedContents/abc" for body in stream_bodies)
+    assert all("system_instruction" not in body for body in stream_bodies)
+    assert usage == {"input_tokens": 9000, "cached_tokens": 8000}
+
+
+def test_gemini_pageindex_call_skips_context_cache_for_small_prefix(monkeypatch):
+    posts = []
+    response = MagicMock()
+    response.raise_for_status.return_value = None
+    response.iter_lines.return_value = iter([])
+
+    def fake_post(url, json=None, stream=None, timeout=None):
+        posts.append((url, json))
+        return response
+
+    monkeypatch.setattr(llm.provider_http, "post", fake_post)
+
+    llm._pageindex_stream_call_gemini(
+        "gm-test", "gemini-2.5-flash", "short system", [], [], None, cache_prefix=True,
+    )
+
+    assert len(posts) == 1
+    assert posts[0][1]["system_instruction"] == {"parts": [{"text": "short system"}]}
+
+
 def test_format_pageindex_evidence_blocks_course_and_web_results():
     evidence = llm._format_pageindex_evidence(
         course_contents=["page one", "page two"],
@@ -166,35 +279,10 @@ def test_format_pageindex_evidence_empty_returns_empty_string():
     assert llm._format_pageindex_evidence([], []) == ""
 
 
-def test_compose_history_keeps_all_when_under_budget():
-    turns = [
-        {"role": "user", "content": "aaaa"},       # 1 token
-        {"role": "assistant", "content": "bbbb"},  # 1 token
-    ]
-    out = llm._compose_history(turns, budget_tokens=100)
-    assert out == turns  # unchanged, chronological order preserved
-
-
-def test_compose_history_drops_oldest_first_when_over_budget():
-    turns = [
-        {"role": "user", "content": "a" * 400},       # 100 tokens (oldest)
-        {"role": "assistant", "content": "b" * 400},  # 100 tokens
-        {"role": "user", "content": "c" * 400},       # 100 tokens (newest)
-    ]
-    # Budget only fits the two newest (200 tokens).
-    out = llm._compose_history(turns, budget_tokens=200)
-    assert [t["content"][0] for t in out] == ["b", "c"]  # oldest "a" dropped
-
-
-def test_compose_history_empty_budget_returns_empty():
-    turns = [{"role": "user", "content": "a" * 400}]
-    assert llm._compose_history(turns, budget_tokens=0) == []
-
-
 def test_load_chat_history_queries_active_branch_and_maps_rows():
     rows = [
-        {"role": "user", "content": "q1"},
-        {"role": "assistant", "content": "a1"},
+        {"message_index": 1, "role": "assistant", "content": "a1", "summary": None, "token_count": 1},
+        {"message_index": 0, "role": "user", "content": "q1", "summary": None, "token_count": 1},
     ]
     cursor = MagicMock()
     cursor.fetchall.return_value = rows
@@ -207,12 +295,84 @@ def test_load_chat_history_queries_active_branch_and_maps_rows():
         {"role": "user", "content": "q1"},
         {"role": "assistant", "content": "a1"},
     ]
-    # Query must filter is_deleted and message_index < before_index, ordered asc.
+    # Query must filter is_deleted and message_index < before_index, newest first.
     sql, params = cursor.execute.call_args[0]
     assert "is_deleted = FALSE" in sql
     assert "message_index <" in sql
-    assert "ORDER BY message_index ASC" in sql
-    assert params == (7, 5)
+    assert "ORDER BY message_index DESC" in sql
+    assert params == (False, 7, -1, 5, llm.HISTORY_PAGE_SIZE)
+
+
+def _paged_history_conn(rows):
+    """Fake connection serving rows (newest first) by keyset page."""
+    cursor = MagicMock()
+    calls = []
+
+    def execute(sql, params):
+        compact, _chat_id, after, before, limit = params
+        calls.append(params)
+        page = [r for r in rows if after < r["message_index"] < before][:limit]
+        cursor.fetchall.return_value = [
+            dict(r, content=None) if compact and r["role"] == "assistant" and r.get("summary") else r
+            for r in page
+        ]
+
+    cursor.execute.side_effect = execute
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+    return conn, calls
+
+
+def test_load_chat_history_pages_newest_first_and_stops_at_budget(monkeypatch):
+    monkeypatch.setattr(llm, "HISTORY_PAGE_SIZE", 2)
+    monkeypatch.setattr(llm, "HISTORY_VERBATIM_RATIO", 1.0)
+    rows = [
+        {"message_index": i, "role": "user" if i % 2 == 0 else "assistant",
+         "content": str(i) * 400, "summary": None, "token_count": 100}
+        for i in range(9, -1, -1)
+    ]
+    conn, calls = _paged_history_conn(rows)
+
+    out = llm._load_chat_history(conn, chat_id=1, before_index=10, budget_tokens=300)
+
+    assert [t["content"][0] for t in out] == ["7", "8", "9"]
+    # Two pages cover the three newest turns; older pages are never read.
+    assert [before for _c, _id, _a, before, _l in calls] == [10, 8]
+
+
+def test_load_chat_history_uses_stored_token_counts():
+    rows = [
+        {"message_index": 1, "role": "assistant", "content": "x" * 40, "summary": None, "token_count": 500},
+        {"message_index": 0, "role": "user", "content": "q", "summary": None, "token_count": 1},
+    ]
+    conn, _calls = _paged_history_conn(rows)
+
+    out = llm._load_chat_history(conn, chat_id=1, before_index=2, budget_tokens=400)
+
+    assert out == []
+
+
+def test_load_chat_history_collapses_older_replies_to_summaries(monkeypatch):
+    monkeypatch.setattr(llm, "HISTORY_PAGE_SIZE", 1)
+    monkeypatch.setattr(llm, "HISTORY_VERBATIM_RATIO", 0.8)
+    rows = [
+        {"message_index": 3, "role": "assistant", "content": "new" * 100, "summary": "Recent", "token_count": 75},
+        {"message_index": 2, "role": "user", "content": "q2", "summary": None, "token_count": 1},
+        {"message_index": 1, "role": "assistant", "content": "old" * 100, "summary": "Explained recursion", "token_count": 75},
+        {"message_index": 0, "role": "user", "content": "q1", "summary": None, "token_count": 1},
+    ]
+    conn, calls = _paged_history_conn(rows)
+
+    out = llm._load_chat_history(conn, chat_id=1, before_index=4, budget_tokens=100)
+
+    assert [t["content"] for t in out] == [
+        "q1",
+        llm._HISTORY_SUMMARY_PREFIX + "Explained recursion",
+        "q2",
+        "new" * 100,
+    ]
+    # Pages after the switch are fetched in compact mode, without reply content.
+    assert [compact for compact, _id, _a, _b, _l in calls] == [False, False, False, True, True]
 
 
 def test_load_chat_history_none_chat_returns_empty():
@@ -221,7 +381,7 @@ def test_load_chat_history_none_chat_returns_empty():
 
 
 def test_build_history_turns_end_to_end(monkeypatch):
-    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi: [
+    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi, **_kw: [
         {"role": "user", "content": "a" * 400},       # 100 tokens
         {"role": "assistant", "content": "b" * 400},  # 100 tokens
     ])
@@ -233,6 +393,115 @@ def test_build_history_turns_end_to_end(monkeypatch):
     assert len(kept) == 2
 
 
+def _memory_conn(chat_row, rows=()):
+    cursor = MagicMock()
+    cursor.fetchone.return_value = chat_row
+    cursor.fetchall.return_value = list(rows)
+    cursor.rowcount = 1
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+    return conn, cursor
+
+
+def test_load_chat_memory_ignores_missing_or_too_recent_memory():
+    conn, _ = _memory_conn({"memory_summary": " - Goal: midterm prep ", "memory_through_index": 9})
+    assert llm._load_chat_memory(conn, chat_id=1, before_index=20) == {
+        "summary": "- Goal: midterm prep", "through_index": 9,
+    }
+    # Regenerating a turn the memory already covers falls back to raw history.
+    assert llm._load_chat_memory(conn, chat_id=1, before_index=9) is None
+
+    empty, _ = _memory_conn({"memory_summary": None, "memory_through_index": None})
+    assert llm._load_chat_memory(empty, chat_id=1, before_index=20) is None
+    assert llm._load_chat_memory(empty, chat_id=None, before_index=20) is None
+
+
+def test_build_history_turns_skips_turns_folded_into_memory():
+    rows = [
+        {"message_index": i, "role": "user" if i % 2 == 0 else "assistant",
+         "content": f"t{i}", "summary": None, "token_count": 1}
+        for i in range(7, -1, -1)
+    ]
+    conn, calls = _paged_history_conn(rows)
+
+    kept = llm._build_history_turns(
+        conn=conn, chat_id=1, before_index=8,
+        model="gpt-4o-mini", system_text="s", current_user_text="u", after_index=5,
+    )
+
+    assert [t["content"] for t in kept] == ["t6", "t7"]
+    assert calls[0][2] == 5
+
+
+def test_chat_memory_leads_history_instead_of_system_prompt():
+    memory = {"summary": "- Goal: midterm prep", "through_index": 5}
+    notice = llm._CONVERSATION_MEMORY_NOTICE
+
+    # Unfolded history opening on the assistant's reply: memory becomes its own turn.
+    turns = [{"role": "assistant", "content": "a5"}, {"role": "user", "content": "u6"}]
+    assert llm._with_chat_memory(turns, memory) == [
+        {"role": "user", "content": notice + "- Goal: midterm prep"},
+    ] + turns
+
+    # Opening on a user turn: merged so roles keep alternating.
+    shaped = llm._with_chat_memory([{"role": "user", "content": "u6"}], memory)
+    assert shaped == [{"role": "user", "content": notice + "- Goal: midterm prep\n\nu6"}]
+
+    assert llm._with_chat_memory(turns, None) is turns
+
+
+def test_collect_chat_memory_fold_returns_aged_out_turns(monkeypatch):
+    monkeypatch.setattr(llm, "_get_api_key", lambda conn, uid, provider: "sk-test")
+    conn, cursor = _memory_conn(
+        {"memory_summary": "- Earlier", "memory_through_index": 3},
+        [
+            {"message_index": 4, "role": "user", "content": "q" * 5000},
+            {"message_index": 5, "role": "assistant", "content": "a"},
+        ],
+    )
+
+    fold = llm.collect_chat_memory_fold(conn, user_id=2, chat_id=1)
+
+    sql, params = cursor.execute.call_args_list[1][0]
+    assert "OFFSET %s" in sql and "message_index > %s" in sql
+    assert params == (1, 3, llm.CHAT_MEMORY_RECENT_TURNS, llm.CHAT_MEMORY_FOLD_MAX_TURNS)
+    assert fold["memory"] == "- Earlier"
+    assert (fold["previous_through_index"], fold["through_index"]) == (3, 5)
+    assert len(fold["turns"][0]["content"]) == llm._CHAT_MEMORY_TURN_CHARS
+
+    idle, _ = _memory_conn({"memory_summary": None, "memory_through_index": None}, [])
+    assert llm.collect_chat_memory_fold(idle, user_id=2, chat_id=1) is None
+
+
+def test_summarize_and_store_chat_memory(monkeypatch):
+    captured = {}
+    response = MagicMock()
+    response.json.return_value = {
+        "choices": [{"message": {"content": '{"memory": "- Covered recursion"}'}}]
+    }
+
+    def fake_post(url, headers=None, json=None, timeout=None):
+        captured["json"] = json
+        return response
+
+    monkeypatch.setattr(llm.provider_http, "post", fake_post)
+    fold = {
+        "chat_id": 1, "api_key": "sk-test", "memory": "", "previous_through_index": None,
+        "through_index": 5, "turns": [{"role": "user", "content": "what is recursion?"}],
+    }
+
+    memory = llm.summarize_chat_memory(fold)
+
+    assert memory == "- Covered recursion"
+    assert "what is recursion?" in captured["json"]["messages"][1]["content"]
+
+    conn, cursor = _memory_conn(None)
+    assert llm.store_chat_memory(conn, fold, memory) is True
+    sql, params = cursor.execute.call_args[0]
+    assert "IS NOT DISTINCT FROM" in sql
+    assert params == ("- Covered recursion", 5, 1, None)
+
+
 def test_shape_history_openai_roles_passthrough():
     turns = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "yo"}]
     assert llm._shape_history_openai(turns) == turns
@@ -258,14 +527,14 @@ def test_run_agent_seeds_openai_history(monkeypatch):
     # No images, no real network.
     monkeypatch.setattr(llm, "_fetch_images_as_base64", lambda keys: [])
     monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
-    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi: [
+    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi, **_kw: [
         {"role": "user", "content": "earlier question"},
         {"role": "assistant", "content": "earlier answer"},
     ])
 
     captured = {}
 
-    def fake_stream(api_key, model, msgs, tools, on_event):
+    def fake_stream(api_key, model, msgs, tools, on_event, **kwargs):
         captured["msgs"] = msgs
         # Return message dict shape matching _pageindex_stream_call contract
         return ({"content": "Final answer.", "tool_calls": None}, "stop")
@@ -301,7 +570,7 @@ def test_run_agent_gpt5_synthesis_preserves_history_and_current_turn(monkeypatch
 
     monkeypatch.setattr(llm, "_fetch_images_as_base64", lambda keys: [])
     monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
-    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi: [
+    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi, **_kw: [
         {"role": "user", "content": "earlier question"},
         {"role": "assistant", "content": "earlier answer"},
     ])
@@ -313,7 +582,7 @@ def test_run_agent_gpt5_synthesis_preserves_history_and_current_turn(monkeypatch
 
     calls = []
 
-    def fake_stream(api_key, model, msgs, tools, on_event):
+    def fake_stream(api_key, model, msgs, tools, on_event, **kwargs):
         import copy
         calls.append({"model": model, "msgs": copy.deepcopy(msgs), "tools": tools})
         if tools:
@@ -380,7 +649,7 @@ def test_run_agent_openai_chat_synthesis_uses_clean_prompt(monkeypatch):
 
     monkeypatch.setattr(llm, "_fetch_images_as_base64", lambda keys: [])
     monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
-    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi: [
+    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi, **_kw: [
         {"role": "user", "content": "earlier question"},
         {"role": "assistant", "content": "earlier answer"},
     ])
@@ -388,7 +657,7 @@ def test_run_agent_openai_chat_synthesis_uses_clean_prompt(monkeypatch):
 
     calls = []
 
-    def fake_stream(api_key, model, msgs, tools, on_event):
+    def fake_stream(api_key, model, msgs, tools, on_event, **kwargs):
         import copy
         calls.append({"model": model, "msgs": copy.deepcopy(msgs), "tools": tools})
         if tools:
@@ -435,7 +704,7 @@ def test_run_agent_claude_synthesis_uses_clean_prompt(monkeypatch):
 
     monkeypatch.setattr(llm, "_fetch_images_as_base64", lambda keys: [])
     monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
-    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi: [
+    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi, **_kw: [
         {"role": "user", "content": "earlier question"},
         {"role": "assistant", "content": "earlier answer"},
     ])
@@ -443,7 +712,7 @@ def test_run_agent_claude_synthesis_uses_clean_prompt(monkeypatch):
 
     calls = []
 
-    def fake_claude(api_key, model, system, messages, tools, on_event):
+    def fake_claude(api_key, model, system, messages, tools, on_event, **kwargs):
         import copy
         calls.append({"system": system, "messages": copy.deepcopy(messages), "tools": tools})
         if tools:
@@ -483,7 +752,7 @@ def test_run_agent_gemini_synthesis_uses_clean_prompt(monkeypatch):
 
     monkeypatch.setattr(llm, "_fetch_images_as_base64", lambda keys: [])
     monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
-    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi: [
+    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi, **_kw: [
         {"role": "user", "content": "earlier question"},
         {"role": "assistant", "content": "earlier answer"},
     ])
@@ -491,7 +760,7 @@ def test_run_agent_gemini_synthesis_uses_clean_prompt(monkeypatch):
 
     calls = []
 
-    def fake_gemini(api_key, model, system, contents, tools, on_event):
+    def fake_gemini(api_key, model, system, contents, tools, on_event, **kwargs):
         import copy
         calls.append({"system": system, "contents": copy.deepcopy(contents), "tools": tools})
         if tools:
@@ -531,11 +800,11 @@ def test_claude_retrieval_text_is_not_streamed(monkeypatch):
 
     monkeypatch.setattr(llm, "_fetch_images_as_base64", lambda keys: [])
     monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
-    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi: [])
+    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi, **_kw: [])
     monkeypatch.setattr(llm, "_dispatch_pageindex_tool", lambda **kwargs: ("retrieved page content", {}))
     events = []
 
-    def fake_claude(api_key, model, system, messages, tools, on_event):
+    def fake_claude(api_key, model, system, messages, tools, on_event, **kwargs):
         if tools:
             if on_event:
                 on_event({"type": "text", "chunk": "retrieval preamble"})
@@ -570,11 +839,11 @@ def test_gemini_retrieval_text_is_not_streamed(monkeypatch):
 
     monkeypatch.setattr(llm, "_fetch_images_as_base64", lambda keys: [])
     monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
-    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi: [])
+    monkeypatch.setattr(llm, "_load_chat_history", lambda c, cid, bi, **_kw: [])
     monkeypatch.setattr(llm, "_dispatch_pageindex_tool", lambda **kwargs: ("retrieved page content", {}))
     events = []
 
-    def fake_gemini(api_key, model, system, contents, tools, on_event):
+    def fake_gemini(api_key, model, system, contents, tools, on_event, **kwargs):
         if tools:
             if on_event:
                 on_event({"type": "text", "chunk": "retrieval preamble"})
@@ -610,7 +879,7 @@ def test_openai_propose_generation_returns_non_empty_message(monkeypatch):
     monkeypatch.setattr(llm, "_fetch_images_as_base64", lambda keys: [])
     monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
 
-    def fake_stream(api_key, model, msgs, tools, on_event):
+    def fake_stream(api_key, model, msgs, tools, on_event, **kwargs):
         return ({
             "content": "",
             "tool_calls": [{
@@ -647,7 +916,7 @@ def test_claude_propose_generation_returns_non_empty_message(monkeypatch):
     monkeypatch.setattr(llm, "_fetch_images_as_base64", lambda keys: [])
     monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
 
-    def fake_claude(api_key, model, system, messages, tools, on_event):
+    def fake_claude(api_key, model, system, messages, tools, on_event, **kwargs):
         return ([{
             "type": "tool_use",
             "id": "tool_1",
@@ -680,7 +949,7 @@ def test_gemini_propose_generation_returns_non_empty_message(monkeypatch):
     monkeypatch.setattr(llm, "_fetch_images_as_base64", lambda keys: [])
     monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
 
-    def fake_gemini(api_key, model, system, contents, tools, on_event):
+    def fake_gemini(api_key, model, system, contents, tools, on_event, **kwargs):
         return ([{"functionCall": {
             "name": "propose_generation",
             "args": {"generation_type": "quiz", "title": "Quiz", "discussion_summary": "Summary"},
@@ -713,7 +982,7 @@ def test_openai_synthesis_retries_retrieval_preamble(monkeypatch):
     monkeypatch.setattr(llm, "_dispatch_pageindex_tool", lambda **kwargs: ("retrieved page content", {}))
     final_calls = 0
 
-    def fake_stream(api_key, model, msgs, tools, on_event):
+    def fake_stream(api_key, model, msgs, tools, on_event, **kwargs):
         nonlocal final_calls
         if tools:
             return ({
@@ -782,7 +1051,7 @@ def test_scope_classifier_call_removed():
 def test_dispatch_candidate_frontier_auto_expands_budget_for_many_candidate_pages(monkeypatch):
     captured = {}
 
-    def fake_materialize(conn, candidates, budget):
+    def fake_materialize(conn, candidates, budget, page_cache=None):
         captured["budget"] = budget
         return [], [], {
             "raw_pages": 0,
@@ -812,7 +1081,7 @@ def test_dispatch_candidate_frontier_auto_expands_budget_for_many_candidate_page
 def test_dispatch_candidate_frontier_keeps_base_budget_for_small_candidate_sets(monkeypatch):
     captured = {}
 
-    def fake_materialize(conn, candidates, budget):
+    def fake_materialize(conn, candidates, budget, page_cache=None):
         captured["budget"] = budget
         return [], [], {
             "raw_pages": 0,
@@ -918,20 +1187,32 @@ def test_get_page_section_summaries_returns_matching_sections():
         [
             {
                 "material_id": 742,
+                "page": 4,
                 "material_title": "Lecture 4",
-                "nodes": [
-                    {"start_page": 1, "end_page": 3, "summary": "Intro", "token_count": 300},
-                    {"start_page": 4, "end_page": 6, "summary": "MDP setup", "token_count": 600},
-                ],
-            }
+                "start_page": 4,
+                "end_page": 6,
+                "summary": "MDP setup",
+                "token_count": 600,
+            },
+            {
+                "material_id": 742,
+                "page": 6,
+                "material_title": None,
+                "start_page": 4,
+                "end_page": 6,
+                "summary": "MDP setup",
+                "token_count": None,
+            },
         ]
     )
 
-    summaries = get_page_section_summaries(conn, [742])
+    summaries = get_page_section_summaries(conn, [(742, 4), (742, 6)])
 
     assert summaries[(742, 4)]["summary"] == "MDP setup"
     assert summaries[(742, 4)]["token_count"] == 600
-    assert summaries[(742, 6)]["title"] == "Lecture 4"
+    assert summaries[(742, 4)]["title"] == "Lecture 4"
+    assert summaries[(742, 6)]["title"] == "Material 742"
+    assert summaries[(742, 6)]["token_count"] == 2
 
 
 def test_materialize_page_candidates_splits_raw_and_summary(monkeypatch):
@@ -945,12 +1226,14 @@ def test_materialize_page_candidates_splits_raw_and_summary(monkeypatch):
         "summary_tokens": 500,
     }
 
-    def fake_get_page_content(conn, material_id, pages):
+    def fake_get_page_contents(conn, locations):
         token_counts = {1: 100, 2: 80, 3: 40}
-        page = int(pages)
-        return [{"page_number": page, "text_content": f"raw page {pages}", "has_images": False, "token_count": token_counts[page]}]
+        return {
+            (material_id, page): {"page_number": page, "text_content": f"raw page {page}", "has_images": False, "token_count": token_counts[page]}
+            for material_id, page in locations
+        }
 
-    def fake_get_page_section_summaries(conn, material_ids):
+    def fake_get_page_section_summaries(conn, locations):
         return {
             (742, 2): {
                 "material_id": 742,
@@ -963,7 +1246,7 @@ def test_materialize_page_candidates_splits_raw_and_summary(monkeypatch):
             }
         }
 
-    monkeypatch.setattr(llm, "_get_page_content_for_materialization", fake_get_page_content)
+    monkeypatch.setattr(llm, "_get_page_contents_for_materialization", fake_get_page_contents)
     monkeypatch.setattr(llm, "_get_page_section_summaries_for_materialization", fake_get_page_section_summaries)
 
     raw, summaries, meta = llm._materialize_page_candidates(object(), candidates, budget)
@@ -979,6 +1262,35 @@ def test_materialize_page_candidates_splits_raw_and_summary(monkeypatch):
     assert meta["summary_pages"] == 1
 
 
+def test_materialize_page_candidates_fetches_frontier_in_one_call(monkeypatch):
+    candidates = [
+        {"material_id": 742, "page": 1, "reason": "", "priority": "supporting"},
+        {"material_id": 743, "page": 9, "reason": "", "priority": "core"},
+        {"material_id": 742, "page": 2, "reason": "", "priority": "supporting"},
+    ]
+    calls = []
+
+    def fake_get_page_contents(conn, locations):
+        calls.append(list(locations))
+        # Page 2 has no stored text and must fall through to the summary tier.
+        return {
+            (742, 1): {"page_number": 1, "text_content": "raw one", "has_images": False, "token_count": 10},
+            (743, 9): {"page_number": 9, "text_content": "raw nine", "has_images": False, "token_count": 10},
+        }
+
+    monkeypatch.setattr(llm, "_get_page_contents_for_materialization", fake_get_page_contents)
+    monkeypatch.setattr(llm, "_get_page_section_summaries_for_materialization", lambda conn, locations: {})
+
+    raw, _summaries, meta = llm._materialize_page_candidates(
+        object(), candidates, {"raw_tokens": 1000, "summary_tokens": 1000}
+    )
+
+    assert calls == [[(742, 1), (743, 9), (742, 2)]]
+    # Core candidates are still admitted first.
+    assert raw == ["Material 743, page 9\nraw nine", "Material 742, page 1\nraw one"]
+    assert meta["omitted"] == [{"material_id": 742, "page": 2}]
+
+
 def test_materialize_page_candidates_tracks_summary_omissions(monkeypatch):
     candidates = [
         {"material_id": 742, "page": 1, "reason": "", "priority": "core"},
@@ -989,13 +1301,16 @@ def test_materialize_page_candidates_tracks_summary_omissions(monkeypatch):
 
     monkeypatch.setattr(
         llm,
-        "_get_page_content_for_materialization",
-        lambda conn, material_id, pages: [{"page_number": int(pages), "text_content": "raw", "has_images": False, "token_count": 50}],
+        "_get_page_contents_for_materialization",
+        lambda conn, locations: {
+            (material_id, page): {"page_number": page, "text_content": "raw", "has_images": False, "token_count": 50}
+            for material_id, page in locations
+        },
     )
     monkeypatch.setattr(
         llm,
         "_get_page_section_summaries_for_materialization",
-        lambda conn, material_ids: {
+        lambda conn, locations: {
             (742, 2): {"material_id": 742, "title": "Lecture", "page": 2, "start_page": 2, "end_page": 2, "summary": "summary two"},
             (742, 3): {"material_id": 742, "title": "Lecture", "page": 3, "start_page": 3, "end_page": 3, "summary": "summary three"},
         },
@@ -1031,7 +1346,7 @@ def test_dispatch_select_page_candidates_materializes_evidence(monkeypatch):
     monkeypatch.setattr(
         llm,
         "_materialize_page_candidates",
-        lambda conn, candidates, budget: (
+        lambda conn, candidates, budget, page_cache=None: (
             ["raw evidence"],
             ["summary evidence"],
             {
@@ -1062,12 +1377,14 @@ def test_dispatch_select_page_candidates_materializes_evidence(monkeypatch):
 
 
 def test_dispatch_candidate_frontier_reports_admitted_and_demoted_pages(monkeypatch):
-    def fake_get_page_content(conn, material_id, pages):
+    def fake_get_page_contents(conn, locations):
         token_counts = {1: 100, 2: 80, 3: 40}
-        page = int(pages)
-        return [{"page_number": page, "text_content": f"raw page {pages}", "has_images": False, "token_count": token_counts[page]}]
+        return {
+            (material_id, page): {"page_number": page, "text_content": f"raw page {page}", "has_images": False, "token_count": token_counts[page]}
+            for material_id, page in locations
+        }
 
-    def fake_get_page_section_summaries(conn, material_ids):
+    def fake_get_page_section_summaries(conn, locations):
         return {
             (742, 2): {
                 "material_id": 742,
@@ -1080,7 +1397,7 @@ def test_dispatch_candidate_frontier_reports_admitted_and_demoted_pages(monkeypa
             }
         }
 
-    monkeypatch.setattr(llm, "_get_page_content_for_materialization", fake_get_page_content)
+    monkeypatch.setattr(llm, "_get_page_contents_for_materialization", fake_get_page_contents)
     monkeypatch.setattr(llm, "_get_page_section_summaries_for_materialization", fake_get_page_section_summaries)
 
     result, meta = llm._dispatch_candidate_frontier(
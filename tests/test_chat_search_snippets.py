@@ -27,7 +27,7 @@ def _stub_chat_deps():
 
     mw = _stub("middleware")
     for attr in ("send_json", "send_sse_headers", "send_sse_event",
-                 "handle_options", "authenticate_request",
+                 "handle_options", "load_request_context",
                  "sanitize_string", "check_rate_limit"):
         setattr(mw, attr, None)
 
@@ -37,7 +37,8 @@ def _stub_chat_deps():
     _stub("rag").retrieve_chunks = None
 
     llm_mod = _stub("llm")
-    for attr in ("synthesize", "suggest_chat_title"):
+    for attr in ("synthesize", "suggest_chat_title", "collect_chat_memory_fold",
+                 "summarize_chat_memory", "store_chat_memory"):
         setattr(llm_mod, attr, None)
 
     _stub("services")
@@ -90,3 +91,127 @@ def test_content_match_row_includes_message_fields():
     assert out["hit_count"] == 3
     assert out["title"] == "Midterm review"
     assert out["last_message_at"] == "2026-05-30T10:00:00Z"
+
+
+def _fake_get_db(conns):
+    from contextlib import contextmanager
+
+    @contextmanager
+    def get_db():
+        conns.append("own-conn")
+        yield "own-conn"
+
+    return get_db
+
+
+def test_pending_embeddings_write_after_commit_on_own_connection(monkeypatch):
+    import threading
+    import chat
+
+    release = threading.Event()
+    written = threading.Event()
+    writes, conns = [], []
+
+    def slow_embed(text):
+        release.wait(5)
+        return [float(len(text))]
+
+    def write(conn, message_id, emb):
+        writes.append((conn, message_id, emb))
+        written.set()
+
+    monkeypatch.setattr(chat, "embed_text_via_lambda", slow_embed)
+    monkeypatch.setattr(chat, "write_chat_message_embedding", write)
+    monkeypatch.setattr(chat, "get_db", _fake_get_db(conns))
+
+    pending = chat._PendingMessageEmbeddings("test")
+    with pending:
+        pending.submit(7, "hello")  # returns without waiting on the embedding call
+        pending.submit(8, "")       # empty text is never embedded
+    # Leaving the block does not wait on the embedding either.
+    assert writes == []
+
+    release.set()
+    assert written.wait(5)
+    assert writes == [("own-conn", 7, [5.0])]
+
+
+def test_pending_embeddings_skip_write_on_rollback(monkeypatch):
+    import chat
+
+    writes, conns = [], []
+    monkeypatch.setattr(chat, "embed_text_via_lambda", lambda text: [1.0])
+    monkeypatch.setattr(chat, "write_chat_message_embedding",
+                        lambda conn, message_id, emb: writes.append(message_id))
+    monkeypatch.setattr(chat, "get_db", _fake_get_db(conns))
+
+    pending = chat._PendingMessageEmbeddings("test")
+    with pytest.raises(RuntimeError):
+        with pending:
+            pending.submit(1, "a")
+            raise RuntimeError("insert failed")
+    chat._embed_executor().submit(lambda: None).result(5)
+    assert writes == [] and conns == []
+
+
+def test_pending_embeddings_swallow_failures(monkeypatch):
+    import threading
+    import chat
+
+    def broken_embed(text):
+        raise RuntimeError("lambda down")
+
+    logged = threading.Event()
+    writes, conns = [], []
+    monkeypatch.setattr(chat, "embed_text_via_lambda", broken_embed)
+    monkeypatch.setattr(chat, "write_chat_message_embedding",
+                        lambda conn, message_id, emb: writes.append(message_id))
+    monkeypatch.setattr(chat, "get_db", _fake_get_db(conns))
+    monkeypatch.setattr(chat.logger, "exception", lambda *a, **k: logged.set())
+
+    pending = chat._PendingMessageEmbeddings("test")
+    with pending:
+        pending.submit(1, "a")
+    assert logged.wait(5)
+    assert writes == [] and conns == []
+
+
+def test_pending_chat_memory_runs_after_commit_on_own_connections(monkeypatch):
+    import threading
+    import chat
+
+    stored = threading.Event()
+    calls, conns = [], []
+    monkeypatch.setattr(chat, "get_db", _fake_get_db(conns))
+    monkeypatch.setattr(chat, "collect_chat_memory_fold",
+                        lambda conn, user_id, chat_id: calls.append(("collect", conn, user_id, chat_id)) or {"chat_id": chat_id})
+    monkeypatch.setattr(chat, "summarize_chat_memory", lambda fold: "- memory")
+
+    def store(conn, fold, memory):
+        calls.append(("store", conn, memory))
+        stored.set()
+
+    monkeypatch.setattr(chat, "store_chat_memory", store)
+
+    memory = chat._PendingChatMemory(chat_id=3, user_id=9)
+    with memory:
+        memory.schedule()
+        assert calls == []  # nothing runs inside the request transaction
+    assert stored.wait(5)
+    assert calls == [("collect", "own-conn", 9, 3), ("store", "own-conn", "- memory")]
+    assert conns == ["own-conn", "own-conn"]
+
+
+def test_pending_chat_memory_skipped_on_rollback(monkeypatch):
+    import chat
+
+    conns = []
+    monkeypatch.setattr(chat, "get_db", _fake_get_db(conns))
+    monkeypatch.setattr(chat, "collect_chat_memory_fold", lambda *a: pytest.fail("collected"))
+
+    memory = chat._PendingChatMemory(chat_id=3, user_id=9)
+    with pytest.raises(RuntimeError):
+        with memory:
+            memory.schedule()
+            raise RuntimeError("insert failed")
+    assert conns == []
@@ -0,0 +1,48 @@
+import types
+from contextlib import contextmanager
+
+import api.courses as courses
+
+
+def _install_db(monkeypatch, rows):
+    log = []
+
+    class Cursor:
+        def execute(self, sql, params):
+            log.append((sql, params))
+
+        def fetchone(self):
+            return rows[0] if rows else None
+
+        def fetchall(self):
+            return rows
+
+        def close(self):
+            pass
+
+    @contextmanager
+    def get_db():
+        yield types.SimpleNamespace(cursor=Cursor)
+
+    monkeypatch.setattr(courses, "get_db", get_db)
+    return log
+
+
+def test_verify_access_probes_course_members_not_jsonb(monkeypatch):
+    log = _install_db(monkeypatch, [{"id": 3}])
+
+    assert courses.Course.verify_access(3, 7) is True
+
+    sql, params = log[0]
+    assert "course_members" in sql and "co_creator_ids" not in sql
+    assert params == (3, 7, 7)
+
+
+def test_get_by_creator_unions_owned_and_member_courses(monkeypatch):
+    log = _install_db(monkeypatch, [{"id": 1}, {"id": 2}])
+
+    assert courses.Course.get_by_creator(7, include_co_created=True, status_filter="draft") == [{"id": 1}, {"id": 2}]
+
+    sql, params = log[0]
+    assert "UNION" in sql and "course_members" in sql and "@>" not in sql
+    assert params == [7, 7, 7, "draft"]
@@ -132,7 +132,7 @@ def test_run_agent_pageindex_preloads_routing_and_drops_search_tool():
         }
     ]
 
-    with patch("llm.requests.post", side_effect=fake_post), \
+    with patch("llm.provider_http.post", side_effect=fake_post), \
          patch("pageindex_retrieval.get_course_routing_index", return_value=routing_rows):
         run_agent_pageindex(
             conn=conn,
@@ -216,7 +216,7 @@ def test_run_agent_pageindex_forced_synthesis_when_iterations_exhausted():
     ]
     page_rows = [{"page_number": 2, "text_content": "content"}]
 
-    with patch("llm.requests.post", side_effect=fake_post), \
+    with patch("llm.provider_http.post", side_effect=fake_post), \
          patch("pageindex_retrieval.get_course_routing_index", return_value=routing_rows), \
          patch("pageindex_retrieval.get_page_content", return_value=page_rows):
         final_text, grounding_refs, tool_trace, *_ = run_agent_pageindex(
@@ -360,7 +360,7 @@ def test_run_agent_pageindex_claude_calls_tool_and_returns_answer():
     text_stub = _stub_anthropic_text("Retrieval done.")
     synth_stub = _stub_anthropic_text("Structure answer")
 
-    with patch("requests.post", side_effect=[tool_stub, text_stub, synth_stub]) as mock_post, \
+    with patch("provider_http.post", side_effect=[tool_stub, text_stub, synth_stub]) as mock_post, \
          patch("llm._dispatch_pageindex_tool", return_value=("<structure>...</structure>", {})) as mock_dispatch, \
          patch("llm._recall_prior_chat_images", return_value=[]), \
          patch("llm._format_routing_index_block", return_value="<course_materials></course_materials>"):
@@ -420,7 +420,7 @@ def test_run_agent_pageindex_gemini_calls_tool_and_returns_answer():
     text_stub = _stub_gemini_text("Retrieval done.")
     synth_stub = _stub_gemini_text("Gemini structure answer")
 
-    with patch("requests.post", side_effect=[tool_stub, text_stub, synth_stub]) as mock_post, \
+    with patch("provider_http.post", side_effect=[tool_stub, text_stub, synth_stub]) as mock_post, \
          patch("llm._dispatch_pageindex_tool", return_value=("<structure>...</structure>", {})) as mock_dispatch, \
          patch("llm._recall_prior_chat_images", return_value=[]), \
          patch("llm._format_routing_index_block", return_value="<course_materials></course_materials>"):
@@ -556,7 +556,7 @@ def test_run_agent_pageindex_propose_generation_emits_event():
     )
     second = _stub_openai_response_no_tools("Here's a quiz on the handshake.")
 
-    with patch("llm.requests.post", side_effect=[copy.deepcopy(first), copy.deepcopy(second)]), \
+    with patch("llm.provider_http.post", side_effect=[copy.deepcopy(first), copy.deepcopy(second)]), \
          patch("pageindex_retrieval.get_course_routing_index", return_value=[]), \
          patch("llm._recall_prior_chat_images", return_value=[]), \
          patch("llm._format_routing_index_block", return_value="<course_materials></course_materials>"):
@@ -596,7 +596,7 @@ def test_retrieval_loop_uses_user_selected_model():
             '<META>\n{"summary": "ok", "follow_ups": [], "clarifying_question": null}\n</META>'
         )
 
-    with patch("llm.requests.post", side_effect=fake_post), \
+    with patch("llm.provider_http.post", side_effect=fake_post), \
          patch("pageindex_retrieval.get_course_routing_index", return_value=[]):
         run_agent_pageindex(
             conn=MagicMock(),
@@ -647,7 +647,7 @@ def test_retrieval_loop_nudges_once_when_no_evidence():
     ]
     page_rows = [{"page_number": 2, "text_content": "content"}]
 
-    with patch("llm.requests.post", side_effect=fake_post), \
+    with patch("llm.provider_http.post", side_effect=fake_post), \
          patch("pageindex_retrieval.get_course_routing_index", return_value=routing_rows), \
          patch("pageindex_retrieval.get_page_content", return_value=page_rows):
         final_text, grounding_refs, tool_trace, *_ = run_agent_pageindex(
@@ -693,7 +693,7 @@ def test_retrieval_nudge_fires_at_most_once():
         payloads.append(copy.deepcopy(json))
         return responses[len(payloads) - 1]
 
-    with patch("llm.requests.post", side_effect=fake_post), \
+    with patch("llm.provider_http.post", side_effect=fake_post), \
          patch("pageindex_retrieval.get_course_routing_index", return_value=[]):
         run_agent_pageindex(
             conn=MagicMock(),
@@ -779,7 +779,7 @@ def test_pageindex_responses_call_uses_extended_timeout():
     import llm
 
     captured = {}
-    with patch("llm.requests.post", side_effect=_stub_responses_api_post(captured)):
+    with patch("llm.provider_http.post", side_effect=_stub_responses_api_post(captured)):
         llm._pageindex_call_responses(
             "sk-test",
             "gpt-5.5",
@@ -798,7 +798,7 @@ def test_pageindex_responses_call_uses_low_reasoning_effort_for_planning():
     import llm
 
     planner = {}
-    with patch("llm.requests.post", side_effect=_stub_responses_api_post(planner)):
+    with patch("llm.provider_http.post", side_effect=_stub_responses_api_post(planner)):
         llm._pageindex_call_responses(
             "sk-test",
             "gpt-5.5",
@@ -809,7 +809,7 @@ def test_pageindex_responses_call_uses_low_reasoning_effort_for_planning():
     assert planner["body"]["reasoning"] == {"effort": "low"}
 
     synthesis = {}
-    with patch("llm.requests.post", side_effect=_stub_responses_api_post(synthesis)):
+    with patch("llm.provider_http.post", side_effect=_stub_responses_api_post(synthesis)):
         llm._pageindex_call_responses(
             "sk-test",
             "gpt-5.5",
@@ -818,3 +818,352 @@ def test_pageindex_responses_call_uses_low_reasoning_effort_for_planning():
             None,
         )
     assert "reasoning" not in synthesis["body"]
+
+
+def test_load_routing_block_reuses_block_until_index_version_changes():
+    """The formatted routing block is rebuilt only when the indexer bumps the
+    course's index version; repeat turns hit the in-process tier."""
+    import llm
+
+    llm._ROUTING_BLOCK_CACHE.clear()
+    routing_rows = [
+        {"material_id": 10, "title": "L1", "doc_type": "lecture", "page_count": 5,
+         "summary": "s", "tags": [], "sections": []},
+    ]
+    entry = {"version": "1:2026-06-01 10:00:00", "routing_block": None}
+    stored = []
+
+    with patch("pageindex_retrieval.get_routing_index_cache_entry", side_effect=lambda *a: dict(entry)), \
+         patch("pageindex_retrieval.store_routing_index_cache_entry", side_effect=lambda *a: stored.append(a)), \
+         patch("pageindex_retrieval.get_course_routing_index", return_value=routing_rows) as load:
+        block, tier = llm._load_routing_block(MagicMock(), 7, [10])
+        assert tier == "miss"
+        assert "[10] L1" in block
+        assert stored[0][3] == entry["version"]
+
+        again, tier = llm._load_routing_block(MagicMock(), 7, [10])
+        assert (again, tier) == (block, "memory")
+        assert load.call_count == 1
+
+        entry["version"] = "1:2026-06-02 09:00:00"
+        _, tier = llm._load_routing_block(MagicMock(), 7, [10])
+        assert tier == "miss"
+        assert load.call_count == 2
+
+
+def test_load_routing_block_uses_shared_tier_on_cold_instance():
+    import llm
+
+    llm._ROUTING_BLOCK_CACHE.clear()
+    entry = {"version": "3:2026-06-01 10:00:00", "routing_block": "<course_materials>\ncached\n</course_materials>"}
+
+    with patch("pageindex_retrieval.get_routing_index_cache_entry", return_value=entry), \
+         patch("pageindex_retrieval.get_course_routing_index") as load:
+        block, tier = llm._load_routing_block(MagicMock(), 7, None)
+
+    assert tier == "shared"
+    assert "cached" in block
+    load.assert_not_called()
+
+
+def test_load_routing_block_survives_cache_read_failure():
+    import llm
+
+    llm._ROUTING_BLOCK_CACHE.clear()
+    with patch("pageindex_retrieval.get_routing_index_cache_entry", side_effect=RuntimeError("no table")), \
+         patch("pageindex_retrieval.get_course_routing_index", return_value=[]):
+        block, tier = llm._load_routing_block(MagicMock(), 7, None)
+
+    assert tier == "miss"
+    assert "(no materials available)" in block
+
+
+def test_concurrent_tool_dispatch_overlaps_and_keeps_call_order(monkeypatch):
+    import threading
+    from contextlib import contextmanager
+    import llm
+
+    barrier = threading.Barrier(3, timeout=5)
+    checkouts = []
+
+    @contextmanager
+    def fake_checkout():
+        worker_conn = object()
+        checkouts.append(worker_conn)
+        yield worker_conn
+
+    def fake_dispatch(conn, name, args, course_id, grounding_refs, on_event, page_cache=None):
+        # Every call must be in flight at once for the barrier to release.
+        barrier.wait()
+        grounding_refs.append(f"material:{args['material_id']}")
+        on_event({"type": "tool_call", "tool": name})
+        return f"{name}:{args['material_id']}", {}
+
+    monkeypatch.setattr(llm, "_checkout_tool_conn", fake_checkout)
+    monkeypatch.setattr(llm, "_dispatch_pageindex_tool", fake_dispatch)
+    events = []
+    calls = [
+        ("get_page_content", {"material_id": 3}),
+        ("get_material_structure", {"material_id": 1}),
+        ("web_search", {"material_id": 2}),
+    ]
+
+    results = llm._dispatch_pageindex_tools_concurrently(
+        "request-conn", calls, course_id=7, on_event=events.append
+    )
+
+    assert [r[0] for r in results] == [
+        "get_page_content:3", "get_material_structure:1", "web_search:2",
+    ]
+    assert [r[2] for r in results] == [["material:3"], ["material:1"], ["material:2"]]
+    assert len(events) == 3
+    assert len(checkouts) == 3
+
+
+def test_concurrent_tool_dispatch_respects_concurrency_setting(monkeypatch):
+    import llm
+
+    seen_conns = []
+
+    def fake_dispatch(conn, name, args, course_id, grounding_refs, on_event, page_cache=None):
+        seen_conns.append(conn)
+        return name, {}
+
+    def fail_checkout():
+        raise AssertionError("sequential dispatch must reuse the request connection")
+
+    monkeypatch.setenv("PAGEINDEX_TOOL_CONCURRENCY", "1")
+    monkeypatch.setattr(llm, "_checkout_tool_conn", fail_checkout)
+    monkeypatch.setattr(llm, "_dispatch_pageindex_tool", fake_dispatch)
+
+    results = llm._dispatch_pageindex_tools_concurrently(
+        "request-conn",
+        [("get_page_content", {}), ("get_related_materials", {})],
+        course_id=7,
+        on_event=None,
+    )
+
+    assert [r[0] for r in results] == ["get_page_content", "get_related_materials"]
+    assert seen_conns == ["request-conn", "request-conn"]
+
+
+def test_openai_tool_replies_follow_tool_call_ids(monkeypatch):
+    from unittest.mock import MagicMock
+    import llm
+
+    tool_calls = [
+        {"id": "call_a", "function": {"name": "get_page_content", "arguments": '{"material_id": 1, "pages": "2"}'}},
+        {"id": "call_b", "function": {"name": "get_material_structure", "arguments": '{"material_id": 1}'}},
+    ]
+    sent = []
+
+    def fake_stream_call(api_key, model, messages, tools, on_event, **kwargs):
+        sent.append([dict(m) for m in messages])
+        if len(sent) == 1:
+            return {"content": "", "tool_calls": tool_calls}, "tool_calls"
+        if tools:
+            return {"content": "done"}, "stop"
+        return {"content": '{"reply": "answer"}'}, "stop"
+
+    monkeypatch.setattr(llm, "_pageindex_stream_call", fake_stream_call)
+    monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
+    monkeypatch.setattr(llm, "_load_routing_block", lambda *a: ("<course_materials/>", "miss"))
+    monkeypatch.setattr(
+        llm,
+        "_dispatch_pageindex_tools_concurrently",
+        lambda conn, calls, course_id, on_event, page_cache=None: [(f"result {n}", {}, []) for n, _ in calls],
+    )
+
+    llm.run_agent_pageindex(
+        conn=MagicMock(),
+        user_message="explain page 2",
+        model="gpt-4o",
+        api_key="sk-test",
+        chat_id=None,
+        course_id=7,
+        context_material_ids=[1],
+    )
+
+    tool_replies = [m for m in sent[1] if m.get("role") == "tool"]
+    assert [(m["tool_call_id"], m["content"]) for m in tool_replies] == [
+        ("call_a", "result get_page_content"),
+        ("call_b", "result get_material_structure"),
+    ]
+
+
+def test_page_cache_serves_prefetched_pages_and_tracks_waste():
+    import llm
+
+    cache = llm._PageCache()
+    cache.fill({
+        (1, 7): {"page_number": 7, "text_content": "bellman"},
+        (1, 8): {"page_number": 8, "text_content": "unused page"},
+    })
+    loaded = []
+
+    def load(missing):
+        loaded.append(missing)
+        return {loc: {"page_number": loc[1], "text_content": "db"} for loc in missing}
+
+    rows = cache.fetch([(1, 7), (1, 9)], load)
+
+    assert rows[(1, 7)]["text_content"] == "bellman"
+    assert rows[(1, 9)]["text_content"] == "db"
+    assert loaded == [[(1, 9)]]
+    assert cache.trace == {
+        "phase": "prefetch",
+        "pages": 2,
+        "hits": 1,
+        "misses": 1,
+        "hit_rate": 0.5,
+        "wasted_bytes": len("unused page"),
+    }
+
+
+def test_get_page_content_tool_reads_through_page_cache():
+    from unittest.mock import MagicMock
+    import llm
+
+    cache = llm._PageCache()
+    cache.fill({(42, 3): {"page_number": 3, "text_content": "cached text"}})
+    conn = MagicMock()
+    refs = []
+
+    text, _meta = llm._dispatch_pageindex_tool(
+        conn=conn,
+        name="get_page_content",
+        args={"material_id": 42, "pages": "3"},
+        course_id=1,
+        grounding_refs=refs,
+        on_event=None,
+        page_cache=cache,
+    )
+
+    assert "cached text" in text
+    assert refs == ["material:42"]
+    conn.cursor.assert_not_called()
+    assert cache.trace["hits"] == 1
+
+
+def test_start_page_prefetch_is_disabled_by_default(monkeypatch):
+    import llm
+
+    monkeypatch.delenv("PAGEINDEX_PREFETCH_PAGES", raising=False)
+    assert llm._start_page_prefetch(7, None, "bellman equation") is None
+
+
+def test_start_page_prefetch_scores_loaded_materials_without_reloading(monkeypatch):
+    from contextlib import contextmanager
+    import llm
+    import pageindex_retrieval
+
+    materials = [{"material_id": 3, "sections": [
+        {"start_page": 2, "end_page": 2, "summary": "Bellman equation", "keywords": []},
+    ]}]
+    requested = []
+
+    @contextmanager
+    def fake_conn():
+        yield object()
+
+    def fail_sections(*args):
+        raise AssertionError("sections re-queried")
+
+    def fake_page_contents(conn, locations):
+        requested.extend(locations)
+        return {}
+
+    monkeypatch.setenv("PAGEINDEX_PREFETCH_PAGES", "4")
+    monkeypatch.setattr(llm, "_checkout_tool_conn", fake_conn)
+    monkeypatch.setattr(pageindex_retrieval, "get_prefetch_sections", fail_sections)
+    monkeypatch.setattr(pageindex_retrieval, "get_page_contents", fake_page_contents)
+
+    cache = llm._start_page_prefetch(7, None, "bellman equation", materials)
+    cache._ready.wait(timeout=5)
+
+    assert requested == [(3, 2)]
+
+
+def test_planner_cached_tokens_are_reported_in_tool_trace(monkeypatch):
+    from unittest.mock import MagicMock
+    import llm
+
+    cache_keys = []
+
+    def fake_stream_call(api_key, model, messages, tools, on_event, prompt_cache_key=None, usage=None):
+        if usage is not None:
+            cache_keys.append(prompt_cache_key)
+            usage.update({"input_tokens": 5000, "cached_tokens": 4096})
+        return {"content": '{"reply": "answer"}'}, "stop"
+
+    monkeypatch.setattr(llm, "_pageindex_stream_call", fake_stream_call)
+    monkeypatch.setattr(llm, "_recall_prior_chat_images", lambda *a, **k: [])
+    monkeypatch.setattr(llm, "_load_routing_block", lambda *a: ("<course_materials/>", "miss"))
+
+    result = llm.run_agent_pageindex(
+        conn=MagicMock(),
+        user_message="hello",
+        model="gpt-4o",
+        api_key="sk-test",
+        chat_id=None,
+        course_id=7,
+        context_material_ids=[1],
+    )
+
+    trace = next(t for t in result[2] if t.get("phase") == "prompt_cache")
+    # Retrieval nudge makes a second planner call with the same prefix.
+    assert trace == {
+        "phase": "prompt_cache",
+        "provider": "openai",
+        "calls": 2,
+        "input_tokens": 10000,
+        "cached_tokens": 8192,
+    }
+    assert len(set(cache_keys)) == 1 and cache_keys[0].startswith("pageindex-")
+
+
+def test_load_routing_block_preroutes_large_courses(monkeypatch):
+    from unittest.mock import MagicMock, patch
+    import llm
+
+    materials = [
+        {"material_id": i, "title": f"Lecture {i}", "doc_type": "lecture", "page_count": 10,
+         "summary": f"Summary {i}", "tags": [],
+         "sections": [{"start_page": 1, "end_page": 1, "summary": f"section {i}", "keywords": []}]}
+        for i in range(1, 6)
+    ]
+    materials[3]["title"] = "Gradient descent"
+    monkeypatch.setenv("PAGEINDEX_PREROUTE_THRESHOLD", "3")
+    monkeypatch.setenv("PAGEINDEX_PREROUTE_TOP_K", "2")
+    monkeypatch.setattr(llm, "_ROUTING_LEXICAL_CACHE", llm.OrderedDict())
+    entry = {"version": "5:v1", "material_count": 5, "routing_block": "<stale full block>"}
+    trace = {}
+
+    with patch("pageindex_retrieval.get_routing_index_cache_entry", return_value=entry), \
+         patch("pageindex_retrieval.get_course_routing_index", return_value=materials) as load:
+        block, tier = llm._load_routing_block(MagicMock(), 7, None, "explain gradient descent", trace)
+        again, _ = llm._load_routing_block(MagicMock(), 7, None, "what is in lecture 5", {})
+
+    assert tier == "preroute"
+    assert "<stale full block>" not in block
+    assert block.index("[4] Gradient descent") < block.index("[1] Lecture 1")
+    assert "section 4" in block and "section 2" not in block
+    assert "[5] Lecture 5 | lecture | 10p | tags: none" in block
+    assert trace["preroute"] == {"materials": 5, "detailed": 2, "detailed_material_ids": [4, 1]}
+    # The inverted index is reused for the next query at the same version.
+    assert load.call_count == 1
+    assert "section 5" in again
+
+
+def test_load_routing_block_keeps_full_block_below_preroute_threshold(monkeypatch):
+    from unittest.mock import MagicMock, patch
+    import llm
+
+    monkeypatch.setenv("PAGEINDEX_PREROUTE_THRESHOLD", "3")
+    monkeypatch.setattr(llm, "_ROUTING_BLOCK_CACHE", llm.OrderedDict())
+    entry = {"version": "2:v1", "material_count": 2, "routing_block": "<shared block>"}
+
+    with patch("pageindex_retrieval.get_routing_index_cache_entry", return_value=entry):
+        block, tier = llm._load_routing_block(MagicMock(), 7, None, "anything", {})
+
+    assert (block, tier) == ("<shared block>", "shared")
@@ -48,8 +48,8 @@ def test_get_course_routing_index_formats_output():
             "page_count": 30,
             "material_summary": "Covers backprop.",
             "metadata_tags": ["backpropagation"],
-            "nodes": [
-                {"start_page": 1, "end_page": 2, "summary": "Chain rule"},
+            "sections": [
+                {"start_page": 1, "end_page": 2, "summary": "Chain\nrule ", "keywords": ["chain rule"]},
             ],
         }
     ]
@@ -62,6 +62,10 @@ def test_get_course_routing_index_formats_output():
     assert section["start_page"] == 1
     assert section["end_page"] == 2
     assert section["summary"] == "Chain rule"
+    assert section["keywords"] == ["chain rule"]
+    sql = cursor.execute.call_args[0][0]
+    assert "material_sections" in sql
+    assert "index_json" not in sql
 
 
 def test_get_material_relations_returns_formatted_list():
@@ -104,52 +108,155 @@ def test_get_page_content_returns_token_count():
     assert rows[0]["token_count"] == 7
 
 
-def test_extract_page_summaries_recurses_into_nested_nodes():
-    from pageindex_retrieval import _extract_page_summaries
+def test_get_page_section_summaries_prefers_deepest_section():
+    from pageindex_retrieval import get_page_section_summaries
 
-    nodes = [
-        {
-            "start_page": 1,
-            "end_page": 10,
-            "summary": "Whole lecture",
-            "nodes": [
-                {"start_page": 3, "end_page": 4, "summary": "Bellman backup", "nodes": []},
-            ],
-        },
+    conn = MagicMock()
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [
+        {"material_id": 742, "page": 1, "material_title": "Lecture 4",
+         "start_page": 1, "end_page": 10, "summary": "Whole lecture", "token_count": 50},
+        {"material_id": 742, "page": 3, "material_title": "Lecture 4",
+         "start_page": 3, "end_page": 4, "summary": "Bellman backup", "token_count": 12},
     ]
-    sections = _extract_page_summaries(nodes)
-    summaries = [s["summary"] for s in sections]
-    assert "Whole lecture" in summaries
-    assert "Bellman backup" in summaries
+    conn.cursor.return_value = cursor
 
+    summaries = get_page_section_summaries(conn, [(742, 1), (742, 3), (742, 99)])
 
-def test_get_page_section_summaries_prefers_deepest_section():
+    assert summaries[(742, 3)]["summary"] == "Bellman backup"
+    assert summaries[(742, 1)]["summary"] == "Whole lecture"
+    assert (742, 99) not in summaries
+    sql, params = cursor.execute.call_args[0]
+    # The narrowest covering section is picked in SQL, one row per location.
+    assert "DISTINCT ON" in sql
+    assert "ms.end_page - ms.start_page" in sql
+    assert params == ([742, 742, 742], [1, 3, 99])
+
+
+def test_get_page_section_summaries_skips_query_without_locations():
     from pageindex_retrieval import get_page_section_summaries
 
+    conn = MagicMock()
+    assert get_page_section_summaries(conn, []) == {}
+    conn.cursor.assert_not_called()
+
+
+def test_get_page_contents_keys_rows_by_location():
+    from pageindex_retrieval import get_page_contents
+
     conn = MagicMock()
     cursor = MagicMock()
     cursor.fetchall.return_value = [
+        {"material_id": 742, "page_number": 3, "text_content": "Bellman", "has_images": False, "token_count": 9},
+        {"material_id": 801, "page_number": 1, "text_content": "Intro", "has_images": True, "token_count": 4},
+    ]
+    conn.cursor.return_value = cursor
+
+    rows = get_page_contents(conn, [(742, 3), (801, 1)])
+
+    assert cursor.execute.call_count == 1
+    assert cursor.execute.call_args[0][1] == ([742, 801], [3, 1])
+    assert rows[(742, 3)]["text_content"] == "Bellman"
+    assert rows[(801, 1)]["token_count"] == 4
+
+
+def test_get_page_contents_skips_query_for_empty_frontier():
+    from pageindex_retrieval import get_page_contents
+
+    conn = MagicMock()
+    assert get_page_contents(conn, []) == {}
+    conn.cursor.assert_not_called()
+
+
+def test_routing_index_scope_key_ignores_order_and_duplicates():
+    from pageindex_retrieval import routing_index_scope_key
+
+    assert routing_index_scope_key(None) == "all"
+    assert routing_index_scope_key([3, 1, 3]) == routing_index_scope_key([1, 3])
+    assert routing_index_scope_key([1, 3]) != routing_index_scope_key([1, 4])
+
+
+def test_get_routing_index_cache_entry_returns_version_and_block():
+    from pageindex_retrieval import get_routing_index_cache_entry
+
+    conn = MagicMock()
+    cursor = MagicMock()
+    cursor.fetchone.return_value = {
+        "version": "2:2026-06-01 10:00:00", "material_count": 2, "routing_block": None,
+    }
+    conn.cursor.return_value = cursor
+
+    entry = get_routing_index_cache_entry(conn, 7, [10, 11])
+
+    assert entry == {"version": "2:2026-06-01 10:00:00", "material_count": 2, "routing_block": None}
+    assert cursor.execute.call_count == 1
+
+
+def test_get_prefetch_sections_reads_only_matching_sections():
+    from pageindex_retrieval import get_prefetch_sections
+
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [
+        {"material_id": 1, "start_page": 7, "end_page": 8, "summary": "Value iteration", "keywords": ["bellman"]},
+        {"material_id": 1, "start_page": 1, "end_page": 20, "summary": "MDP overview", "keywords": []},
+    ]
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+
+    materials = get_prefetch_sections(conn, 9, [1, 2], "What is the Bellman equation?")
+
+    sql, params = cursor.execute.call_args[0]
+    assert "material_sections" in sql and "jsonb_agg" not in sql and "LIMIT" in sql
+    assert params[:2] == (9, [1, 2])
+    assert params[2] == r"\m(bellman|equation)\M"
+    assert [m["material_id"] for m in materials] == [1]
+    assert [s["start_page"] for s in materials[0]["sections"]] == [7, 1]
+    assert get_prefetch_sections(conn, 9, None, "the and what") == []
+    assert cursor.execute.call_count == 1
+
+
+def test_rank_prefetch_pages_prefers_keyword_hits_and_narrow_sections():
+    from pageindex_retrieval import rank_prefetch_pages
+
+    materials = [
         {
-            "material_id": 742,
-            "material_title": "Lecture 4",
-            "nodes": [
-                {
-                    "start_page": 1,
-                    "end_page": 10,
-                    "summary": "Whole lecture",
-                    "nodes": [
-                        {"start_page": 3, "end_page": 4, "summary": "Bellman backup", "nodes": []},
-                    ],
-                },
+            "material_id": 1,
+            "sections": [
+                {"start_page": 1, "end_page": 20, "summary": "Markov decision processes overview", "keywords": []},
+                {"start_page": 7, "end_page": 8, "summary": "Value iteration", "keywords": ["bellman equation"]},
+                {"start_page": 30, "end_page": 31, "summary": "Unrelated logistics", "keywords": ["grading"]},
             ],
-        }
+        },
+        {
+            "material_id": 2,
+            "sections": [
+                {"start_page": 4, "end_page": 4, "summary": "Worked Bellman example", "keywords": []},
+            ],
+        },
     ]
-    conn.cursor.return_value = cursor
 
-    summaries = get_page_section_summaries(conn, [742])
+    pages = rank_prefetch_pages(materials, "How does the Bellman equation relate to Markov decision processes?", 5)
 
-    # Pages inside the nested section get its tighter summary...
-    assert summaries[(742, 3)]["summary"] == "Bellman backup"
-    assert summaries[(742, 4)]["summary"] == "Bellman backup"
-    # ...while other pages keep the parent's.
-    assert summaries[(742, 1)]["summary"] == "Whole lecture"
+    # Keyword hits (x2) rank first; the 20-page chapter contributes only two pages.
+    assert pages == [(1, 7), (1, 8), (1, 1), (1, 2), (2, 4)]
+    assert rank_prefetch_pages(materials, "the and what", 5) == []
+    assert rank_prefetch_pages(materials, "bellman", 0) == []
+
+
+def test_rank_routing_materials_weights_titles_and_keywords_over_summaries():
+    from pageindex_retrieval import build_routing_lexical_index, rank_routing_materials
+
+    materials = [
+        {"material_id": 1, "title": "Syllabus", "tags": [], "summary": "Course policies", "sections": []},
+        {"material_id": 2, "title": "Lecture 3", "tags": ["probability"],
+         "summary": "Mentions dropout once", "sections": []},
+        {"material_id": 3, "title": "Dropout regularization", "tags": [], "summary": "", "sections": []},
+        {"material_id": 4, "title": "Lecture 9", "tags": [], "summary": "",
+         "sections": [{"keywords": ["dropout", "batch norm"]}]},
+    ]
+    index = build_routing_lexical_index(materials)
+
+    ranked = rank_routing_materials(index, len(materials), "How does dropout work?")
+
+    # Title beats section keywords beats summary; non-matches keep their order.
+    assert [materials[p]["material_id"] for p in ranked] == [3, 4, 2, 1]
@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import provider_http
+
+
+def test_get_session_is_shared_and_retries_rate_limits(monkeypatch):
+    monkeypatch.setattr(provider_http, "_SESSION", None)
+    monkeypatch.setenv("PROVIDER_HTTP_RETRIES", "3")
+
+    session = provider_http.get_session()
+    assert provider_http.get_session() is session
+
+    adapter = session.get_adapter("https://api.anthropic.com/v1/messages")
+    retry = adapter.max_retries
+    assert retry.total == 3
+    assert 429 in retry.status_forcelist and 503 in retry.status_forcelist
+    assert "POST" in retry.allowed_methods
+    assert retry.raise_on_status is False  # final 429 still reaches raise_for_status()
+    assert retry.read == 0  # never replay a request after its response started streaming
+
+
+def test_post_goes_through_the_pooled_session(monkeypatch):
+    calls = []
+
+    class _FakeSession:
+        def post(self, url, **kwargs):
+            calls.append((url, kwargs))
+            return "resp"
+
+    monkeypatch.setattr(provider_http, "_SESSION", _FakeSession())
+    assert provider_http.post("https://api.openai.com/v1/responses", json={"a": 1}, timeout=5) == "resp"
+    assert calls == [("https://api.openai.com/v1/responses", {"json": {"a": 1}, "timeout": 5})]
@@ -0,0 +1,137 @@
+import sys
+import time
+import types
+from contextlib import contextmanager
+
+import api.middleware as middleware
+
+
+class _Cursor:
+    def __init__(self, log, shared):
+        self.log = log
+        self.shared = shared
+        self.row = None
+
+    def execute(self, sql, params=None):
+        self.log.append((sql, params))
+        if "rate_limit_buckets AS b" in sql:
+            key, capacity, cost = params[0], params[1], params[2]
+            self.shared[key] = min(capacity, self.shared.get(key, capacity)) - cost
+            self.row = {"tokens": self.shared[key]}
+        elif "UPDATE rate_limit_buckets" in sql:
+            capacity, keys = params
+            for key in keys:
+                self.shared[key] = min(capacity, self.shared[key] + 1)
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+def _install_db(monkeypatch, fail=False):
+    log, shared, timeouts = [], {}, []
+
+    @contextmanager
+    def get_db(timeout=None):
+        timeouts.append(timeout)
+        if fail:
+            raise RuntimeError("database unavailable")
+        yield types.SimpleNamespace(cursor=lambda: _Cursor(log, shared))
+
+    monkeypatch.setitem(sys.modules, "api.db", types.SimpleNamespace(get_db=get_db, timeouts=timeouts))
+    return log, shared
+
+
+def _setup(monkeypatch):
+    middleware._rate_buckets.clear()
+    # Frozen clock: no refill between calls.
+    monkeypatch.setattr(middleware, "time", types.SimpleNamespace(monotonic=lambda: 100.0, time=time.time))
+
+
+def _handler(ip="203.0.113.7"):
+    return types.SimpleNamespace(headers={"X-Forwarded-For": f"{ip}, 10.0.0.1"}, client_address=None)
+
+
+def test_cheap_reads_sync_to_postgres_in_batches(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setenv("RATE_LIMIT_READ_RPM", "120")
+    monkeypatch.setenv("RATE_LIMIT_SYNC_BATCH", "10")
+    log, shared = _install_db(monkeypatch)
+
+    assert all(middleware.check_rate_limit(_handler(), bucket="read") for _ in range(11))
+
+    # First sight of the key syncs; the next nine are charged locally and
+    # flushed together with the eleventh request.
+    assert [params[2] for _sql, params in log] == [1, 10]
+    assert shared == {"read:ip:203.0.113.7": 109}
+
+
+def test_expensive_bucket_refuses_locally_once_empty(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setenv("RATE_LIMIT_EXPENSIVE_RPM", "2")
+    log, shared = _install_db(monkeypatch)
+    handler = _handler()
+
+    results = [middleware.check_rate_limit(handler, bucket="expensive", user_id=5) for _ in range(3)]
+
+    assert results == [True, True, False]
+    # Two syncs of both keys; the refusal costs no query.
+    assert len(log) == 4
+    assert shared == {"expensive:ip:203.0.113.7": 0, "expensive:user:5": 0}
+    # Other classes keep their own buckets.
+    assert middleware.check_rate_limit(handler, bucket="default", user_id=5)
+
+
+def test_shared_bucket_limits_across_instances(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setenv("RATE_LIMIT_EXPENSIVE_RPM", "2")
+    _log, shared = _install_db(monkeypatch)
+    # Another instance already spent this user's budget.
+    shared["expensive:user:5"] = 0
+
+    assert middleware.check_rate_limit(_handler(), bucket="expensive", user_id=5) is False
+    assert middleware.check_rate_limit(_handler("198.51.100.1"), bucket="expensive", user_id=5) is False
+
+
+def test_refused_user_does_not_drain_ip_bucket(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setenv("RATE_LIMIT_EXPENSIVE_RPM", "2")
+    _log, shared = _install_db(monkeypatch)
+    shared["expensive:user:5"] = 0
+    handler = _handler()
+
+    # Refused in Postgres, then locally: neither charge sticks to the IP.
+    assert middleware.check_rate_limit(handler, bucket="expensive", user_id=5) is False
+    assert middleware.check_rate_limit(handler, bucket="expensive", user_id=5) is False
+    assert shared == {"expensive:ip:203.0.113.7": 2, "expensive:user:5": 0}
+    assert middleware._rate_buckets["expensive:ip:203.0.113.7"]["tokens"] == 2
+
+    # Another user behind the same IP keeps the full burst.
+    results = [middleware.check_rate_limit(handler, bucket="expensive", user_id=6) for _ in range(3)]
+    assert results == [True, True, False]
+
+
+def test_local_estimate_decides_when_postgres_is_unreachable(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setenv("RATE_LIMIT_EXPENSIVE_RPM", "2")
+    _install_db(monkeypatch, fail=True)
+
+    results = [middleware.check_rate_limit(_handler(), bucket="expensive") for _ in range(3)]
+
+    assert results == [True, True, False]
+    assert middleware._rate_buckets["expensive:ip:203.0.113.7"]["pending"] == 2
+    # Syncs wait only briefly for a pooled connection.
+    assert sys.modules["api.db"].timeouts == [middleware._RATE_LIMIT_DB_TIMEOUT_SECONDS] * 2
+
+
+def test_local_bucket_state_is_bounded(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setattr(middleware, "_RATE_LIMIT_MAX_KEYS", 3)
+    _install_db(monkeypatch)
+
+    for i in range(5):
+        middleware.check_rate_limit(_handler(f"192.0.2.{i}"))
+
+    assert list(middleware._rate_buckets) == [f"default:ip:192.0.2.{i}" for i in (2, 3, 4)]
@@ -0,0 +1,82 @@
+import sys
+import types
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import api.middleware as middleware
+
+
+class _Cursor:
+    def __init__(self, log, rows):
+        self.log = log
+        self.rows = rows
+
+    def execute(self, sql, params):
+        self.log.append((sql, params))
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def close(self):
+        pass
+
+
+def _install_db(monkeypatch, rows):
+    log = []
+
+    @contextmanager
+    def get_db():
+        yield types.SimpleNamespace(cursor=lambda: _Cursor(log, rows))
+
+    monkeypatch.setitem(sys.modules, "api.db", types.SimpleNamespace(get_db=get_db))
+    return log
+
+
+def _handler(token):
+    return types.SimpleNamespace(headers={"Cookie": f"cm_session={token}"})
+
+
+def test_load_request_context_fuses_session_user_and_course_access(monkeypatch):
+    monkeypatch.delenv("DEV_BYPASS_AUTH", raising=False)
+    monkeypatch.setenv("AUTH_SESSION_CACHE_SECONDS", "30")
+    middleware._session_cache.clear()
+    expires = datetime.now(timezone.utc) + timedelta(hours=1)
+    log = _install_db(monkeypatch, [
+        {"id": 7, "google_id": "g-1", "email": "a@b.c", "_session_google_id": "g-1",
+         "_session_expires_at": expires, "_course_access": True},
+        {"_course_access": False},
+    ])
+
+    context = middleware.load_request_context(_handler("tok"), course_id=3)
+
+    assert context == {
+        "google_id": "g-1",
+        "session_token": "tok",
+        "user": {"id": 7, "google_id": "g-1", "email": "a@b.c"},
+        "course_access": True,
+    }
+    assert len(log) == 1 and "JOIN users" in log[0][0] and log[0][1] == (3, "tok")
+
+    # Warm hit: no session query; a different course costs one access probe.
+    assert middleware.authenticate_request(_handler("tok")) == ("g-1", "tok")
+    assert middleware.load_request_context(_handler("tok"), course_id=4)["course_access"] is False
+    assert len(log) == 2 and log[1][1] == (4, 7)
+
+
+def test_revocation_evicts_cached_session(monkeypatch):
+    monkeypatch.delenv("DEV_BYPASS_AUTH", raising=False)
+    middleware._session_cache.clear()
+    expires = datetime.now(timezone.utc) + timedelta(hours=1)
+    log = _install_db(monkeypatch, [
+        {"id": 7, "google_id": "g-1", "_session_google_id": "g-1", "_session_expires_at": expires},
+    ])
+
+    assert middleware.load_request_context(_handler("tok"))["user"]["id"] == 7
+    middleware.forget_session(session_token="tok")
+    assert middleware.load_request_context(_handler("tok")) is None
+    assert len(log) == 2
+
+    middleware._cache_session("a", "g-2", None)
+    middleware._cache_session("b", "g-2", None)
+    middleware.forget_session(google_id="g-2")
+    assert middleware._session_cache == {}